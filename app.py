@@ -5,9 +5,13 @@ This module provides the application factory pattern for creating Flask app inst
 Routes are organized in separate blueprint modules in the routes package.
 """
 
+import click
 from flask import Flask
-from database import init_database, add_sample_data
+from database import (init_database, add_sample_data, begin_connection_scope, end_connection_scope,
+                      reconcile_patron_loan_counts)
+from migrations import run_migrations
 from routes import register_blueprints
+from services import library_service, payment_outbox
 
 
 def create_app():
@@ -23,12 +27,50 @@ def create_app():
     # Initialize the database
     init_database()
     
+    # Bring the schema up to date (indexes, new columns)
+    run_migrations()
+    
     # Add sample data for testing and demonstration
     add_sample_data()
     
+    # Load the in-process search index once if it is the configured backend
+    if library_service.SEARCH_MODE == 'trigram':
+        library_service.build_search_index()
+    
+    # Reuse one pooled database connection for the whole request
+    app.before_request(begin_connection_scope)
+    app.teardown_request(end_connection_scope)
+    
     # Register all route blueprints
     register_blueprints(app)
     
+    # Gateway used to drain the payment outbox
+    if payment_outbox.PAYMENT_GATEWAY_CLASS:
+        app.config['PAYMENT_GATEWAY'] = payment_outbox.load_gateway(payment_outbox.PAYMENT_GATEWAY_CLASS)
+    if payment_outbox.OUTBOX_WORKER_MODE == 'thread' and app.config.get('PAYMENT_GATEWAY'):
+        app.extensions['payment_outbox'] = payment_outbox.OutboxWorker(app.config['PAYMENT_GATEWAY']).start()
+    # Only queue payments that some worker will charge
+    app.config['PAYMENT_OUTBOX_DRAINED'] = bool(
+        app.config.get('PAYMENT_GATEWAY') and payment_outbox.OUTBOX_WORKER_MODE in payment_outbox.WORKER_MODES)
+    
+    @app.cli.command('reconcile-loan-counts')
+    def reconcile_loan_counts_command():
+        """Rebuild per-patron open-loan counters from borrow_records."""
+        result = reconcile_patron_loan_counts()
+        click.echo(f"Checked {result['patrons']} patrons, corrected {result['corrected']} counters")
+    
+    @app.cli.command('payment-worker')
+    def payment_worker_command():
+        """Drain the payment outbox through the configured gateway until interrupted."""
+        gateway = app.config.get('PAYMENT_GATEWAY')
+        if gateway is None:
+            raise click.ClickException('Set LIBRARY_PAYMENT_GATEWAY to the gateway class to use')
+        click.echo('Draining the payment outbox (Ctrl+C to stop)')
+        try:
+            payment_outbox.OutboxWorker(gateway).run()
+        except KeyboardInterrupt:
+            pass
+    
     return app
 
 
@@ -0,0 +1,86 @@
+"""
+Connection Pool Benchmark - measures the connect overhead saved by pooling
+
+Runs the same mix of lookups from several threads with pooling on and off
+against a scratch database and reports throughput for each mode.
+
+Usage:
+    python -m benchmarks.connection_pool [--threads 8] [--calls 2000]
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+from typing import Dict
+
+import database
+from migrations import run_migrations
+
+
+def _run(threads: int, calls: int) -> float:
+    """Run ``calls`` lookups on each of ``threads`` threads; return elapsed seconds."""
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        barrier.wait()
+        for i in range(calls):
+            database.get_book_by_id(i % 3 + 1)
+            database.get_patron_borrow_count('123456')
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in workers:
+        t.join()
+    return time.perf_counter() - start
+
+
+def benchmark(threads: int = 8, calls: int = 2000) -> Dict:
+    """Compare pooled and unpooled connections under concurrent load."""
+    original_db, original_enabled = database.DATABASE, database.POOL_ENABLED
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DATABASE = os.path.join(tmp, 'bench.db')
+        try:
+            database.init_database()
+            run_migrations()
+            database.add_sample_data()
+            results = {}
+            for enabled in (False, True):
+                database.POOL_ENABLED = enabled
+                database.close_pool()
+                elapsed = _run(threads, calls)
+                queries = threads * calls * 2
+                results['pooled' if enabled else 'unpooled'] = {
+                    'seconds': round(elapsed, 4),
+                    'queries_per_sec': round(queries / elapsed, 1),
+                    'us_per_query': round(elapsed / queries * 1e6, 2),
+                }
+            results['pool_stats'] = database.get_pool_stats()
+            saved = results['unpooled']['us_per_query'] - results['pooled']['us_per_query']
+            results['connect_overhead_saved_us'] = round(saved, 2)
+        finally:
+            database.close_pool()
+            database.DATABASE, database.POOL_ENABLED = original_db, original_enabled
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--calls', type=int, default=2000)
+    args = parser.parse_args()
+
+    results = benchmark(args.threads, args.calls)
+    for mode in ('unpooled', 'pooled'):
+        r = results[mode]
+        print(f"{mode:>9}: {r['seconds']:.3f}s  {r['queries_per_sec']:>10.1f} q/s  {r['us_per_query']:.2f} us/query")
+    print(f"connect overhead saved: {results['connect_overhead_saved_us']:.2f} us/query")
+    print(f"pool stats: {results['pool_stats']}")
+
+
+if __name__ == '__main__':
+    main()
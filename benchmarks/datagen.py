@@ -0,0 +1,154 @@
+"""
+Data Generator - deterministic synthetic library databases by scale factor
+
+A scale factor of N generates N books, N loans and N / 10 patrons (capped at
+the 900,000 six-digit card numbers available). The same scale and seed always
+produce the same catalog and loan history; loan dates are placed relative to
+the generation time, so the share of open and overdue loans stays the same.
+
+Usage:
+    python -m benchmarks.datagen library_100k.db --scale 100k [--seed 327]
+"""
+
+import argparse
+import os
+import random
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+import database
+from migrations import run_migrations
+
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000, '10m': 10_000_000}
+
+MAX_PATRONS = 900_000
+MAX_OPEN_LOANS_PER_PATRON = 5
+OPEN_LOAN_SHARE = 0.1
+
+_ADJECTIVES = ('Silent', 'Crimson', 'Hidden', 'Last', 'Broken', 'Golden', 'Distant', 'Wild', 'Quiet', 'Frozen',
+               'Burning', 'Secret', 'Endless', 'Forgotten', 'Little', 'Dark', 'Bright', 'Lonely', 'Ancient', 'Open')
+_NOUNS = ('River', 'Garden', 'Empire', 'Ocean', 'Mountain', 'Kingdom', 'Library', 'Winter', 'City', 'Road',
+          'Harbor', 'Forest', 'Island', 'Machine', 'Letter', 'Orchard', 'Station', 'Tower', 'Voyage', 'Window')
+_FIRST_NAMES = ('Ada', 'Ben', 'Chloe', 'David', 'Elena', 'Farid', 'Grace', 'Hiro', 'Ines', 'Jonas',
+                'Kofi', 'Lena', 'Mateo', 'Nadia', 'Omar', 'Priya', 'Quinn', 'Rosa', 'Sven', 'Tara')
+_LAST_NAMES = ('Abbott', 'Brennan', 'Castillo', 'Dubois', 'Eriksen', 'Fischer', 'Garcia', 'Haddad', 'Ito', 'Jensen',
+               'Kowalski', 'Larsen', 'Moreau', 'Novak', 'Okafor', 'Petrov', 'Quist', 'Rossi', 'Sato', 'Tanaka')
+
+
+def parse_scale(text: str) -> int:
+    """Read a scale factor given as a name from SCALES or a plain number."""
+    scale = SCALES.get(text.lower())
+    if scale is None:
+        try:
+            scale = int(text.replace('_', ''))
+        except ValueError:
+            raise ValueError(f'Unknown scale: {text} (use one of {", ".join(SCALES)} or a number)')
+    if scale <= 0:
+        raise ValueError('Scale must be positive')
+    return scale
+
+
+def patron_id(index: int) -> str:
+    return f'{100000 + index:06d}'
+
+
+def dataset_path(directory: str, scale_name: str, seed: int) -> str:
+    """Where the benchmarks keep the generated database for a scale and seed."""
+    return os.path.join(directory, f'library_{scale_name}_seed{seed}.db')
+
+
+def generate(path: str, scale: int, seed: int = 327, as_of: Optional[datetime] = None,
+             batch_size: int = 50000) -> Dict:
+    """
+    Create a migrated database at ``path`` holding ``scale`` books and loans.
+
+    About 10% of loans are open (never more than a book's copies or five per
+    patron); the rest were returned, some of them late.
+
+    Returns:
+        dict: Row counts ('books', 'patrons', 'loans', 'open_loans',
+        'overdue_loans') and the generation time in 'seconds'
+    """
+    if os.path.exists(path):
+        raise FileExistsError(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    now = database.to_epoch_seconds(as_of or datetime.now())
+    day = 86400
+    patrons = max(1, min(scale // 10, MAX_PATRONS))
+
+    original_db = database.DATABASE
+    database.DATABASE = path
+    database.close_pool()
+    try:
+        database.init_database()
+        run_migrations()
+        conn = database.get_db_connection()
+        conn.execute('PRAGMA synchronous = OFF')
+
+        copies = [rng.randint(1, 5) for _ in range(scale)]
+        for first in range(0, scale, batch_size):
+            conn.executemany(
+                'INSERT INTO books (id, title, author, isbn, total_copies, available_copies) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(i + 1,
+                  f'{rng.choice(_ADJECTIVES)} {rng.choice(_NOUNS)} of the {rng.choice(_NOUNS)}',
+                  f'{rng.choice(_FIRST_NAMES)} {rng.choice(_LAST_NAMES)}',
+                  f'{9780000000000 + i}', copies[i], copies[i])
+                 for i in range(first, min(first + batch_size, scale))])
+            conn.commit()
+
+        open_by_book = [0] * scale
+        open_by_patron = [0] * patrons
+        open_loans = overdue = 0
+        for first in range(0, scale, batch_size):
+            rows = []
+            for _ in range(first, min(first + batch_size, scale)):
+                book = rng.randrange(scale)
+                patron = rng.randrange(patrons)
+                is_open = (rng.random() < OPEN_LOAN_SHARE and open_by_book[book] < copies[book]
+                           and open_by_patron[patron] < MAX_OPEN_LOANS_PER_PATRON)
+                if is_open:
+                    # Open loans were borrowed in the last six weeks, so two thirds are overdue
+                    borrowed = now - rng.randrange(42 * day)
+                    returned = None
+                    open_by_book[book] += 1
+                    open_by_patron[patron] += 1
+                    open_loans += 1
+                    overdue += borrowed + 14 * day < now
+                else:
+                    borrowed = now - rng.randrange(42 * day, 730 * day)
+                    returned = borrowed + rng.randrange(day, 21 * day)
+                rows.append((patron_id(patron), book + 1, borrowed, borrowed + 14 * day, returned))
+            conn.executemany('INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date, return_date) '
+                             'VALUES (?, ?, ?, ?, ?)', rows)
+            conn.commit()
+
+        conn.executemany('UPDATE books SET available_copies = available_copies - ? WHERE id = ?',
+                         [(count, i + 1) for i, count in enumerate(open_by_book) if count])
+        conn.commit()
+        conn.execute('PRAGMA optimize')
+        conn.close()
+    finally:
+        database.close_pool()
+        database.DATABASE = original_db
+
+    return {'books': scale, 'patrons': patrons, 'loans': scale, 'open_loans': open_loans,
+            'overdue_loans': overdue, 'seconds': round(time.perf_counter() - start, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('path', help='database file to create')
+    parser.add_argument('--scale', default='10k', help=f'{", ".join(SCALES)} or a number of books')
+    parser.add_argument('--seed', type=int, default=327)
+    args = parser.parse_args()
+
+    counts = generate(args.path, parse_scale(args.scale), args.seed)
+    print(', '.join(f'{name} {value}' for name, value in counts.items()))
+
+
+if __name__ == '__main__':
+    main()
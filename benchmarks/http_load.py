@@ -0,0 +1,362 @@
+"""
+HTTP Load Benchmark - end-to-end throughput and latency per route under a read/write mix
+
+Serves create_app() (every blueprint: catalog, borrowing, search and api)
+from a separate process against a copy of a benchmarks.datagen database,
+then drives it from many concurrent HTTP clients with a weighted mix of
+read and write requests. Each configuration (pooling and caching on or off,
+set through the same LIBRARY_* environment variables as production) starts
+from the same data; per-route throughput and p50/p95/p99 latency are printed
+side by side and written as JSON.
+
+Usage:
+    python -m benchmarks.http_load [--scale 10k] [--clients 16] [--duration 10] [--write-ratio 0.2]
+                                   [--configs default no-pool no-cache] [--mix borrow=0 overdue_report=1]
+                                   [--env LIBRARY_SEARCH_MODE=fts] [--data-dir DIR] [--output results.json]
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+from benchmarks import datagen
+from benchmarks.timing import environment, summarize
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Environment of the server process for each configuration. 'cache' covers the
+# book lookup cache, the search result cache and clients revalidating with ETags.
+CONFIGURATIONS = {
+    'default': {'pool': True, 'cache': True},
+    'no-pool': {'pool': False, 'cache': True},
+    'no-cache': {'pool': True, 'cache': False},
+    'no-pool-no-cache': {'pool': False, 'cache': False},
+}
+
+# Seconds to wait for the server process to accept connections
+STARTUP_TIMEOUT = 60
+
+# (method, path, body, headers) of one request
+Request = Tuple[str, str, Optional[bytes], Dict[str, str]]
+
+
+def _form(path: str, fields: Dict) -> Request:
+    return 'POST', path, urlencode(fields).encode(), {'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+def _json(path: str, payload) -> Request:
+    return 'POST', path, json.dumps(payload).encode(), {'Content-Type': 'application/json'}
+
+
+def _loan(rng: random.Random, inputs: Dict) -> Tuple[str, int]:
+    """A loan to return: one this run borrowed, else one that was open in the generated data."""
+    try:
+        return inputs['borrowed'].popleft()
+    except IndexError:
+        return rng.choice(inputs['open_loans'])
+
+
+def _borrow(rng: random.Random, inputs: Dict) -> Request:
+    loan = (rng.choice(inputs['patrons']), rng.choice(inputs['books']))
+    inputs['borrowed'].append(loan)
+    return _form('/borrow', {'patron_id': loan[0], 'book_id': loan[1]})
+
+
+def _add_book(rng: random.Random, inputs: Dict) -> Request:
+    serial = next(inputs['serial'])
+    return _form('/add_book', {'title': f'Load Test {serial}', 'author': 'Load Tester',
+                               'isbn': f'{9970000000000 + serial}', 'total_copies': 2})
+
+
+def _borrow_batch(rng: random.Random, inputs: Dict) -> Request:
+    patron_id = rng.choice(inputs['patrons'])
+    loans = [(patron_id, book_id) for book_id in rng.sample(inputs['books'], 3)]
+    inputs['borrowed'].extend(loans)
+    return _json('/api/borrow/batch', {'operations': [list(loan) for loan in loans]})
+
+
+# name: (kind, default weight within its kind, request builder)
+ROUTES: Dict[str, Tuple[str, float, Callable[[random.Random, Dict], Request]]] = {
+    'catalog': ('read', 3, lambda rng, inputs: ('GET', '/catalog', None, {})),
+    'search': ('read', 2, lambda rng, inputs: (
+        'GET', f"/search?{urlencode({'q': rng.choice(inputs['words']), 'type': 'title'})}", None, {})),
+    'api_search': ('read', 3, lambda rng, inputs: (
+        'GET', f"/api/search?{urlencode({'q': rng.choice(inputs['authors']), 'type': 'author'})}", None, {})),
+    'late_fee': ('read', 3, lambda rng, inputs: (
+        'GET', '/api/late_fee/{}/{}'.format(*rng.choice(inputs['open_loans'])), None, {})),
+    'overdue_report': ('read', 0, lambda rng, inputs: ('GET', '/api/reports/overdue?min_days=30', None, {})),
+    'borrow': ('write', 4, _borrow),
+    'return': ('write', 4, lambda rng, inputs: _form('/return', dict(zip(('patron_id', 'book_id'),
+                                                                       _loan(rng, inputs))))),
+    'add_book': ('write', 1, _add_book),
+    'borrow_batch': ('write', 1, _borrow_batch),
+    'return_batch': ('write', 1, lambda rng, inputs: _json('/api/return/batch', {
+        'operations': [list(_loan(rng, inputs)) for _ in range(3)]})),
+}
+
+
+def route_weights(write_ratio: float, overrides: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+    """
+    Share of requests each route gets.
+
+    ``write_ratio`` of the traffic is split between write routes, and the
+    rest between read routes, in proportion to their weights; ``overrides``
+    replaces individual weights (0 leaves a route out).
+    """
+    if not 0 <= write_ratio <= 1:
+        raise ValueError('The write ratio must be between 0 and 1')
+    unknown = set(overrides or ()) - set(ROUTES)
+    if unknown:
+        raise ValueError(f"Unknown route: {', '.join(sorted(unknown))} (routes: {', '.join(ROUTES)})")
+    weights = {name: (overrides or {}).get(name, weight) for name, (_, weight, _) in ROUTES.items()}
+    shares = {}
+    for kind, share in (('read', 1 - write_ratio), ('write', write_ratio)):
+        total = sum(weights[name] for name, (k, _, _) in ROUTES.items() if k == kind)
+        if share > 0 and total <= 0:
+            raise ValueError(f'No {kind} routes left in the mix')
+        for name, (k, _, _) in ROUTES.items():
+            if k == kind and weights[name] > 0 and share > 0:
+                shares[name] = share * weights[name] / total
+    return shares
+
+
+def _inputs(path: str, rng: random.Random) -> Dict:
+    """Pick request inputs from the generated data before the server starts writing to it."""
+    conn = sqlite3.connect(path)
+    try:
+        books = [row[0] for row in conn.execute('SELECT id FROM books WHERE available_copies > 0 LIMIT 50000')]
+        patrons = [row[0] for row in conn.execute('SELECT patron_id FROM patrons WHERE open_loans < 5 LIMIT 50000')]
+        open_loans = conn.execute('SELECT patron_id, book_id FROM borrow_records '
+                                  'WHERE return_date IS NULL LIMIT 50000').fetchall()
+    finally:
+        conn.close()
+    return {
+        'books': books,
+        'patrons': patrons,
+        'open_loans': [tuple(loan) for loan in open_loans],
+        'words': [noun.lower() for noun in datagen._NOUNS],
+        'authors': list(datagen._LAST_NAMES),
+        'borrowed': deque(maxlen=10000),
+        'serial': itertools.count(rng.randrange(10 ** 6) * 1000),
+    }
+
+
+def _client(port: int, shares: Dict[str, float], inputs: Dict, revalidate: bool, deadline: float,
+            seed: int) -> Dict:
+    """Send requests until ``deadline``; return per-route latencies, status counts and errors."""
+    rng = random.Random(seed)
+    names, weights = list(shares), list(shares.values())
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    etags = {}
+    latencies, statuses, errors = defaultdict(list), defaultdict(Counter), Counter()
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        method, path, body, headers = ROUTES[name][2](rng, inputs)
+        if revalidate and method == 'GET' and path in etags:
+            headers = dict(headers, **{'If-None-Match': etags[path]})
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            errors[name] += 1
+            conn.close()
+            continue
+        latencies[name].append(time.perf_counter() - start)
+        statuses[name][str(response.status)] += 1
+        if revalidate and response.getheader('ETag'):
+            etags[path] = response.getheader('ETag')
+    conn.close()
+    return {'latencies': latencies, 'statuses': statuses, 'errors': errors}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _start_server(database_path: str, port: int, env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    """Start ``serve()`` in a child process and wait until it accepts connections."""
+    command = [sys.executable, '-m', 'benchmarks.http_load', '--serve', '--database', database_path,
+               '--port', str(port)]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [PROJECT_ROOT, os.environ.get('PYTHONPATH')])),
+               **env)
+    with open(log_path, 'w') as log:
+        server = subprocess.Popen(command, cwd=PROJECT_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            with open(log_path) as log:
+                raise RuntimeError(f'Server exited during startup:\n{log.read()[-2000:]}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f'Server did not start within {STARTUP_TIMEOUT} seconds')
+
+
+def _stop_server(server: subprocess.Popen):
+    server.terminate()
+    try:
+        server.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def run_configuration(source: str, settings: Dict, shares: Dict[str, float], clients: int, duration: float,
+                      seed: int, env: Optional[Dict[str, str]] = None) -> Dict:
+    """Serve a fresh copy of ``source`` with ``settings`` and load it for ``duration`` seconds."""
+    server_env = dict(env or {}, LIBRARY_DB_POOL='1' if settings['pool'] else '0')
+    if not settings['cache']:
+        server_env.update(LIBRARY_BOOK_CACHE_SIZE='0', LIBRARY_SEARCH_CACHE_SIZE='0')
+    inputs = _inputs(source, random.Random(seed))
+    with tempfile.TemporaryDirectory() as tmp:
+        work = os.path.join(tmp, 'library.db')
+        shutil.copyfile(source, work)
+        port = _free_port()
+        server = _start_server(work, port, server_env, os.path.join(tmp, 'server.log'))
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=clients) as pool:
+                outcomes = list(pool.map(
+                    lambda i: _client(port, shares, inputs, settings['cache'], start + duration, seed + i),
+                    range(clients)))
+            elapsed = time.perf_counter() - start
+        finally:
+            _stop_server(server)
+
+    routes = {}
+    for name in shares:
+        seconds = [s for outcome in outcomes for s in outcome['latencies'].get(name, ())]
+        stats = summarize(seconds)
+        stats.update({
+            'requests_per_sec': round(len(seconds) / elapsed, 1),
+            'status': dict(sum((outcome['statuses'].get(name, Counter()) for outcome in outcomes), Counter())),
+            'errors': sum(outcome['errors'][name] for outcome in outcomes),
+        })
+        routes[name] = stats
+    requests = sum(stats['calls'] for stats in routes.values())
+    return {
+        'settings': settings,
+        'seconds': round(elapsed, 3),
+        'requests': requests,
+        'requests_per_sec': round(requests / elapsed, 1),
+        'errors': sum(stats['errors'] for stats in routes.values()),
+        'server_errors': sum(count for stats in routes.values()
+                             for status, count in stats['status'].items() if status.startswith('5')),
+        'routes': routes,
+    }
+
+
+def run_load(scale: str = '10k', configs: Optional[List[str]] = None, clients: int = 16, duration: float = 10,
+             write_ratio: float = 0.2, mix: Optional[Dict[str, float]] = None, seed: int = 327,
+             data_dir: Optional[str] = None, env: Optional[Dict[str, str]] = None) -> Dict:
+    """Generate (or reuse) the ``scale`` database and load-test each configuration against a copy of it."""
+    configs = configs or list(CONFIGURATIONS)
+    unknown = set(configs) - set(CONFIGURATIONS)
+    if unknown:
+        raise ValueError(f"Unknown configuration: {', '.join(sorted(unknown))}")
+    shares = route_weights(write_ratio, mix)
+    report = dict(environment(), scale=scale, clients=clients, duration=duration, write_ratio=write_ratio,
+                  mix={name: round(share, 4) for name, share in shares.items()}, seed=seed, env=env or {},
+                  configs={})
+    with tempfile.TemporaryDirectory() as tmp:
+        source = datagen.dataset_path(data_dir or tmp, scale, seed)
+        if not os.path.exists(source):
+            datagen.generate(source, datagen.parse_scale(scale), seed)
+        for name in configs:
+            report['configs'][name] = run_configuration(source, CONFIGURATIONS[name], shares, clients,
+                                                        duration, seed, env)
+    return report
+
+
+def serve(database_path: str, port: int):
+    """Run create_app() against ``database_path`` on a threaded server (the load test's child process)."""
+    from werkzeug.serving import make_server
+
+    import database
+    from app import create_app
+
+    database.DATABASE = database_path
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', port, create_app(), threaded=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def _pairs(items: Optional[List[str]], convert: Callable = str) -> Dict:
+    pairs = {}
+    for item in items or ():
+        name, sep, value = item.partition('=')
+        if not sep:
+            raise argparse.ArgumentTypeError(f'Expected NAME=VALUE, got {item!r}')
+        pairs[name] = convert(value)
+    return pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--scale', default='10k', help=f'{", ".join(datagen.SCALES)} or a number of books')
+    parser.add_argument('--configs', nargs='+', default=list(CONFIGURATIONS), choices=list(CONFIGURATIONS))
+    parser.add_argument('--clients', type=int, default=16, help='concurrent HTTP clients')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load per configuration')
+    parser.add_argument('--write-ratio', type=float, default=0.2, help='share of requests that write')
+    parser.add_argument('--mix', nargs='+', metavar='ROUTE=WEIGHT',
+                        help=f'route weights within reads or writes ({", ".join(ROUTES)})')
+    parser.add_argument('--env', nargs='+', metavar='NAME=VALUE', help='extra server environment variables')
+    parser.add_argument('--seed', type=int, default=327)
+    parser.add_argument('--data-dir', help='keep the generated database here and reuse it on later runs')
+    parser.add_argument('--output', help='JSON results file (default: http_load-<revision>.json)')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--database', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.database, args.port)
+        return
+
+    report = run_load(args.scale, args.configs, args.clients, args.duration, args.write_ratio,
+                      _pairs(args.mix, float), args.seed, args.data_dir, _pairs(args.env))
+    configs = report['configs']
+    print(f"{'route':<16}" + ''.join(f'{name:>34}' for name in configs))
+    print(f"{'':<16}" + f"{'req/s   p50   p95   p99 ms':>34}" * len(configs))
+    for route in report['mix']:
+        cells = ''.join(f" {r['requests_per_sec']:>9.1f} {r['p50_ms']:>7.1f} {r['p95_ms']:>7.1f} {r['p99_ms']:>7.1f}"
+                        for r in (result['routes'][route] for result in configs.values()))
+        print(f'{route:<16}{cells}')
+    print(f"{'total':<16}" + ''.join(f" {result['requests_per_sec']:>9.1f}{'':>24}" for result in configs.values()))
+    for name, result in configs.items():
+        if result['errors'] or result['server_errors']:
+            print(f"{name}: {result['errors']} connection errors, {result['server_errors']} 5xx responses")
+
+    output = args.output or f"http_load-{report['git_revision'] or int(time.time())}.json"
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
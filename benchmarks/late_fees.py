@@ -0,0 +1,95 @@
+"""
+Late Fee Benchmark - batch fee engine vs. the per-loan Python formula
+
+Times the fee schedule over synthetic open loans three ways: the scalar
+formula in a Python loop, the NumPy array engine, and (with --sql) the full
+open_loan_fees() pipeline for both engines against a scratch database.
+
+Usage:
+    python -m benchmarks.late_fees [--sizes 1000000 10000000] [--sql]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict
+
+import database
+from migrations import run_migrations
+from services import fee_engine
+from services.fee_engine import compute_late_fees, late_fee_for_days, open_loan_fees
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_formula(size: int, seed: int = 327) -> Dict:
+    """Days-overdue values in [-14, 60) evaluated in Python and with NumPy."""
+    rng = random.Random(seed)
+    days = [rng.randrange(-14, 60) for _ in range(size)]
+    results = {}
+    _, results['python_seconds'] = _timed(lambda: [late_fee_for_days(d) for d in days])
+    if fee_engine.np is not None:
+        array = fee_engine.np.array(days, dtype=fee_engine.np.int64)
+        _, results['numpy_seconds'] = _timed(compute_late_fees, array)
+    return results
+
+
+def bench_pipeline(size: int, seed: int = 327) -> Dict:
+    """Load and price ``size`` open loans from SQLite with each engine."""
+    rng = random.Random(seed)
+    now = datetime.now()
+    original_db = database.DATABASE
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DATABASE = os.path.join(tmp, 'fees.db')
+        try:
+            database.init_database()
+            run_migrations()
+            database.insert_book('Bench', 'Author', '1234567890123', size, 0)
+            conn = database.get_db_connection()
+            batch = []
+            for i in range(size):
+                due = now - timedelta(days=rng.randrange(-14, 60), seconds=rng.randrange(86400))
+                due_s = database.to_epoch_seconds(due)
+                batch.append((f'{i % 300000:06d}', 1, due_s - 14 * 86400, due_s))
+                if len(batch) == 100000:
+                    conn.executemany('INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date) '
+                                     'VALUES (?, ?, ?, ?)', batch)
+                    batch = []
+            conn.executemany('INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date) '
+                             'VALUES (?, ?, ?, ?)', batch)
+            conn.commit()
+            conn.close()
+            for engine in fee_engine.ENGINES:
+                if engine == 'numpy' and fee_engine.np is None:
+                    continue
+                _, results[f'{engine}_pipeline_seconds'] = _timed(open_loan_fees, now, engine)
+        finally:
+            database.close_pool()
+            database.DATABASE = original_db
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000_000, 10_000_000])
+    parser.add_argument('--sql', action='store_true', help='also time the database pipelines')
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        results = bench_formula(size)
+        if args.sql:
+            results.update(bench_pipeline(size))
+        timings = ', '.join(f'{name.replace("_seconds", "")} {seconds:.3f}s' for name, seconds in results.items())
+        print(f'{size:>10} loans: {timings}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Loan History Benchmark - ISO text vs. integer epoch loan dates
+
+Fills a scratch database in the original ISO-text layout with one patron
+holding ``--loans`` loans (plus background loans for other patrons), times
+history decoding and an overdue range scan, then applies the migrations that
+convert the dates to epoch seconds and times the same work again. Exits
+non-zero if either measurement is slower after the migration than before.
+
+Usage:
+    python -m benchmarks.loan_history [--loans 10000] [--others 100000] [--repeat 5]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import database
+from migrations import run_migrations
+
+PATRON = '123456'
+
+
+def _best_of(repeat: int, func, *args) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _iso_history(patron_id: str) -> List[Dict]:
+    """get_patron_borrowing_history() as written for ISO text dates."""
+    conn = database.get_db_connection()
+    records = conn.execute('''
+        SELECT br.*, b.title, b.author
+        FROM borrow_records br
+        JOIN books b ON br.book_id = b.id
+        WHERE br.patron_id = ?
+        ORDER BY br.borrow_date DESC
+    ''', (patron_id,)).fetchall()
+    conn.close()
+    return [{
+        'book_id': record['book_id'],
+        'title': record['title'],
+        'author': record['author'],
+        'borrow_date': datetime.fromisoformat(record['borrow_date']),
+        'due_date': datetime.fromisoformat(record['due_date']),
+        'return_date': datetime.fromisoformat(record['return_date']) if record['return_date'] else None,
+        'is_returned': record['return_date'] is not None,
+        'is_overdue': record['return_date'] is None and datetime.now() > datetime.fromisoformat(record['due_date'])
+    } for record in records]
+
+
+def _count_due_before(cutoff) -> int:
+    conn = database.get_db_connection()
+    try:
+        return conn.execute('''
+            SELECT COUNT(*) FROM borrow_records WHERE return_date IS NULL AND due_date <= ?
+        ''', (cutoff,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _seed(loans: int, others: int, seed: int):
+    rng = random.Random(seed)
+    now = datetime.now()
+    database.insert_book('Bench', 'Author', '1234567890123', loans + others, 0)
+    rows = []
+    for i in range(loans + others):
+        borrowed = now - timedelta(days=rng.randrange(1, 3650), seconds=rng.randrange(86400),
+                                   microseconds=rng.randrange(1000000))
+        due = borrowed + timedelta(days=14)
+        returned = None if rng.random() < 0.1 else due - timedelta(days=rng.randrange(-5, 14))
+        patron_id = PATRON if i < loans else f'{rng.randrange(1, 999999):06d}'
+        rows.append((patron_id, borrowed.isoformat(), due.isoformat(),
+                     returned.isoformat() if returned else None))
+    conn = database.get_db_connection()
+    conn.executemany('''
+        INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date, return_date)
+        VALUES (?, 1, ?, ?, ?)
+    ''', rows)
+    # Same history index the migrated layout gets, so only the date encoding differs
+    conn.execute('CREATE INDEX idx_borrow_records_patron_borrow_date ON borrow_records (patron_id, borrow_date)')
+    conn.commit()
+    conn.close()
+
+
+def benchmark(loans: int = 10000, others: int = 100000, repeat: int = 5, seed: int = 327) -> Dict:
+    """Time history decoding and an overdue range scan before and after the epoch migration."""
+    original_db = database.DATABASE
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DATABASE = os.path.join(tmp, 'history.db')
+        try:
+            database.init_database()
+            _seed(loans, others, seed)
+            cutoff = datetime.now() - timedelta(days=30)
+
+            results['iso_history_seconds'] = _best_of(repeat, _iso_history, PATRON)
+            results['iso_due_scan_seconds'] = _best_of(repeat, _count_due_before, cutoff.isoformat())
+
+            start = time.perf_counter()
+            run_migrations()
+            results['migration_seconds'] = time.perf_counter() - start
+
+            results['epoch_history_seconds'] = _best_of(repeat, database.get_patron_borrowing_history, PATRON)
+            results['epoch_due_scan_seconds'] = _best_of(repeat, _count_due_before,
+                                                         database.to_epoch_seconds(cutoff))
+        finally:
+            database.close_pool()
+            database.DATABASE = original_db
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--loans', type=int, default=10000, help='loans held by the measured patron')
+    parser.add_argument('--others', type=int, default=100000, help='background loans for other patrons')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    results = benchmark(args.loans, args.others, args.repeat)
+    for name, seconds in results.items():
+        print(f"{name.replace('_seconds', ''):>18}: {seconds * 1000:9.2f} ms")
+    print(f"history speedup: {results['iso_history_seconds'] / results['epoch_history_seconds']:.2f}x, "
+          f"due scan speedup: {results['iso_due_scan_seconds'] / results['epoch_due_scan_seconds']:.2f}x")
+
+    regressions = [name for name in ('history', 'due_scan')
+                   if results[f'epoch_{name}_seconds'] > results[f'iso_{name}_seconds']]
+    for name in regressions:
+        print(f"REGRESSION {name}: {results[f'iso_{name}_seconds'] * 1000:.2f} -> "
+              f"{results[f'epoch_{name}_seconds'] * 1000:.2f} ms")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Payments Benchmark - pay/refund throughput and tail latency against a simulated gateway
+
+Seeds a scratch database with one overdue loan per patron, then drives
+pay_late_fees() for every patron and refund_late_fee_payment() for every
+successful charge from a thread pool, using SimulatedGateway in place of the
+real gateway. Reports throughput and latency percentiles per operation and
+checks the results against the simulator's ledger.
+
+Usage:
+    python -m benchmarks.payments [--patrons 500] [--threads 16] [--latency lognormal:0.02,0.5]
+                                  [--failure-rate 0.02] [--timeout-rate 0.01] [--timeout 0.5]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+import database
+from benchmarks.timing import summarize
+from migrations import run_migrations
+from services.gateway_simulator import SimulatedGateway
+from services.library_service import pay_late_fees, refund_late_fee_payment
+
+
+def _drive(func: Callable, calls: List[Tuple], threads: int) -> Tuple[List, Dict]:
+    """Run func(*args) for every call on a thread pool; return results and timing summary."""
+    def timed(args):
+        start = time.perf_counter()
+        result = func(*args)
+        return result, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        outcomes = list(pool.map(timed, calls))
+    elapsed = time.perf_counter() - start
+
+    summary = summarize(seconds for _, seconds in outcomes)
+    summary.update({
+        'ok': sum(1 for result, _ in outcomes if result[0]),
+        'seconds': round(elapsed, 3),
+        'calls_per_sec': round(len(calls) / elapsed, 1) if elapsed else 0.0,
+    })
+    return [result for result, _ in outcomes], summary
+
+
+def _seed(patrons: int, seed: int) -> List[Tuple[str, int]]:
+    rng = random.Random(seed)
+    now = datetime.now()
+    database.insert_book('Bench', 'Author', '1234567890123', patrons, 0)
+    rows = []
+    for i in range(patrons):
+        due = now - timedelta(days=rng.randrange(1, 30), hours=1)
+        rows.append((f'{100000 + i:06d}', database.to_epoch_seconds(due - timedelta(days=14)),
+                     database.to_epoch_seconds(due)))
+    conn = database.get_db_connection()
+    conn.executemany('INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date) '
+                     'VALUES (?, 1, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+    return [(patron_id, 1) for patron_id, _, _ in rows]
+
+
+def benchmark(patrons: int = 500, threads: int = 16, latency: str = 'lognormal:0.02,0.5',
+              failure_rate: float = 0.02, timeout_rate: float = 0.01, timeout: float = 0.5,
+              seed: int = 327) -> Dict:
+    """Pay every patron's fee, then refund every successful charge, through a SimulatedGateway."""
+    gateway = SimulatedGateway(latency=latency, failure_rate=failure_rate, timeout_rate=timeout_rate,
+                               timeout=timeout, seed=seed)
+    original_db = database.DATABASE
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DATABASE = os.path.join(tmp, 'payments.db')
+        try:
+            database.init_database()
+            run_migrations()
+            loans = _seed(patrons, seed)
+
+            paid, pay_summary = _drive(lambda p, b: pay_late_fees(p, b, gateway), loans, threads)
+            charges = {charge['transaction_id']: charge['amount'] for charge in gateway.ledger()}
+            refunds = [(txn, charges[txn]) for ok, _, txn in paid if ok]
+            refunded, refund_summary = _drive(lambda t, a: refund_late_fee_payment(t, a, gateway),
+                                              refunds, threads)
+        finally:
+            database.close_pool()
+            database.DATABASE = original_db
+
+    stats = gateway.stats()
+    refunded_ok = round(sum(amount for (_, amount), (ok, _) in zip(refunds, refunded) if ok), 2)
+    return {
+        'pay': pay_summary,
+        'refund': refund_summary,
+        'gateway': stats,
+        # Timed-out charges are applied but unknown to the caller, so only
+        # refunds the caller saw succeed should appear in the ledger
+        'ledger_consistent': stats['refunded'] == refunded_ok,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--patrons', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--latency', default='lognormal:0.02,0.5',
+                        help='constant:S, uniform:LOW,HIGH, exponential:MEAN or lognormal:MEDIAN,SIGMA')
+    parser.add_argument('--failure-rate', type=float, default=0.02)
+    parser.add_argument('--timeout-rate', type=float, default=0.01)
+    parser.add_argument('--timeout', type=float, default=0.5, help='seconds a simulated timeout takes')
+    args = parser.parse_args()
+
+    results = benchmark(args.patrons, args.threads, args.latency, args.failure_rate,
+                        args.timeout_rate, args.timeout)
+    for name in ('pay', 'refund'):
+        r = results[name]
+        print(f"{name:>6}: {r['ok']}/{r['calls']} ok, {r['calls_per_sec']:.1f} calls/s, "
+              f"p50 {r['p50_ms']:.1f} ms, p95 {r['p95_ms']:.1f} ms, p99 {r['p99_ms']:.1f} ms, "
+              f"max {r['max_ms']:.1f} ms")
+    print(f"gateway: {results['gateway']}")
+    print(f"ledger consistent: {results['ledger_consistent']}")
+
+
+if __name__ == '__main__':
+    main()
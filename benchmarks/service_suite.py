@@ -0,0 +1,231 @@
+"""
+Service Suite Benchmark - times every service function at each scale factor
+
+For each scale, generates (or reuses, with --data-dir) a synthetic database
+with benchmarks.datagen, runs each service-layer function against a fresh
+copy of it and records per-call latency statistics. Results are written as
+JSON; --compare flags functions whose median got slower than a previous run.
+
+Usage:
+    python -m benchmarks.service_suite [--scales 10k 100k] [--repeat 50] [--output results.json]
+                                       [--data-dir DIR] [--only NAME ...] [--compare baseline.json]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import database
+from benchmarks import datagen
+from benchmarks.timing import environment, summarize
+from services import fee_engine, library_service
+from services.gateway_simulator import SimulatedGateway
+
+# Whole-catalog operations run this many times instead of --repeat
+HEAVY_REPEAT = 3
+
+# (calls, function taking the call index, or None and a function counting the
+# inputs an earlier case produced)
+Case = Tuple[Optional[int], Callable[[int], object], Optional[Callable[[], int]]]
+
+
+def _samples(rng: random.Random, count: int) -> Dict:
+    """Pick deterministic inputs for the cases from the generated data."""
+    conn = database.get_db_connection()
+    try:
+        now = database.to_epoch_seconds(datetime.now())
+        open_loans = conn.execute('''
+            SELECT patron_id, book_id, due_date FROM borrow_records
+            WHERE return_date IS NULL ORDER BY id LIMIT 50000
+        ''').fetchall()
+        books = conn.execute('''
+            SELECT id, isbn, author FROM books WHERE available_copies > 1 ORDER BY id LIMIT 50000
+        ''').fetchall()
+        patrons = [row[0] for row in conn.execute('''
+            SELECT patron_id FROM patrons WHERE open_loans < 5 ORDER BY patron_id LIMIT 50000
+        ''')]
+    finally:
+        conn.close()
+
+    overdue = [(row['patron_id'], row['book_id']) for row in open_loans if row['due_date'] < now]
+    # One loan per patron, so paying one patron never changes another case's input
+    by_patron = list({patron_id: book_id for patron_id, book_id in overdue}.items())
+    pick = lambda items, n: rng.sample(items, min(n, len(items)))
+    return {
+        'overdue': pick(overdue, count),
+        'overdue_patrons': pick(by_patron, count * 2),
+        'books': pick([tuple(row) for row in books], count * 2),
+        'patrons': pick(patrons, count * 2),
+    }
+
+
+def _cases(samples: Dict, repeat: int, rng: random.Random) -> Dict[str, Case]:
+    gateway = SimulatedGateway(latency='constant:0', seed=0)
+    books, patrons = samples['books'], samples['patrons']
+    borrowed, paid = [], []
+    batch = [(patrons[i % len(patrons)], books[i % len(books)][0]) for i in range(50)] if books and patrons else []
+    words = [noun.lower() for noun in datagen._NOUNS]
+    last_names = list(datagen._LAST_NAMES)
+
+    def borrow(i):
+        patron_id, book_id = patrons[i % len(patrons)], books[i % len(books)][0]
+        borrowed.append((patron_id, book_id))
+        return library_service.borrow_book_by_patron(patron_id, book_id)
+
+    def pay(i):
+        patron_id, book_id = samples['overdue'][i % len(samples['overdue'])]
+        result = library_service.pay_late_fees(patron_id, book_id, gateway)
+        if result[0]:
+            paid.append(result[2])
+        return result
+
+    def search(search_type, mode, term):
+        def run(i):
+            library_service._search_cache.clear()  # time the query, not the result cache
+            return library_service.search_books_in_catalog(term(i), search_type, mode)
+        return run
+
+    cases = {
+        'add_book_to_catalog': (repeat, lambda i: library_service.add_book_to_catalog(
+            f'Benchmark Title {i}', 'Benchmark Author', f'{9990000000000 + i}', 3)),
+        'borrow_book_by_patron': (min(repeat, len(patrons), len(books)), borrow),
+        'return_book_by_patron': (None, lambda i: library_service.return_book_by_patron(*borrowed[i])),
+        'borrow_books_in_batch[50]': (1 if batch else 0, lambda i: library_service.borrow_books_in_batch(batch)),
+        'return_books_in_batch[50]': (1 if batch else 0, lambda i: library_service.return_books_in_batch(batch)),
+        'calculate_late_fee_for_book': (len(samples['overdue']), lambda i: library_service.calculate_late_fee_for_book(
+            *samples['overdue'][i])),
+        'get_patron_status_report': (len(patrons[:repeat]), lambda i: library_service.get_patron_status_report(
+            patrons[i])),
+        'search_books_in_catalog[title,substring]': (HEAVY_REPEAT, search(
+            'title', 'substring', lambda i: rng.choice(words))),
+        'search_books_in_catalog[author,substring]': (HEAVY_REPEAT, search(
+            'author', 'substring', lambda i: rng.choice(last_names))),
+        'search_books_in_catalog[title,fts]': (repeat, search('title', 'fts', lambda i: rng.choice(words))),
+        'search_books_in_catalog[isbn]': (min(repeat, len(books)), search(
+            'isbn', None, lambda i: books[i][1])),
+        'build_search_index': (1, lambda i: library_service.build_search_index()),
+        'search_books_in_catalog[title,trigram]': (repeat, search('title', 'trigram', lambda i: rng.choice(words))),
+        'pay_late_fees': (len(samples['overdue']), pay),
+        'refund_late_fee_payment': (None, lambda i: library_service.refund_late_fee_payment(paid[i], 0.5, gateway)),
+        'pay_all_late_fees': (len(samples['overdue_patrons'][:repeat]), lambda i: library_service.pay_all_late_fees(
+            samples['overdue_patrons'][i][0], gateway)),
+        'open_loan_fees': (HEAVY_REPEAT, lambda i: fee_engine.open_loan_fees()),
+        'iter_overdue_report': (HEAVY_REPEAT, lambda i: sum(1 for _ in fee_engine.iter_overdue_report())),
+    }
+    # Cases whose inputs are produced by the case before them
+    counts = {'return_book_by_patron': lambda: len(borrowed), 'refund_late_fee_payment': lambda: len(paid)}
+    return {name: (calls, func, counts.get(name)) for name, (calls, func) in cases.items()}
+
+
+def run_scale(path: str, repeat: int, seed: int, only: Optional[List[str]] = None) -> Dict:
+    """Time every case against the database at ``path``; returns per-function summaries."""
+    original_db = database.DATABASE
+    database.DATABASE = path
+    database.close_pool()
+    database.clear_book_cache()
+    library_service._search_cache.clear()
+    rng = random.Random(seed)
+    results = {}
+    try:
+        cases = _cases(_samples(rng, repeat), repeat, rng)
+        for name, (calls, func, count) in cases.items():
+            if calls is None:
+                calls = count()
+            if only and not any(pattern in name for pattern in only):
+                continue
+            timings = []
+            for i in range(calls):
+                start = time.perf_counter()
+                func(i)
+                timings.append(time.perf_counter() - start)
+            results[name] = summarize(timings)
+    finally:
+        library_service._search_index = None
+        library_service._search_cache.clear()
+        database.close_pool()
+        database.clear_book_cache()
+        database.DATABASE = original_db
+    return results
+
+
+def run_suite(scales: List[str], repeat: int = 50, seed: int = 327, data_dir: Optional[str] = None,
+              only: Optional[List[str]] = None) -> Dict:
+    """Generate (or reuse) each scale's database and time the service functions against a copy of it."""
+    report = dict(environment(), repeat=repeat, seed=seed, scales={})
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in scales:
+            scale = datagen.parse_scale(name)
+            source = datagen.dataset_path(data_dir or tmp, name, seed)
+            data = None
+            if not os.path.exists(source):
+                data = datagen.generate(source, scale, seed)
+            # Cases write (new books, loans, payments); keep the generated data pristine
+            work = os.path.join(tmp, f'work_{name}.db')
+            shutil.copyfile(source, work)
+            try:
+                report['scales'][name] = {'books': scale, 'data': data,
+                                          'functions': run_scale(work, repeat, seed, only)}
+            finally:
+                for suffix in ('', '-wal', '-shm'):
+                    if os.path.exists(work + suffix):
+                        os.remove(work + suffix)
+    return report
+
+
+def compare(report: Dict, baseline: Dict, threshold: float = 1.25) -> List[Dict]:
+    """List functions whose median latency grew by at least ``threshold`` times since ``baseline``."""
+    regressions = []
+    for scale, current in report['scales'].items():
+        previous = baseline.get('scales', {}).get(scale, {}).get('functions', {})
+        for name, stats in current['functions'].items():
+            before = previous.get(name, {}).get('p50_ms')
+            if before and stats['p50_ms'] / before >= threshold:
+                regressions.append({'scale': scale, 'function': name, 'baseline_p50_ms': before,
+                                    'p50_ms': stats['p50_ms'], 'ratio': round(stats['p50_ms'] / before, 2)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--scales', nargs='+', default=['10k', '100k'],
+                        help=f'{", ".join(datagen.SCALES)} or numbers of books')
+    parser.add_argument('--repeat', type=int, default=50, help='calls per function (whole-catalog ones run fewer)')
+    parser.add_argument('--seed', type=int, default=327)
+    parser.add_argument('--data-dir', help='keep generated databases here and reuse them on later runs')
+    parser.add_argument('--only', nargs='+', help='only run functions whose name contains one of these')
+    parser.add_argument('--output', help='JSON results file (default: service_suite-<revision>.json)')
+    parser.add_argument('--compare', help='previous results file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown ratio reported as a regression')
+    args = parser.parse_args()
+
+    report = run_suite(args.scales, args.repeat, args.seed, args.data_dir, args.only)
+    for scale, result in report['scales'].items():
+        print(f'scale {scale}:')
+        for name, stats in result['functions'].items():
+            print(f"  {name:<42} {stats['calls']:>5} calls  p50 {stats['p50_ms']:>10.3f} ms  "
+                  f"p95 {stats['p95_ms']:>10.3f} ms")
+
+    output = args.output or f"service_suite-{report['git_revision'] or int(time.time())}.json"
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'results written to {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for r in regressions:
+            print(f"REGRESSION {r['scale']} {r['function']}: p50 {r['baseline_p50_ms']:.3f} -> "
+                  f"{r['p50_ms']:.3f} ms ({r['ratio']:.2f}x)")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Timing helpers shared by the benchmarks - latency percentiles, summaries and run metadata
+"""
+
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+from datetime import datetime
+from typing import Dict, Iterable, Sequence
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile (q in 0..100) of already sorted values."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(seconds: Iterable[float]) -> Dict:
+    """Summarize per-call durations (seconds) as call count and millisecond statistics."""
+    latencies = sorted(seconds)
+    calls = len(latencies)
+    return {
+        'calls': calls,
+        'min_ms': round(latencies[0] * 1000, 3) if calls else 0.0,
+        'mean_ms': round(sum(latencies) / calls * 1000, 3) if calls else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3) if calls else 0.0,
+    }
+
+
+def environment() -> Dict:
+    """Describe the code revision and runtime a benchmark ran on, for its results file."""
+    from services import fee_engine
+
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except OSError:
+        revision = ''
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'git_revision': revision or None,
+        'python': sys.version.split()[0],
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'numpy': fee_engine.np is not None,
+    }
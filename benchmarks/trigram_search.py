@@ -0,0 +1,102 @@
+"""
+Trigram Search Benchmark - in-process trigram index vs. linear scan
+
+Builds a synthetic catalog in memory, then times the substring scan used by
+search_books_in_catalog against TrigramIndex lookups for the same queries.
+Reports build time and index memory footprint at each size.
+
+Usage:
+    python -m benchmarks.trigram_search [--sizes 100000 1000000] [--queries 200]
+"""
+
+import argparse
+import random
+import time
+from typing import Dict, List
+
+from services.search_index import TrigramIndex
+
+WORDS = (
+    'the', 'great', 'gatsby', 'kill', 'mockingbird', 'brave', 'new', 'world', 'war',
+    'peace', 'pride', 'prejudice', 'crime', 'punishment', 'moby', 'dick', 'odyssey',
+    'catcher', 'rye', 'hobbit', 'ring', 'lord', 'flies', 'animal', 'farm', 'jane',
+    'eyre', 'wuthering', 'heights', 'little', 'women', 'grapes', 'wrath', 'sun',
+)
+NAMES = (
+    'Scott', 'Harper', 'George', 'Aldous', 'Jane', 'Emily', 'Leo', 'Fyodor',
+    'Herman', 'Homer', 'Mary', 'Louisa', 'John', 'Ernest', 'Virginia', 'Toni',
+)
+
+
+def make_books(count: int, seed: int = 327) -> List[Dict]:
+    rng = random.Random(seed)
+    books = []
+    for book_id in range(1, count + 1):
+        title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 5))).title()
+        author = f'{rng.choice(NAMES)} {rng.choice(NAMES)}son{book_id % 997}'
+        books.append({'id': book_id, 'title': title, 'author': author})
+    return books
+
+
+def make_queries(books: List[Dict], count: int, seed: int = 328) -> List[str]:
+    """Mid-word substrings of real titles plus a few misses."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        title = rng.choice(books)['title'].lower()
+        start = rng.randrange(max(1, len(title) - 6))
+        queries.append(title[start:start + rng.randint(3, 6)])
+    return queries + ['zzzz', 'qxj']
+
+
+def linear_scan(books: List[Dict], term: str) -> List[int]:
+    term = term.lower()
+    return [book['id'] for book in books if term in book['title'].lower()]
+
+
+def benchmark(size: int, query_count: int) -> Dict:
+    books = make_books(size)
+    queries = make_queries(books, query_count)
+
+    start = time.perf_counter()
+    index = TrigramIndex()
+    index.add_all(books)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for term in queries:
+        index.search(term, 'title')
+    index_seconds = time.perf_counter() - start
+
+    scan_queries = queries[:max(5, query_count // 20)]
+    start = time.perf_counter()
+    for term in scan_queries:
+        linear_scan(books, term)
+    scan_seconds = time.perf_counter() - start
+
+    memory = index.memory_usage()
+    return {
+        'books': size,
+        'build_seconds': round(build_seconds, 3),
+        'index_ms_per_query': round(index_seconds / len(queries) * 1000, 3),
+        'scan_ms_per_query': round(scan_seconds / len(scan_queries) * 1000, 3),
+        'index_mb': round(memory['total_bytes'] / 2 ** 20, 1),
+        'trigrams': memory['trigrams'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        r = benchmark(size, args.queries)
+        print(f"{r['books']:>9} books: build {r['build_seconds']:.2f}s, "
+              f"index {r['index_mb']} MB ({r['trigrams']} trigrams), "
+              f"trigram {r['index_ms_per_query']:.3f} ms/query vs scan {r['scan_ms_per_query']:.3f} ms/query")
+
+
+if __name__ == '__main__':
+    main()
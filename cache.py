@@ -0,0 +1,82 @@
+"""
+Cache Module - Bounded in-process LRU cache with optional TTL
+Used as a read-through cache in front of hot, rarely changing lookups
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache.
+
+    Holds at most ``maxsize`` entries (0 disables caching) and, when ``ttl``
+    is set, treats entries older than ``ttl`` seconds as misses. Every
+    invalidation bumps ``generation``; readers pass the generation they saw
+    before querying to put() so a value read before a concurrent write is
+    never cached after that write's invalidation.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl or None
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None, record: bool = True) -> Any:
+        """Get a cached value (refreshing its recency) or ``default``; ``record`` counts the hit/miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl and entry[0] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                if record:
+                    self._stats['misses'] += 1
+                return default
+            self._entries.move_to_end(key)
+            if record:
+                self._stats['hits'] += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any, generation: Optional[int] = None):
+        """Cache a value unless an invalidation happened since ``generation``."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            expires = time.monotonic() + self.ttl if self.ttl else None
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def invalidate(self, *keys: Hashable):
+        """Drop the given keys."""
+        with self._lock:
+            self.generation += 1
+            self._stats['invalidations'] += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop every entry (counters are kept)."""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return dict(self._stats, size=len(self._entries), maxsize=self.maxsize, ttl=self.ttl,
+                        hit_rate=round(self._stats['hits'] / lookups, 4) if lookups else 0.0)
@@ -3,19 +3,361 @@ Database module for Library Management System
 Handles all database operations and connections
 """
 
+import json
+import os
+import re
 import sqlite3
+import threading
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import metrics
+from cache import LRUCache
+from sql_trace import trace_active, traced, trace_statement
 
 # Database configuration
 DATABASE = 'library.db'
 
-def get_db_connection():
-    """Get a database connection."""
-    conn = sqlite3.connect(DATABASE)
+# Connection pool configuration (LIBRARY_DB_POOL=0 opens a fresh connection per call)
+POOL_ENABLED = os.environ.get('LIBRARY_DB_POOL', '1') != '0'
+POOL_SIZE = int(os.environ.get('LIBRARY_DB_POOL_SIZE', '8'))
+POOL_TIMEOUT = float(os.environ.get('LIBRARY_DB_POOL_TIMEOUT', '10'))
+
+# Book lookup cache (LIBRARY_BOOK_CACHE_SIZE=0 disables it; TTL in seconds, 0 = no expiry)
+BOOK_CACHE_SIZE = int(os.environ.get('LIBRARY_BOOK_CACHE_SIZE', '1024'))
+BOOK_CACHE_TTL = float(os.environ.get('LIBRARY_BOOK_CACHE_TTL', '60'))
+
+# Pragmas applied once to every new connection
+CONNECTION_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -16000),       # ~16 MB page cache
+    ('mmap_size', 268435456),     # 256 MB memory-mapped I/O
+    ('busy_timeout', 5000),       # ms to wait on a locked database
+)
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    sqlite3 connection that hands itself back to its pool on close().
+
+    Helpers keep the usual ``conn = get_db_connection() ... conn.close()``
+    shape; close() releases the connection instead of tearing it down, and is
+    a no-op while the connection is pinned to a connection scope. execute()
+    and executemany() run on a metrics.MeteredCursor while metrics are on.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.in_use = False
+        self.pinned = False
+        self.traced = False
+
+    def close(self):
+        if self.pinned:
+            if self.in_transaction:
+                self.rollback()
+        elif self.pool is not None:
+            if self.in_use:
+                self.untrace()
+                self.pool.release(self)
+        else:
+            super().close()
+
+    def trace(self):
+        """Report statements to sql_trace while a traced helper call is using this connection."""
+        if not self.traced:
+            self.set_trace_callback(trace_statement)
+            self.traced = True
+
+    def untrace(self):
+        if self.traced:
+            self.set_trace_callback(None)
+            self.traced = False
+
+    def execute(self, sql, parameters=()):
+        return self.cursor(metrics.MeteredCursor if metrics.METRICS_ENABLED else sqlite3.Cursor).execute(
+            sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor(metrics.MeteredCursor if metrics.METRICS_ENABLED else sqlite3.Cursor).executemany(
+            sql, seq_of_parameters)
+
+    def discard(self):
+        """Really close the underlying connection."""
+        self.pool = None
+        self.pinned = False
+        super().close()
+
+
+def _connect(database: str) -> PooledConnection:
+    """Open a new connection with the library's per-connection pragmas."""
+    conn = sqlite3.connect(database, factory=PooledConnection, check_same_thread=False)
     conn.row_factory = sqlite3.Row  # This enables column access by name
+    for pragma, value in CONNECTION_PRAGMAS:
+        conn.execute(f'PRAGMA {pragma} = {value}')
     return conn
 
+
+class ConnectionPool:
+    """Bounded pool of reusable connections to a single database file."""
+
+    def __init__(self, database: str, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.closed = False
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self.stats = {'opened': 0, 'reused': 0, 'checkouts': 0}
+
+    def acquire(self) -> PooledConnection:
+        """Check out a connection, waiting up to ``timeout`` for a free slot."""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError('connection pool exhausted')
+        try:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+                self.stats['checkouts'] += 1
+                if conn is not None:
+                    self.stats['reused'] += 1
+            if conn is None:
+                conn = _connect(self.database)
+                with self._lock:
+                    self.stats['opened'] += 1
+        except Exception:
+            self._slots.release()
+            raise
+        conn.pool = self
+        conn.in_use = True
+        return conn
+
+    def release(self, conn: PooledConnection):
+        """Return a connection to the pool, rolling back any open transaction."""
+        conn.in_use = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            with self._lock:
+                keep = not self.closed
+                if keep:
+                    self._idle.append(conn)
+            if not keep:
+                conn.discard()
+        except sqlite3.Error:
+            conn.discard()
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        """Close idle connections; checked-out ones are closed when released."""
+        with self._lock:
+            self.closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.discard()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_pool() -> ConnectionPool:
+    """Get the pool for the current DATABASE, replacing it if the path changed."""
+    global _pool
+    pool = _pool
+    if pool is None or pool.database != DATABASE:
+        with _pool_lock:
+            if _pool is None or _pool.database != DATABASE:
+                if _pool is not None:
+                    _pool.close_all()
+                _pool = ConnectionPool(DATABASE, POOL_SIZE, POOL_TIMEOUT)
+            pool = _pool
+    return pool
+
+
+def close_pool():
+    """Close every pooled connection (e.g. before deleting the database file)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+            _pool = None
+
+
+def get_pool_stats() -> Dict:
+    """Get connection counters for the active pool."""
+    pool = _pool
+    if pool is None:
+        return {'opened': 0, 'reused': 0, 'checkouts': 0, 'idle': 0, 'size': POOL_SIZE}
+    with pool._lock:
+        return dict(pool.stats, idle=len(pool._idle), size=pool.size)
+
+
+def _open_connection():
+    if metrics.METRICS_ENABLED:
+        metrics.record_connection('pooled' if POOL_ENABLED else 'new')
+    if POOL_ENABLED:
+        return get_pool().acquire()
+    return _connect(DATABASE)
+
+
+def get_db_connection():
+    """Get a database connection (the scoped one, a pooled one, or a fresh one)."""
+    if getattr(_local, 'depth', 0) == 0:
+        conn = _open_connection()
+    else:
+        conn = _local.connection
+        if conn is None:
+            # Checked out on first use, so scopes that never query cost nothing
+            conn = _local.connection = _open_connection()
+            conn.pinned = True
+        elif metrics.METRICS_ENABLED:
+            metrics.record_connection('scoped')
+    if trace_active():
+        conn.trace()
+    return conn
+
+
+def begin_connection_scope():
+    """Pin one connection to the current thread until end_connection_scope()."""
+    depth = getattr(_local, 'depth', 0)
+    if depth == 0:
+        _local.connection = None
+    _local.depth = depth + 1
+
+
+def end_connection_scope(exc=None):
+    """Release the connection pinned by the matching begin_connection_scope()."""
+    depth = getattr(_local, 'depth', 0)
+    if depth == 0:
+        return
+    _local.depth = depth - 1
+    if depth == 1:
+        conn = _local.connection
+        _local.connection = None
+        if conn is not None:
+            conn.pinned = False
+            conn.close()
+
+
+@contextmanager
+def connection_scope():
+    """Reuse a single connection for every helper call made inside the block."""
+    begin_connection_scope()
+    try:
+        yield get_db_connection()
+    finally:
+        end_connection_scope()
+
+_book_cache: Optional[LRUCache] = None
+_book_cache_database: Optional[str] = None
+_book_cache_lock = threading.Lock()
+
+
+def get_book_cache() -> LRUCache:
+    """Get the book lookup cache for the current DATABASE, replacing it if the path changed."""
+    global _book_cache, _book_cache_database
+    cache = _book_cache
+    if cache is None or _book_cache_database != DATABASE:
+        with _book_cache_lock:
+            if _book_cache is None or _book_cache_database != DATABASE:
+                _book_cache = LRUCache(BOOK_CACHE_SIZE, BOOK_CACHE_TTL)
+                _book_cache_database = DATABASE
+            cache = _book_cache
+    return cache
+
+
+def invalidate_books(book_ids: Iterable[int] = (), isbns: Iterable[str] = ()):
+    """Drop cached lookups for books that were written; call after the write commits."""
+    get_book_cache().invalidate(*book_ids, *(('isbn', isbn) for isbn in isbns))
+
+
+def clear_book_cache():
+    """Drop every cached book (e.g. after rewriting the books table outside these helpers)."""
+    get_book_cache().clear()
+    bump_catalog_generation()
+
+
+# Catalog generation: a counter in the catalog_generation row, bumped by
+# triggers on books (migration 10), so writes from any process or connection
+# change it. The nonce tells apart databases that were recreated.
+_UNVERSIONED = 'unversioned'
+
+
+def bump_catalog_generation():
+    """Record that the catalog changed (e.g. after rewriting books behind the triggers' back)."""
+    conn = get_db_connection()
+    try:
+        conn.execute('UPDATE catalog_generation SET generation = generation + 1, rewrites = rewrites + 1 '
+                     'WHERE id = 1')
+        conn.commit()
+    except sqlite3.OperationalError:
+        # Not migrated yet: get_catalog_version() never matches anyway
+        if conn.in_transaction:
+            conn.rollback()
+    finally:
+        conn.close()
+
+
+def get_catalog_version() -> str:
+    """Get an opaque token that changes whenever the catalog data may have changed."""
+    conn = get_db_connection()
+    try:
+        row = conn.execute('SELECT nonce, generation FROM catalog_generation WHERE id = 1').fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    finally:
+        conn.close()
+    if row is None:
+        # Without the shared counter no version can be trusted; never match
+        return f'{_UNVERSIONED}-{os.urandom(4).hex()}'
+    return f'{row[0]}-{row[1]}'
+
+
+def get_catalog_generation() -> Optional[Dict]:
+    """Get the shared catalog counters (nonce, generation, rewrites), or None before migration 11."""
+    conn = get_db_connection()
+    try:
+        row = conn.execute('SELECT nonce, generation, rewrites FROM catalog_generation WHERE id = 1').fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    finally:
+        conn.close()
+    return dict(row) if row is not None else None
+
+
+def get_book_cache_stats() -> Dict:
+    """Get hit/miss/eviction counters for the book lookup cache."""
+    return get_book_cache().stats()
+
+def fts5_available(conn) -> bool:
+    """Check whether this SQLite build supports FTS5 virtual tables."""
+    try:
+        conn.execute('CREATE VIRTUAL TABLE IF NOT EXISTS temp.fts5_probe USING fts5(x)')
+        conn.execute('DROP TABLE temp.fts5_probe')
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+# Loan dates are stored as whole seconds since the epoch. Naive datetimes are
+# treated as UTC on both sides, so the round trip never shifts a date.
+_EPOCH = datetime(1970, 1, 1)
+
+def to_epoch_seconds(moment: datetime) -> int:
+    """Encode a naive datetime as integer seconds since the epoch."""
+    return (moment - _EPOCH) // timedelta(seconds=1)
+
+def from_epoch_seconds(seconds: int) -> datetime:
+    """Decode integer epoch seconds back into a naive datetime."""
+    return _EPOCH + timedelta(0, seconds)  # positional args skip keyword normalization
+
+@traced
 def init_database():
     """Initialize the database with required tables."""
     conn = get_db_connection()
@@ -48,6 +390,7 @@ def init_database():
     conn.commit()
     conn.close()
 
+@traced
 def add_sample_data():
     """Add sample data to the database if it's empty."""
     conn = get_db_connection()
@@ -72,8 +415,8 @@ def add_sample_data():
             INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
             VALUES (?, ?, ?, ?)
         ''', ('123456', 3, 
-              (datetime.now() - timedelta(days=5)).isoformat(),
-              (datetime.now() + timedelta(days=9)).isoformat()))
+              to_epoch_seconds(datetime.now() - timedelta(days=5)),
+              to_epoch_seconds(datetime.now() + timedelta(days=9))))
         
         # Update available copies for 1984
         conn.execute('UPDATE books SET available_copies = 0 WHERE id = 3')
@@ -81,92 +424,283 @@ def add_sample_data():
         conn.commit()
     
     conn.close()
+    if book_count == 0:
+        clear_book_cache()
 
 # Helper Functions for Database Operations
 
-def get_all_books() -> List[Dict]:
-    """Get all books from the database."""
+@traced
+def get_all_books(limit: Optional[int] = None, after: Optional[Tuple[str, int]] = None) -> List[Dict]:
+    """
+    Get books from the database ordered by title.
+
+    Pass ``limit`` and the ``(title, id)`` of the last book already seen as
+    ``after`` to fetch one page (keyset pagination on the title index).
+    """
+    query = 'SELECT * FROM books'
+    params = []
+    if after is not None:
+        query += ' WHERE (title, id) > (?, ?)'
+        params.extend(after)
+    query += ' ORDER BY title, id'
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit)
     conn = get_db_connection()
-    books = conn.execute('SELECT * FROM books ORDER BY title').fetchall()
+    books = conn.execute(query, params).fetchall()
     conn.close()
     return [dict(book) for book in books]
 
-def get_book_by_id(book_id: int) -> Optional[Dict]:
-    """Get a specific book by ID."""
+@traced
+def iter_all_books(batch_size: int = 500) -> Iterator[Dict]:
+    """
+    Yield every book ordered by title without loading the whole catalog.
+
+    Rows are pulled from one open cursor ``batch_size`` at a time; the
+    connection is released when the generator is exhausted or closed.
+    """
     conn = get_db_connection()
-    book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
-    conn.close()
-    return dict(book) if book else None
+    try:
+        cursor = conn.execute('SELECT * FROM books ORDER BY title, id')
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+    finally:
+        conn.close()
 
+@traced
+def get_book_by_id(book_id: int) -> Optional[Dict]:
+    """Get a specific book by ID (read through the book cache)."""
+    cache = get_book_cache()
+    book = cache.get(book_id)
+    if book is None:
+        generation = cache.generation
+        conn = get_db_connection()
+        book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
+        conn.close()
+        if not book:
+            return None
+        book = dict(book)
+        cache.put(book_id, book, generation)
+    return dict(book)
+
+@traced
 def get_book_by_isbn(isbn: str) -> Optional[Dict]:
-    """Get a specific book by ISBN."""
+    """Get a specific book by ISBN (read through the book cache)."""
+    cache = get_book_cache()
+    # ISBN -> id never changes, so the alias entry needs no invalidation
+    book_id = cache.get(('isbn', isbn), record=False)
+    book = cache.get(book_id)  # an unknown ISBN (book_id None) counts as a miss
+    if book is None:
+        generation = cache.generation
+        conn = get_db_connection()
+        book = conn.execute('SELECT * FROM books WHERE isbn = ?', (isbn,)).fetchone()
+        conn.close()
+        if not book:
+            return None
+        book = dict(book)
+        cache.put(('isbn', isbn), book['id'])
+        cache.put(book['id'], book, generation)
+    return dict(book)
+
+@traced
+def get_books_added_after(book_id: int) -> List[Dict]:
+    """Get the books with an id above book_id (ids only grow), in id order."""
     conn = get_db_connection()
-    book = conn.execute('SELECT * FROM books WHERE isbn = ?', (isbn,)).fetchone()
+    books = conn.execute('SELECT * FROM books WHERE id > ? ORDER BY id', (book_id,)).fetchall()
     conn.close()
-    return dict(book) if book else None
+    return [dict(book) for book in books]
 
+@traced
+def get_books_by_ids(book_ids: List[int]) -> List[Dict]:
+    """Get the books with the given IDs, ordered by title."""
+    books = []
+    conn = get_db_connection()
+    try:
+        for start in range(0, len(book_ids), 500):
+            chunk = book_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            books.extend(conn.execute(
+                f'SELECT * FROM books WHERE id IN ({placeholders})', chunk
+            ).fetchall())
+    finally:
+        conn.close()
+    books = [dict(book) for book in books]
+    books.sort(key=lambda book: (book['title'], book['id']))
+    return books
+
+@traced
+def search_books_fulltext(search_term: str, field: str, limit: Optional[int] = None,
+                          after: Optional[Tuple[str, int]] = None) -> Optional[List[Dict]]:
+    """
+    Search titles or authors through the books_fts index.
+
+    Every word in the search term must prefix-match a word in the field.
+    Results are ordered by title and support the same ``limit``/``after``
+    keyset paging as get_all_books(). Returns None when the full-text index
+    is not available.
+    """
+    if field not in ('title', 'author'):
+        raise ValueError(f'Unsupported full-text field: {field}')
+    words = re.findall(r'\w+', search_term.lower())
+    if not words:
+        return []
+    match = f'{field} : (' + ' AND '.join(f'"{word}"*' for word in words) + ')'
+    query = '''
+        SELECT b.* FROM books_fts
+        JOIN books b ON b.id = books_fts.rowid
+        WHERE books_fts MATCH ?
+    '''
+    params = [match]
+    if after is not None:
+        query += ' AND (b.title, b.id) > (?, ?)'
+        params.extend(after)
+    query += ' ORDER BY b.title, b.id'
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit)
+    conn = get_db_connection()
+    try:
+        books = conn.execute(query, params).fetchall()
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+    return [dict(book) for book in books]
+
+@traced
 def get_patron_borrowed_books(patron_id: str) -> List[Dict]:
-    """Get currently borrowed books for a patron."""
+    """
+    Get currently borrowed books for a patron.
+
+    Dates are returned as stored, in epoch seconds; callers decode them with
+    from_epoch_seconds() only where they are displayed.
+    """
     conn = get_db_connection()
     records = conn.execute('''
         SELECT br.*, b.title, b.author 
         FROM borrow_records br 
         JOIN books b ON br.book_id = b.id 
         WHERE br.patron_id = ? AND br.return_date IS NULL
-        ORDER BY br.borrow_date
+        ORDER BY br.borrow_date, br.id
     ''', (patron_id,)).fetchall()
     conn.close()
     
+    now = to_epoch_seconds(datetime.now())
     borrowed_books = []
     for record in records:
         borrowed_books.append({
             'book_id': record['book_id'],
             'title': record['title'],
             'author': record['author'],
-            'borrow_date': datetime.fromisoformat(record['borrow_date']),
-            'due_date': datetime.fromisoformat(record['due_date']),
-            'is_overdue': datetime.now() > datetime.fromisoformat(record['due_date'])
+            'borrow_date': record['borrow_date'],
+            'due_date': record['due_date'],
+            'is_overdue': now > record['due_date']
         })
     
     return borrowed_books
 
+@traced
 def get_patron_borrow_count(patron_id: str) -> int:
     """Get the number of books currently borrowed by a patron."""
     conn = get_db_connection()
-    count = conn.execute('''
-        SELECT COUNT(*) as count FROM borrow_records 
-        WHERE patron_id = ? AND return_date IS NULL
-    ''', (patron_id,)).fetchone()['count']
+    row = conn.execute('SELECT open_loans FROM patrons WHERE patron_id = ?', (patron_id,)).fetchone()
     conn.close()
-    return count
+    return row['open_loans'] if row else 0
 
+@traced
+def reconcile_patron_loan_counts(conn=None) -> Dict:
+    """
+    Rebuild every patron's open-loan counter from borrow_records.
+
+    One grouped pass over borrow_records upserts the true counts, and patrons
+    with no loans left are reset to zero. Runs on ``conn`` inside the
+    caller's transaction if given, otherwise in its own transaction.
+
+    Returns:
+        dict: 'patrons' counted and how many counters were 'corrected'
+    """
+    own = conn is None
+    if own:
+        conn = get_db_connection()
+        conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS true_open_loans (
+                patron_id TEXT PRIMARY KEY, open_loans INTEGER NOT NULL
+            )
+        ''')
+        conn.execute('DELETE FROM temp.true_open_loans')
+        conn.execute('''
+            INSERT INTO temp.true_open_loans (patron_id, open_loans)
+            SELECT patron_id, SUM(return_date IS NULL) FROM borrow_records GROUP BY patron_id
+        ''')
+        corrected = conn.execute('''
+            SELECT COUNT(*) FROM temp.true_open_loans t
+            LEFT JOIN patrons p ON p.patron_id = t.patron_id
+            WHERE IFNULL(p.open_loans, -1) != t.open_loans
+        ''').fetchone()[0]
+        corrected += conn.execute('''
+            UPDATE patrons SET open_loans = 0
+            WHERE open_loans != 0
+              AND patron_id NOT IN (SELECT patron_id FROM temp.true_open_loans)
+        ''').rowcount
+        conn.execute('''
+            INSERT INTO patrons (patron_id, open_loans)
+            SELECT patron_id, open_loans FROM temp.true_open_loans WHERE true
+            ON CONFLICT (patron_id) DO UPDATE SET open_loans = excluded.open_loans
+        ''')
+        patrons = conn.execute('SELECT COUNT(*) FROM temp.true_open_loans').fetchone()[0]
+        conn.execute('DROP TABLE temp.true_open_loans')
+        if own:
+            conn.commit()
+        return {'patrons': patrons, 'corrected': corrected}
+    except Exception:
+        if own and conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        if own:
+            conn.close()
+
+@traced
 def get_patron_borrowing_history(patron_id: str) -> List[Dict]:
-    """Get complete borrowing history for a patron (including returned books)."""
+    """
+    Get complete borrowing history for a patron (including returned books).
+
+    Dates are epoch seconds, as in get_patron_borrowed_books().
+    """
     conn = get_db_connection()
     records = conn.execute('''
         SELECT br.*, b.title, b.author 
         FROM borrow_records br 
         JOIN books b ON br.book_id = b.id 
         WHERE br.patron_id = ?
-        ORDER BY br.borrow_date DESC
+        ORDER BY br.borrow_date DESC, br.id DESC
     ''', (patron_id,)).fetchall()
     conn.close()
     
+    now = to_epoch_seconds(datetime.now())
     history = []
     for record in records:
+        returned = record['return_date'] is not None
         history.append({
             'book_id': record['book_id'],
             'title': record['title'],
             'author': record['author'],
-            'borrow_date': datetime.fromisoformat(record['borrow_date']),
-            'due_date': datetime.fromisoformat(record['due_date']),
-            'return_date': datetime.fromisoformat(record['return_date']) if record['return_date'] else None,
-            'is_returned': record['return_date'] is not None,
-            'is_overdue': record['return_date'] is None and datetime.now() > datetime.fromisoformat(record['due_date'])
+            'borrow_date': record['borrow_date'],
+            'due_date': record['due_date'],
+            'return_date': record['return_date'],
+            'is_returned': returned,
+            'is_overdue': not returned and now > record['due_date']
         })
     
     return history
 
+@traced
 def insert_book(title: str, author: str, isbn: str, total_copies: int, available_copies: int) -> bool:
     """Insert a new book into the database."""
     conn = get_db_connection()
@@ -177,11 +711,52 @@ def insert_book(title: str, author: str, isbn: str, total_copies: int, available
         ''', (title, author, isbn, total_copies, available_copies))
         conn.commit()
         conn.close()
+        invalidate_books(isbns=[isbn])
         return True
     except Exception as e:
         conn.close()
         return False
 
+@traced
+def get_books_by_isbns(isbns: List[str]) -> List[Dict]:
+    """Get the books with any of the given ISBNs (in no particular order)."""
+    books = []
+    conn = get_db_connection()
+    try:
+        for start in range(0, len(isbns), 500):
+            chunk = isbns[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            books.extend(conn.execute(
+                f'SELECT * FROM books WHERE isbn IN ({placeholders})', chunk
+            ).fetchall())
+    finally:
+        conn.close()
+    return [dict(book) for book in books]
+
+@traced
+def insert_books(books: List[Tuple[str, str, str, int, int]]) -> bool:
+    """
+    Insert many books in a single transaction.
+
+    Each entry is ``(title, author, isbn, total_copies, available_copies)``.
+    Nothing is inserted if any row fails.
+    """
+    conn = get_db_connection()
+    try:
+        conn.executemany('''
+            INSERT INTO books (title, author, isbn, total_copies, available_copies)
+            VALUES (?, ?, ?, ?, ?)
+        ''', books)
+        conn.commit()
+        conn.close()
+        invalidate_books(isbns=[book[2] for book in books])
+        return True
+    except Exception as e:
+        conn.rollback()
+        conn.close()
+        return False
+
+@traced
 def insert_borrow_record(patron_id: str, book_id: int, borrow_date: datetime, due_date: datetime) -> bool:
     """Insert a new borrow record into the database."""
     conn = get_db_connection()
@@ -189,7 +764,7 @@ def insert_borrow_record(patron_id: str, book_id: int, borrow_date: datetime, du
         conn.execute('''
             INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
             VALUES (?, ?, ?, ?)
-        ''', (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()))
+        ''', (patron_id, book_id, to_epoch_seconds(borrow_date), to_epoch_seconds(due_date)))
         conn.commit()
         conn.close()
         return True
@@ -197,6 +772,7 @@ def insert_borrow_record(patron_id: str, book_id: int, borrow_date: datetime, du
         conn.close()
         return False
 
+@traced
 def update_book_availability(book_id: int, change: int) -> bool:
     """Update the available copies of a book by a given amount (+1 for return, -1 for borrow)."""
     conn = get_db_connection()
@@ -206,11 +782,13 @@ def update_book_availability(book_id: int, change: int) -> bool:
         ''', (change, book_id))
         conn.commit()
         conn.close()
+        invalidate_books([book_id])
         return True
     except Exception as e:
         conn.close()
         return False
 
+@traced
 def update_borrow_record_return_date(patron_id: str, book_id: int, return_date: datetime) -> bool:
     """Update the return date for a borrow record."""
     conn = get_db_connection()
@@ -219,10 +797,721 @@ def update_borrow_record_return_date(patron_id: str, book_id: int, return_date:
             UPDATE borrow_records 
             SET return_date = ? 
             WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
-        ''', (return_date.isoformat(), patron_id, book_id))
+        ''', (to_epoch_seconds(return_date), patron_id, book_id))
         conn.commit()
         conn.close()
         return True
     except Exception as e:
         conn.close()
         return False
+
+@traced
+def borrow_book_atomic(patron_id: str, book_id: int, borrow_date: datetime, due_date: datetime,
+                       max_loans: int) -> Tuple[str, Optional[Dict]]:
+    """
+    Borrow a book in one write transaction.
+
+    The limit check, the conditional availability decrement and the loan
+    insert all run inside BEGIN IMMEDIATE, so concurrent borrowers can never
+    take more copies than exist.
+
+    Returns:
+        tuple: (status, book) where status is one of 'ok', 'not_found',
+        'unavailable', 'limit' (patron already has ``max_loans`` open
+        loans) or 'error'
+    """
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
+        if not book:
+            conn.rollback()
+            return 'not_found', None
+        book = dict(book)
+        if book['available_copies'] <= 0:
+            conn.rollback()
+            return 'unavailable', book
+        
+        patron = conn.execute('SELECT open_loans FROM patrons WHERE patron_id = ?', (patron_id,)).fetchone()
+        open_loans = patron['open_loans'] if patron else 0
+        if open_loans >= max_loans:
+            conn.rollback()
+            return 'limit', book
+        
+        taken = conn.execute('''
+            UPDATE books SET available_copies = available_copies - 1
+            WHERE id = ? AND available_copies > 0
+        ''', (book_id,)).rowcount
+        if taken != 1:
+            conn.rollback()
+            return 'unavailable', book
+        
+        conn.execute('''
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+            VALUES (?, ?, ?, ?)
+        ''', (patron_id, book_id, to_epoch_seconds(borrow_date), to_epoch_seconds(due_date)))
+        conn.commit()
+        invalidate_books([book_id])
+        book['available_copies'] -= 1
+        return 'ok', book
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.rollback()
+        return 'error', None
+    finally:
+        conn.close()
+
+@traced
+def return_book_atomic(patron_id: str, book_id: int,
+                       return_date: datetime) -> Tuple[str, Optional[Dict], Optional[datetime]]:
+    """
+    Return a borrowed book in one write transaction.
+
+    Closes the patron's oldest open loan of the book and increments its
+    availability together, so the two can never drift apart.
+
+    Returns:
+        tuple: (status, book, due_date) where status is one of 'ok',
+        'not_found', 'not_borrowed' or 'error'
+    """
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
+        if not book:
+            conn.rollback()
+            return 'not_found', None, None
+        book = dict(book)
+        
+        loan = conn.execute('''
+            SELECT id, due_date FROM borrow_records
+            WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
+            ORDER BY borrow_date, id
+            LIMIT 1
+        ''', (patron_id, book_id)).fetchone()
+        if not loan:
+            conn.rollback()
+            return 'not_borrowed', book, None
+        
+        conn.execute('UPDATE borrow_records SET return_date = ? WHERE id = ?',
+                     (to_epoch_seconds(return_date), loan['id']))
+        conn.execute('UPDATE books SET available_copies = available_copies + 1 WHERE id = ?',
+                     (book_id,))
+        conn.commit()
+        invalidate_books([book_id])
+        book['available_copies'] += 1
+        return 'ok', book, from_epoch_seconds(loan['due_date'])
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.rollback()
+        return 'error', None, None
+    finally:
+        conn.close()
+
+def _fetch_books_by_id(conn, book_ids: List[int]) -> Dict[int, Dict]:
+    books = {}
+    for start in range(0, len(book_ids), 500):
+        chunk = book_ids[start:start + 500]
+        placeholders = ','.join('?' * len(chunk))
+        for row in conn.execute(f'SELECT * FROM books WHERE id IN ({placeholders})', chunk):
+            books[row['id']] = dict(row)
+    return books
+
+@traced
+def borrow_books_batch(operations: List[Tuple[str, int]], borrow_date: datetime, due_date: datetime,
+                       max_loans: int) -> List[Tuple[str, Optional[Dict]]]:
+    """
+    Apply many borrows in one write transaction.
+
+    Books and open-loan counts are prefetched with IN queries, each operation
+    is checked in order against the running totals (same rules as
+    borrow_book_atomic), and the accepted loans are written with executemany.
+
+    Returns:
+        list: One (status, book) pair per operation, in input order
+    """
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        books = _fetch_books_by_id(conn, sorted({book_id for _, book_id in operations}))
+        
+        patrons = sorted({patron_id for patron_id, _ in operations})
+        open_loans = Counter()
+        for start in range(0, len(patrons), 500):
+            chunk = patrons[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            open_loans.update(dict(conn.execute(f'''
+                SELECT patron_id, open_loans FROM patrons WHERE patron_id IN ({placeholders})
+            ''', chunk).fetchall()))
+        
+        results = []
+        loans = []
+        taken = Counter()
+        borrow_epoch, due_epoch = to_epoch_seconds(borrow_date), to_epoch_seconds(due_date)
+        for patron_id, book_id in operations:
+            book = books.get(book_id)
+            if not book:
+                results.append(('not_found', None))
+            elif book['available_copies'] <= 0:
+                results.append(('unavailable', dict(book)))
+            elif open_loans[patron_id] >= max_loans:
+                results.append(('limit', dict(book)))
+            else:
+                book['available_copies'] -= 1
+                open_loans[patron_id] += 1
+                taken[book_id] += 1
+                loans.append((patron_id, book_id, borrow_epoch, due_epoch))
+                results.append(('ok', dict(book)))
+        
+        conn.executemany('''
+            INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+            VALUES (?, ?, ?, ?)
+        ''', loans)
+        updated = conn.executemany('''
+            UPDATE books SET available_copies = available_copies - ?
+            WHERE id = ? AND available_copies >= ?
+        ''', [(count, book_id, count) for book_id, count in taken.items()]).rowcount
+        if taken and updated != len(taken):
+            raise sqlite3.IntegrityError('available copies changed during batch borrow')
+        conn.commit()
+        invalidate_books(taken)
+        return results
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.rollback()
+        return [('error', None)] * len(operations)
+    finally:
+        conn.close()
+
+@traced
+def return_books_batch(operations: List[Tuple[str, int]],
+                       return_date: datetime) -> List[Tuple[str, Optional[Dict], Optional[datetime]]]:
+    """
+    Apply many returns in one write transaction.
+
+    Books and the matching open loans are prefetched with IN queries; each
+    operation closes the oldest still-open loan for its (patron, book) pair,
+    as return_book_atomic does.
+
+    Returns:
+        list: One (status, book, due_date) triple per operation, in input order
+    """
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        book_ids = sorted({book_id for _, book_id in operations})
+        books = _fetch_books_by_id(conn, book_ids)
+        
+        # Callers cap batches well below SQLite's bound-parameter limit
+        wanted = set(operations)
+        patrons = sorted({patron_id for patron_id, _ in operations})
+        open_loans = defaultdict(deque)
+        for loan in conn.execute(f'''
+            SELECT id, patron_id, book_id, due_date FROM borrow_records
+            WHERE book_id IN ({','.join('?' * len(book_ids))})
+              AND patron_id IN ({','.join('?' * len(patrons))})
+              AND return_date IS NULL
+            ORDER BY borrow_date, id
+        ''', book_ids + patrons):
+            key = (loan['patron_id'], loan['book_id'])
+            if key in wanted:
+                open_loans[key].append(loan)
+        
+        results = []
+        closed = []
+        restored = Counter()
+        return_epoch = to_epoch_seconds(return_date)
+        for patron_id, book_id in operations:
+            book = books.get(book_id)
+            loans = open_loans.get((patron_id, book_id))
+            if not book:
+                results.append(('not_found', None, None))
+            elif not loans:
+                results.append(('not_borrowed', dict(book), None))
+            else:
+                loan = loans.popleft()
+                book['available_copies'] += 1
+                restored[book_id] += 1
+                closed.append((return_epoch, loan['id']))
+                results.append(('ok', dict(book), from_epoch_seconds(loan['due_date'])))
+        
+        conn.executemany('UPDATE borrow_records SET return_date = ? WHERE id = ?', closed)
+        conn.executemany('UPDATE books SET available_copies = available_copies + ? WHERE id = ?',
+                         [(count, book_id) for book_id, count in restored.items()])
+        conn.commit()
+        invalidate_books(restored)
+        return results
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.rollback()
+        return [('error', None, None)] * len(operations)
+    finally:
+        conn.close()
+
+# Microseconds since the epoch for a due_date, computed inside SQLite
+_DUE_DATE_MICROS = '(due_date * 1000000)'
+
+@traced
+def iter_open_loan_due_dates(batch_size: int = 100000) -> Iterator[List[Tuple[int, str, int, int]]]:
+    """
+    Yield open loans in batches as ``(loan_id, patron_id, book_id, due_us)``.
+
+    ``due_us`` is the due date in integer microseconds since the epoch, so
+    callers can do date arithmetic without parsing a string per row.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(f'''
+            SELECT id, patron_id, book_id, {_DUE_DATE_MICROS} AS due_us
+            FROM borrow_records WHERE return_date IS NULL
+            ORDER BY id
+        ''')
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [tuple(row) for row in rows]
+    finally:
+        conn.close()
+
+# Days overdue and capped fee per open loan; parameters :as_of (epoch us),
+# :week, :first_rate, :later_rate and :max_fee describe the R5 schedule.
+# ``due_filter`` may narrow the loans by due_date range, which is served by
+# idx_borrow_records_open_due
+def _open_loan_fees_query(due_filter: str = '') -> str:
+    return f'''
+    SELECT id, patron_id, book_id, due_date, days_overdue,
+           MIN(CASE WHEN days_overdue <= :week THEN days_overdue * :first_rate
+                    ELSE :week * :first_rate + (days_overdue - :week) * :later_rate
+               END, :max_fee) AS fee
+    FROM (
+        SELECT id, patron_id, book_id, due_date,
+               MAX(0, (:as_of - {_DUE_DATE_MICROS}) / 86400000000) AS days_overdue
+        FROM borrow_records WHERE return_date IS NULL {due_filter}
+    )
+'''
+
+@traced
+def get_open_loan_fees(as_of_us: int, first_week_days: int, first_week_rate: float,
+                       later_rate: float, max_fee: float) -> List[Tuple[int, str, int, int, float]]:
+    """
+    Compute days overdue and capped late fees for every open loan in SQL.
+
+    Returns:
+        list: ``(loan_id, patron_id, book_id, days_overdue, fee)`` per open loan
+    """
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(f'''
+            SELECT id, patron_id, book_id, days_overdue, fee
+            FROM ({_open_loan_fees_query()})
+            ORDER BY id
+        ''', {'as_of': as_of_us, 'week': first_week_days, 'first_rate': first_week_rate,
+              'later_rate': later_rate, 'max_fee': max_fee}).fetchall()
+    finally:
+        conn.close()
+    return [tuple(row) for row in rows]
+
+@traced
+def iter_overdue_patrons(as_of_us: int, first_week_days: int, first_week_rate: float,
+                         later_rate: float, max_fee: float, fee_over: float = 0.0,
+                         min_days_overdue: int = 1) -> Iterator[Dict]:
+    """
+    Yield one row per patron with overdue loans, computed by a single grouped query.
+
+    Only loans at least ``min_days_overdue`` days late are counted, and only
+    patrons whose total fee is greater than ``fee_over`` are returned. Rows
+    are streamed from the cursor in patron order.
+
+    Yields:
+        dict: patron_id, overdue_count, total_fee and loans (a list of
+        book_id, title, due_date, days_overdue and fee)
+    """
+    # Loans at least min_days late were due on or before this epoch second
+    due_before = (as_of_us - max(min_days_overdue, 1) * 86400000000) // 1000000
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(f'''
+            SELECT f.patron_id,
+                   COUNT(*) AS overdue_count,
+                   ROUND(SUM(f.fee), 2) AS total_fee,
+                   json_group_array(json_object(
+                       'book_id', f.book_id, 'title', b.title,
+                       'due_date', strftime('%Y-%m-%dT%H:%M:%S', f.due_date, 'unixepoch'),
+                       'days_overdue', f.days_overdue, 'fee', f.fee
+                   )) AS loans
+            FROM ({_open_loan_fees_query('AND due_date <= :due_before')}) f
+            JOIN books b ON b.id = f.book_id
+            WHERE f.days_overdue >= MAX(:min_days, 1)
+            GROUP BY f.patron_id
+            HAVING SUM(f.fee) > :fee_over
+            ORDER BY f.patron_id
+        ''', {'as_of': as_of_us, 'week': first_week_days, 'first_rate': first_week_rate,
+              'later_rate': later_rate, 'max_fee': max_fee, 'fee_over': fee_over,
+              'min_days': min_days_overdue, 'due_before': due_before})
+        for row in cursor:
+            yield {
+                'patron_id': row['patron_id'],
+                'overdue_count': row['overdue_count'],
+                'total_fee': row['total_fee'],
+                'loans': json.loads(row['loans']),
+            }
+    finally:
+        conn.close()
+
+# A queued intent that was never sent to the gateway and is past its
+# expires_at (epoch seconds :now); see expire_payment_intents()
+_EXPIRED_INTENT = "status = 'pending' AND attempts = 0 AND expires_at IS NOT NULL AND expires_at <= :now"
+
+# Loans already covered by a recorded payment, reserved by a queued payment
+# intent, or by a charge whose outcome is not known yet
+_PAID_OR_RESERVED = f'''
+    SELECT loan_id, amount FROM late_fee_payments WHERE patron_id = :patron_id
+    UNION ALL
+    SELECT json_extract(item.value, '$.loan_id'), json_extract(item.value, '$.amount')
+    FROM (
+        SELECT items FROM payment_intents
+        WHERE patron_id = :patron_id AND status IN ('pending', 'processing', 'unknown')
+          AND NOT ({_EXPIRED_INTENT})
+    ) i, json_each(i.items) item
+'''
+
+def _patron_outstanding_fees(conn: sqlite3.Connection, patron_id: str, as_of_us: int, first_week_days: int,
+                             first_week_rate: float, later_rate: float, max_fee: float) -> List[Dict]:
+    rows = conn.execute(f'''
+        SELECT f.id AS loan_id, f.book_id, b.title, f.days_overdue,
+               ROUND(f.fee - IFNULL(p.paid, 0), 2) AS amount
+        FROM ({_open_loan_fees_query('AND patron_id = :patron_id')}) f
+        JOIN books b ON b.id = f.book_id
+        LEFT JOIN (
+            SELECT loan_id, SUM(amount) AS paid FROM ({_PAID_OR_RESERVED}) GROUP BY loan_id
+        ) p ON p.loan_id = f.id
+        WHERE ROUND(f.fee - IFNULL(p.paid, 0), 2) > 0
+        ORDER BY f.id
+    ''', {'as_of': as_of_us, 'week': first_week_days, 'first_rate': first_week_rate,
+          'later_rate': later_rate, 'max_fee': max_fee, 'patron_id': patron_id,
+          'now': as_of_us // 1000000}).fetchall()
+    return [dict(row) for row in rows]
+
+@traced
+def get_patron_outstanding_fees(patron_id: str, as_of_us: int, first_week_days: int, first_week_rate: float,
+                                later_rate: float, max_fee: float) -> List[Dict]:
+    """
+    Get the unpaid late fee on each of a patron's open loans in one query.
+
+    Amounts already recorded in late_fee_payments, or reserved by a queued
+    payment intent that has not expired, are subtracted, so a loan that keeps accruing after a
+    payment only owes the difference.
+
+    Returns:
+        list: loan_id, book_id, title, days_overdue and amount per loan that
+        still owes something, in loan order
+    """
+    conn = get_db_connection()
+    try:
+        return _patron_outstanding_fees(conn, patron_id, as_of_us, first_week_days, first_week_rate,
+                                        later_rate, max_fee)
+    finally:
+        conn.close()
+
+def _insert_fee_allocations(conn: sqlite3.Connection, transaction_id: str, patron_id: str, items: List[Dict],
+                            paid_at: datetime):
+    conn.executemany('''
+        INSERT INTO late_fee_payments (transaction_id, patron_id, loan_id, book_id, days_overdue, amount, paid_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(transaction_id, patron_id, item['loan_id'], item['book_id'], item['days_overdue'],
+           item['amount'], to_epoch_seconds(paid_at)) for item in items])
+
+@traced
+def insert_fee_payment(transaction_id: str, patron_id: str, items: List[Dict], paid_at: datetime) -> bool:
+    """Record how one gateway charge was split across loans (items need loan_id, book_id, days_overdue, amount)."""
+    conn = get_db_connection()
+    try:
+        _insert_fee_allocations(conn, transaction_id, patron_id, items, paid_at)
+        conn.commit()
+        conn.close()
+        return True
+    except sqlite3.Error:
+        conn.rollback()
+        conn.close()
+        return False
+
+@traced
+def get_fee_payment_allocations(transaction_id: str) -> List[Dict]:
+    """Get the per-loan allocation recorded for a payment."""
+    conn = get_db_connection()
+    rows = conn.execute('''
+        SELECT loan_id, book_id, days_overdue, amount FROM late_fee_payments
+        WHERE transaction_id = ? ORDER BY loan_id
+    ''', (transaction_id,)).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+def _payment_intent(row: sqlite3.Row) -> Dict:
+    intent = dict(row)
+    intent['items'] = json.loads(intent['items'])
+    for column in ('next_attempt_at', 'created_at', 'updated_at'):
+        intent[column] = from_epoch_seconds(intent[column])
+    if intent['expires_at'] is not None:
+        intent['expires_at'] = from_epoch_seconds(intent['expires_at'])
+    return intent
+
+@traced
+def create_payment_intent(patron_id: str, idempotency_key: str,
+                          describe: Callable[[List[Dict]], Tuple[float, str]], as_of_us: int,
+                          first_week_days: int, first_week_rate: float, later_rate: float,
+                          max_fee: float, expires_in: Optional[int] = None) -> Tuple[str, Optional[Dict]]:
+    """
+    Queue a charge for everything a patron owes, in one write transaction.
+
+    The outstanding fees are computed and the intent (with its per-loan
+    items) is written inside the same BEGIN IMMEDIATE, so the queued amount
+    always matches the loans it reserves. ``describe(items)`` returns the
+    (amount, description) to charge. If no worker has attempted the intent
+    within ``expires_in`` seconds it expires (see expire_payment_intents());
+    None keeps it queued indefinitely.
+
+    Returns:
+        tuple: (status, intent) where status is 'created', 'existing' (the
+        key was seen before, or the patron already has an open intent),
+        'conflict' (the key belongs to another patron), 'no_fees' or 'error'
+    """
+    now = as_of_us // 1000000
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        _expire_payment_intents(conn, now, 'AND patron_id = :patron_id', patron_id)
+        existing = conn.execute('SELECT * FROM payment_intents WHERE idempotency_key = ?',
+                                (idempotency_key,)).fetchone()
+        if existing is None:
+            existing = conn.execute('''
+                SELECT * FROM payment_intents
+                WHERE patron_id = ? AND status IN ('pending', 'processing')
+            ''', (patron_id,)).fetchone()
+        if existing is not None:
+            conn.rollback()
+            return ('existing' if existing['patron_id'] == patron_id else 'conflict'), _payment_intent(existing)
+        
+        items = _patron_outstanding_fees(conn, patron_id, as_of_us, first_week_days, first_week_rate,
+                                         later_rate, max_fee)
+        if not items:
+            conn.rollback()
+            return 'no_fees', None
+        
+        amount, description = describe(items)
+        intent_id = conn.execute('''
+            INSERT INTO payment_intents (idempotency_key, patron_id, amount, description, items,
+                                         next_attempt_at, expires_at, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (idempotency_key, patron_id, amount, description, json.dumps(items), now,
+              None if expires_in is None else now + expires_in, now, now)).lastrowid
+        intent = _payment_intent(conn.execute('SELECT * FROM payment_intents WHERE id = ?',
+                                              (intent_id,)).fetchone())
+        conn.commit()
+        return 'created', intent
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.rollback()
+        return 'error', None
+    finally:
+        conn.close()
+
+# Message of an intent that expired before a worker attempted it
+EXPIRED_MESSAGE = 'Expired: no payment worker picked this payment up; nothing was charged'
+
+def _expire_payment_intents(conn: sqlite3.Connection, now: int, where: str = '',
+                            patron_id: Optional[str] = None) -> int:
+    return conn.execute(f'''
+        UPDATE payment_intents SET status = 'failed', message = :message, updated_at = :now
+        WHERE {_EXPIRED_INTENT} AND next_attempt_at <= :now {where}
+    ''', {'message': EXPIRED_MESSAGE, 'now': now, 'patron_id': patron_id}).rowcount
+
+@traced
+def expire_payment_intents(now: datetime) -> int:
+    """
+    Mark queued intents that were never attempted and are past expires_at as 'failed'.
+
+    Nothing was sent to the gateway for them, so their fees are owed again
+    and the patron can queue a new payment. Intents that were attempted are
+    never expired: the gateway may have charged them.
+
+    Returns:
+        int: Number of intents expired
+    """
+    conn = get_db_connection()
+    try:
+        count = _expire_payment_intents(conn, to_epoch_seconds(now))
+        conn.commit()
+        return count
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.rollback()
+        return 0
+    finally:
+        conn.close()
+
+@traced
+def get_payment_intent(intent_id: int) -> Optional[Dict]:
+    """Get a payment intent by id."""
+    conn = get_db_connection()
+    row = conn.execute('SELECT * FROM payment_intents WHERE id = ?', (intent_id,)).fetchone()
+    conn.close()
+    return _payment_intent(row) if row else None
+
+@traced
+def claim_payment_intents(now: datetime, lease_seconds: int, limit: int) -> List[Dict]:
+    """
+    Claim up to ``limit`` intents that are due for a gateway attempt.
+
+    Claimed intents move to 'processing' with their attempt count bumped and
+    a lease of ``lease_seconds``; an intent whose worker died mid-attempt
+    becomes claimable again when its lease runs out.
+    """
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        # An expired intent's fees may have been paid another way since
+        _expire_payment_intents(conn, to_epoch_seconds(now))
+        rows = conn.execute('''
+            UPDATE payment_intents
+            SET status = 'processing', attempts = attempts + 1,
+                next_attempt_at = :lease_until, updated_at = :now
+            WHERE id IN (
+                SELECT id FROM payment_intents
+                WHERE status IN ('pending', 'processing') AND next_attempt_at <= :now
+                ORDER BY next_attempt_at, id LIMIT :limit
+            )
+            RETURNING *
+        ''', {'now': to_epoch_seconds(now), 'lease_until': to_epoch_seconds(now) + lease_seconds,
+              'limit': limit}).fetchall()
+        conn.commit()
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.rollback()
+        rows = []
+    finally:
+        conn.close()
+    return sorted((_payment_intent(row) for row in rows), key=lambda intent: intent['id'])
+
+@traced
+def record_unknown_payment(patron_id: str, idempotency_key: str, amount: float, description: str,
+                           items: List[Dict], message: str, now: datetime, retry_at: datetime) -> Optional[int]:
+    """
+    Record a charge the gateway may or may not have made (e.g. it timed out) as an 'unknown' intent.
+
+    Its items stay reserved, so no payment path charges them again, until
+    claim_unknown_payments() hands it to a worker that replays the
+    idempotency key (not before ``retry_at``).
+
+    Returns:
+        int or None: The intent id, or None if it could not be written
+    """
+    conn = get_db_connection()
+    try:
+        intent_id = conn.execute('''
+            INSERT INTO payment_intents (idempotency_key, patron_id, amount, description, items, status,
+                                         attempts, next_attempt_at, message, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, 'unknown', 1, ?, ?, ?, ?)
+        ''', (idempotency_key, patron_id, amount, description, json.dumps(items), to_epoch_seconds(retry_at),
+              message, to_epoch_seconds(now), to_epoch_seconds(now))).lastrowid
+        conn.commit()
+        return intent_id
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.rollback()
+        return None
+    finally:
+        conn.close()
+
+@traced
+def claim_unknown_payments(now: datetime, lease_seconds: int, limit: int) -> List[Dict]:
+    """
+    Claim up to ``limit`` 'unknown' intents that are due to be reconciled.
+
+    They keep their status (and so their reservation); only the lease moves
+    on, so a worker that dies mid-replay leaves them to the next one.
+    """
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        rows = conn.execute('''
+            UPDATE payment_intents
+            SET attempts = attempts + 1, next_attempt_at = :lease_until, updated_at = :now
+            WHERE id IN (
+                SELECT id FROM payment_intents
+                WHERE status = 'unknown' AND next_attempt_at <= :now
+                ORDER BY next_attempt_at, id LIMIT :limit
+            )
+            RETURNING *
+        ''', {'now': to_epoch_seconds(now), 'lease_until': to_epoch_seconds(now) + lease_seconds,
+              'limit': limit}).fetchall()
+        conn.commit()
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.rollback()
+        rows = []
+    finally:
+        conn.close()
+    return sorted((_payment_intent(row) for row in rows), key=lambda intent: intent['id'])
+
+@traced
+def complete_payment_intent(intent_id: int, transaction_id: str, message: str, now: datetime,
+                            from_status: str = 'processing') -> bool:
+    """Mark a claimed intent paid and record its per-loan allocation in the same transaction."""
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('''
+            UPDATE payment_intents
+            SET status = 'succeeded', transaction_id = ?, message = ?, updated_at = ?
+            WHERE id = ? AND status = ?
+            RETURNING patron_id, items
+        ''', (transaction_id, message, to_epoch_seconds(now), intent_id, from_status)).fetchone()
+        if row is None:
+            conn.rollback()
+            return False
+        _insert_fee_allocations(conn, transaction_id, row['patron_id'], json.loads(row['items']), now)
+        conn.commit()
+        return True
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+@traced
+def mark_payment_unknown(intent_id: int, message: str, now: datetime, retry_at: datetime) -> bool:
+    """
+    Move a claimed intent whose gateway attempts all errored to 'unknown'.
+
+    Its items stay reserved, and claim_unknown_payments() hands it back to a
+    worker (not before ``retry_at``) to replay its idempotency key.
+    """
+    conn = get_db_connection()
+    cursor = conn.execute('''
+        UPDATE payment_intents SET status = 'unknown', message = ?, next_attempt_at = ?, updated_at = ?
+        WHERE id = ? AND status = 'processing'
+    ''', (message, to_epoch_seconds(retry_at), to_epoch_seconds(now), intent_id))
+    conn.commit()
+    conn.close()
+    return cursor.rowcount == 1
+
+@traced
+def fail_payment_intent(intent_id: int, message: str, now: datetime, retry_at: Optional[datetime] = None,
+                        from_status: str = 'processing') -> bool:
+    """Send a claimed intent back to 'pending' until ``retry_at``, or mark it 'failed' if not given."""
+    conn = get_db_connection()
+    if retry_at is None:
+        cursor = conn.execute('''
+            UPDATE payment_intents SET status = 'failed', message = ?, updated_at = ?
+            WHERE id = ? AND status = ?
+        ''', (message, to_epoch_seconds(now), intent_id, from_status))
+    else:
+        cursor = conn.execute('''
+            UPDATE payment_intents SET status = 'pending', message = ?, next_attempt_at = ?, updated_at = ?
+            WHERE id = ? AND status = 'processing'
+        ''', (message, to_epoch_seconds(retry_at), to_epoch_seconds(now), intent_id))
+    conn.commit()
+    conn.close()
+    return cursor.rowcount == 1
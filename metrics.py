@@ -0,0 +1,370 @@
+"""
+Metrics Module - Request latency histograms and SQL counters in Prometheus text format
+
+Values live in process memory and are cheap to update: per-request SQL
+counts accumulate in a thread-local and are folded into the shared series
+once when the request ends (for a streamed body, once it has been sent). With several worker processes, set
+LIBRARY_METRICS_DIR to a directory shared by them; each process writes a
+snapshot there at most every LIBRARY_METRICS_FLUSH_INTERVAL seconds and
+/metrics reports the sum over every snapshot.
+"""
+
+import atexit
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Tuple
+
+# LIBRARY_METRICS=0 turns off instrumentation and the /metrics endpoint
+METRICS_ENABLED = os.environ.get('LIBRARY_METRICS', '1') != '0'
+METRICS_DIR = os.environ.get('LIBRARY_METRICS_DIR') or None
+FLUSH_INTERVAL = float(os.environ.get('LIBRARY_METRICS_FLUSH_INTERVAL', '1'))
+
+# Histogram buckets (seconds, or queries for the per-request query count)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Counter:
+    """Monotonic per-label-set totals."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1):
+        """Add ``amount``; callers hold the registry lock."""
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def merge(self, labels: Tuple[str, ...], value: float):
+        self.inc(labels, value)
+
+    def samples(self) -> Iterable[Tuple[str, Tuple[str, ...], Tuple[Tuple[str, str], ...], float]]:
+        for labels, value in self.values.items():
+            yield self.name, labels, (), value
+
+
+class Histogram:
+    """Per-label-set bucket counts, sum and count of observed values."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [count per bucket (not cumulative)..., count above the last bucket, sum]
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        """Record one value; callers hold the registry lock."""
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def merge(self, labels: Tuple[str, ...], value: List[float]):
+        entry = self.values.setdefault(labels, [0] * (len(self.buckets) + 1) + [0.0])
+        for i, amount in enumerate(value):
+            entry[i] += amount
+
+    def samples(self):
+        for labels, entry in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), entry[:-1]):
+                cumulative += count
+                yield f'{self.name}_bucket', labels, (('le', _format_value(bound)),), cumulative
+            yield f'{self.name}_sum', labels, (), entry[-1]
+            yield f'{self.name}_count', labels, (), cumulative
+
+
+class Registry:
+    """The process's metrics, updated under one lock."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics: Dict[str, object] = {}
+
+    def add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self) -> Dict[str, List]:
+        """Copy every series as JSON-friendly [labels, value] pairs."""
+        with self.lock:
+            return {name: [[list(labels), value if metric.kind == 'counter' else list(value)]
+                           for labels, value in metric.values.items()]
+                    for name, metric in self.metrics.items()}
+
+    def reset(self):
+        with self.lock:
+            for metric in self.metrics.values():
+                metric.values.clear()
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.add(Histogram(
+    'library_http_request_duration_seconds', 'Time to handle a request, by endpoint, method and status',
+    ('endpoint', 'method', 'status')))
+REQUEST_QUERIES = REGISTRY.add(Histogram(
+    'library_http_request_queries', 'SQL statements executed per request', ('endpoint',), QUERY_COUNT_BUCKETS))
+REQUEST_SQL_SECONDS = REGISTRY.add(Histogram(
+    'library_http_request_sql_seconds', 'Time spent in SQLite per request', ('endpoint',)))
+SQL_QUERIES = REGISTRY.add(Counter('library_sql_queries_total', 'SQL statements executed'))
+SQL_ROWS = REGISTRY.add(Counter('library_sql_rows_total', 'Rows returned by SQL statements'))
+SQL_SECONDS = REGISTRY.add(Counter('library_sql_seconds_total', 'Time spent executing statements and fetching rows'))
+DB_CONNECTIONS = REGISTRY.add(Counter(
+    'library_db_connections_total', 'get_db_connection() calls, by where the connection came from', ('source',)))
+
+
+class QueryStats:
+    """SQL work done by one thread (during one request, or outside requests)."""
+
+    __slots__ = ('queries', 'rows', 'seconds', 'folded')
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+        self.seconds = 0.0
+        self.folded = (0, 0, 0.0)
+
+
+_local = threading.local()
+# Stats of threads that query outside requests (startup, background workers),
+# by thread; folded into the totals when metrics are collected rather than on
+# every query, and dropped once their thread has ended
+_background: Dict[threading.Thread, QueryStats] = {}
+# Size of _background at which threads that have ended are folded and dropped
+# when the next thread registers, so short-lived threads cannot pile up
+_prune_at = 64
+_clock = time.perf_counter
+
+
+def _thread_stats() -> QueryStats:
+    global _prune_at
+    stats = getattr(_local, 'request', None)
+    if stats is None:
+        stats = getattr(_local, 'background', None)
+        if stats is None:
+            stats = _local.background = QueryStats()
+            with REGISTRY.lock:
+                if len(_background) >= _prune_at:
+                    _fold_background()
+                    _prune_at = max(64, 2 * len(_background))
+                _background[threading.current_thread()] = stats
+    return stats
+
+
+def _fold_background():
+    """
+    Add what background threads did since the last fold to the totals and
+    forget threads that have ended; callers hold the registry lock.
+    """
+    for thread, stats in list(_background.items()):
+        # Checked first: a thread that has ended cannot add work after the read
+        ended = not thread.is_alive()
+        queries, rows, seconds = stats.queries, stats.rows, stats.seconds
+        folded_queries, folded_rows, folded_seconds = stats.folded
+        stats.folded = (queries, rows, seconds)
+        SQL_QUERIES.inc((), queries - folded_queries)
+        SQL_ROWS.inc((), rows - folded_rows)
+        SQL_SECONDS.inc((), seconds - folded_seconds)
+        if ended:
+            del _background[thread]
+
+
+_execute = sqlite3.Cursor.execute
+_executemany = sqlite3.Cursor.executemany
+_next = sqlite3.Cursor.__next__
+_fetchone = sqlite3.Cursor.fetchone
+_fetchmany = sqlite3.Cursor.fetchmany
+_fetchall = sqlite3.Cursor.fetchall
+
+
+class MeteredCursor(sqlite3.Cursor):
+    """
+    Cursor that counts statements, returned rows and the time spent in SQLite.
+
+    Work is added to the stats of the thread that executed the statement,
+    without taking a lock.
+    """
+
+    def execute(self, sql, parameters=()):
+        stats = self.stats = _thread_stats()
+        start = _clock()
+        try:
+            return _execute(self, sql, parameters)
+        finally:
+            stats.queries += 1
+            stats.seconds += _clock() - start
+
+    def executemany(self, sql, seq_of_parameters):
+        stats = self.stats = _thread_stats()
+        start = _clock()
+        try:
+            return _executemany(self, sql, seq_of_parameters)
+        finally:
+            stats.queries += 1
+            stats.seconds += _clock() - start
+
+    def __next__(self):
+        start = _clock()
+        row = _next(self)
+        stats = self.stats
+        stats.rows += 1
+        stats.seconds += _clock() - start
+        return row
+
+    def fetchone(self):
+        start = _clock()
+        row = _fetchone(self)
+        stats = self.stats
+        stats.rows += row is not None
+        stats.seconds += _clock() - start
+        return row
+
+    def fetchmany(self, size=None):
+        start = _clock()
+        rows = _fetchmany(self, self.arraysize if size is None else size)
+        stats = self.stats
+        stats.rows += len(rows)
+        stats.seconds += _clock() - start
+        return rows
+
+    def fetchall(self):
+        start = _clock()
+        rows = _fetchall(self)
+        stats = self.stats
+        stats.rows += len(rows)
+        stats.seconds += _clock() - start
+        return rows
+
+
+def record_connection(source: str):
+    """Count one get_db_connection() call ('scoped', 'pooled' or 'new')."""
+    with REGISTRY.lock:
+        DB_CONNECTIONS.inc((source,))
+
+
+def begin_request():
+    """Start collecting this thread's SQL work for a request."""
+    _local.request = QueryStats()
+    _local.started = time.perf_counter()
+
+
+def end_request(endpoint: str, method: str, status: int):
+    """Record the request that begin_request() started on this thread."""
+    stats = getattr(_local, 'request', None)
+    if stats is None:
+        return
+    elapsed = time.perf_counter() - _local.started
+    _local.request = None
+    with REGISTRY.lock:
+        REQUEST_SECONDS.observe((endpoint, method, str(status)), elapsed)
+        REQUEST_QUERIES.observe((endpoint,), stats.queries)
+        REQUEST_SQL_SECONDS.observe((endpoint,), stats.seconds)
+        SQL_QUERIES.inc((), stats.queries)
+        SQL_ROWS.inc((), stats.rows)
+        SQL_SECONDS.inc((), stats.seconds)
+    if METRICS_DIR:
+        flush(force=False)
+
+
+# Multi-process mode: one snapshot file per process, summed when scraped
+_PROCESS_FILE = f'{os.getpid()}-{os.urandom(4).hex()}.json'
+_last_flush = float('-inf')
+_flush_lock = threading.Lock()
+
+
+def flush(force: bool = True):
+    """Write this process's snapshot to METRICS_DIR (at most every FLUSH_INTERVAL unless forced)."""
+    global _last_flush
+    if not METRICS_DIR:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < FLUSH_INTERVAL:
+        return
+    if not _flush_lock.acquire(blocking=force):
+        return
+    try:
+        _last_flush = now
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, _PROCESS_FILE)
+        with REGISTRY.lock:
+            _fold_background()
+        with open(path + '.tmp', 'w') as f:
+            json.dump(REGISTRY.snapshot(), f)
+        os.replace(path + '.tmp', path)
+    finally:
+        _flush_lock.release()
+
+
+if METRICS_DIR:
+    atexit.register(flush)
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _collect() -> Registry:
+    """This process's registry, or the sum of every process's snapshot in METRICS_DIR."""
+    if not METRICS_DIR:
+        with REGISTRY.lock:
+            _fold_background()
+        return REGISTRY
+    flush()
+    total = Registry()
+    for metric in REGISTRY.metrics.values():
+        copy = type(metric)(metric.name, metric.help, metric.labelnames)
+        if isinstance(metric, Histogram):
+            copy.buckets = metric.buckets
+        total.add(copy)
+    for path in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue  # being replaced, or not ours
+        for name, series in snapshot.items():
+            metric = total.metrics.get(name)
+            if metric is not None:
+                for labels, value in series:
+                    metric.merge(tuple(labels), value)
+    return total
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    registry = _collect()
+    lines = []
+    with registry.lock:
+        for metric in registry.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, extra, value in metric.samples():
+                pairs = [f'{key}="{_escape(label)}"' for key, label in zip(metric.labelnames, labels)]
+                pairs += [f'{key}="{label}"' for key, label in extra]
+                lines.append(f"{name}{{{','.join(pairs)}}} {_format_value(value)}" if pairs
+                             else f'{name} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
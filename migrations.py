@@ -0,0 +1,338 @@
+"""
+Schema migration module for Library Management System
+Applies numbered, idempotent schema changes on top of init_database()
+"""
+
+import sqlite3
+from datetime import datetime
+from typing import Callable, List, Tuple, Union
+
+from database import fts5_available, get_db_connection, reconcile_patron_loan_counts
+
+# A migration step is either a SQL statement or a callable taking the connection
+Step = Union[str, Callable[[sqlite3.Connection], None]]
+
+def _create_books_fts(conn: sqlite3.Connection):
+    """Create the books_fts full-text index and the triggers that sync it."""
+    if not fts5_available(conn):
+        return  # search_books_fulltext() reports unavailable; callers fall back
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+            title, author,
+            content='books', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+            INSERT INTO books_fts (rowid, title, author) VALUES (new.id, new.title, new.author);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author)
+            VALUES ('delete', old.id, old.title, old.author);
+        END
+    ''')
+    # Only title/author edits touch the index; availability updates do not
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author)
+            VALUES ('delete', old.id, old.title, old.author);
+            INSERT INTO books_fts (rowid, title, author) VALUES (new.id, new.title, new.author);
+        END
+    ''')
+    conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+
+
+def _create_patron_counters(conn: sqlite3.Connection):
+    """Create the patrons summary table, its maintenance triggers, and fill it."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS patrons (
+            patron_id TEXT PRIMARY KEY,
+            open_loans INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # Every write path that opens or closes a loan updates the counter in the
+    # same transaction, whichever helper issued it
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS patrons_loan_opened AFTER INSERT ON borrow_records
+        WHEN new.return_date IS NULL BEGIN
+            INSERT INTO patrons (patron_id, open_loans) VALUES (new.patron_id, 1)
+            ON CONFLICT (patron_id) DO UPDATE SET open_loans = open_loans + 1;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS patrons_loan_closed AFTER UPDATE OF return_date ON borrow_records
+        WHEN old.return_date IS NULL AND new.return_date IS NOT NULL BEGIN
+            UPDATE patrons SET open_loans = open_loans - 1 WHERE patron_id = old.patron_id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS patrons_loan_reopened AFTER UPDATE OF return_date ON borrow_records
+        WHEN old.return_date IS NOT NULL AND new.return_date IS NULL BEGIN
+            INSERT INTO patrons (patron_id, open_loans) VALUES (new.patron_id, 1)
+            ON CONFLICT (patron_id) DO UPDATE SET open_loans = open_loans + 1;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS patrons_loan_deleted AFTER DELETE ON borrow_records
+        WHEN old.return_date IS NULL BEGIN
+            UPDATE patrons SET open_loans = open_loans - 1 WHERE patron_id = old.patron_id;
+        END
+    ''')
+    reconcile_patron_loan_counts(conn)
+
+
+def _create_catalog_generation(conn: sqlite3.Connection):
+    """Create the catalog_generation row that get_catalog_version() reads, and its triggers."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            nonce TEXT NOT NULL,
+            generation INTEGER NOT NULL
+        )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO catalog_generation (id, nonce, generation) "
+                 "VALUES (1, lower(hex(randomblob(4))), 0)")
+    # Any committed change to books, from any process, moves the ETag and
+    # search cache keys on
+    for event in ('INSERT', 'DELETE', 'UPDATE'):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS catalog_generation_books_{event.lower()} AFTER {event} ON books BEGIN
+                UPDATE catalog_generation SET generation = generation + 1 WHERE id = 1;
+            END
+        ''')
+
+
+def _create_catalog_rewrites(conn: sqlite3.Connection):
+    """
+    Add catalog_generation.rewrites: bumped by changes that a reader catching
+    up on new book ids would miss (deleted books, edited titles or authors).
+    """
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(catalog_generation)')}
+    if 'rewrites' not in columns:
+        conn.execute('ALTER TABLE catalog_generation ADD COLUMN rewrites INTEGER NOT NULL DEFAULT 0')
+    for name, event in (('delete', 'DELETE'), ('update', 'UPDATE OF title, author')):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS catalog_rewrites_books_{name} AFTER {event} ON books BEGIN
+                UPDATE catalog_generation SET rewrites = rewrites + 1 WHERE id = 1;
+            END
+        ''')
+
+
+def _add_payment_intent_expiry(conn: sqlite3.Connection):
+    """Add payment_intents.expires_at: when a queued intent that no worker picked up stops reserving its fees."""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(payment_intents)')}
+    if 'expires_at' not in columns:
+        conn.execute('ALTER TABLE payment_intents ADD COLUMN expires_at INTEGER')
+
+
+def _epoch(column: str) -> str:
+    # ISO text -> whole seconds since the epoch; values already converted pass through
+    return f"CASE typeof({column}) WHEN 'text' THEN CAST(strftime('%s', {column}) AS INTEGER) ELSE {column} END"
+
+
+def _convert_loan_dates_to_epoch(conn: sqlite3.Connection):
+    """
+    Rebuild borrow_records with INTEGER epoch-second date columns.
+
+    SQLite cannot change a column's type in place, so the table is copied,
+    swapped in, and the indexes and triggers from earlier migrations are
+    recreated on it.
+    """
+    sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'borrow_records'").fetchone()
+    conn.execute('DROP TABLE IF EXISTS borrow_records_epoch')
+    conn.execute('''
+        CREATE TABLE borrow_records_epoch (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patron_id TEXT NOT NULL,
+            book_id INTEGER NOT NULL,
+            borrow_date INTEGER NOT NULL,
+            due_date INTEGER NOT NULL,
+            return_date INTEGER,
+            FOREIGN KEY (book_id) REFERENCES books (id)
+        )
+    ''')
+    conn.execute(f'''
+        INSERT INTO borrow_records_epoch (id, patron_id, book_id, borrow_date, due_date, return_date)
+        SELECT id, patron_id, book_id, {_epoch('borrow_date')}, {_epoch('due_date')}, {_epoch('return_date')}
+        FROM borrow_records
+    ''')
+    conn.execute('DROP TABLE borrow_records')
+    conn.execute('ALTER TABLE borrow_records_epoch RENAME TO borrow_records')
+    if sequence:
+        conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'borrow_records'",
+                     (sequence[0],))
+
+    # Dropping the old table dropped its indexes and triggers too
+    for version, _, steps in MIGRATIONS:
+        if version in _BORROW_RECORDS_SCHEMA:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+
+
+# Migrations whose indexes/triggers live on borrow_records and must be
+# recreated whenever the table is rebuilt
+_BORROW_RECORDS_SCHEMA = (1, 2, 3, 6)
+
+# Numbered migrations, applied in order. Never renumber or edit a shipped entry;
+# append a new one instead. Every step must be safe to re-run.
+MIGRATIONS: List[Tuple[int, str, List[Step]]] = [
+    (1, 'index open loans by patron', [
+        # get_patron_borrow_count / get_patron_borrowed_books:
+        #   WHERE patron_id = ? AND return_date IS NULL
+        '''CREATE INDEX IF NOT EXISTS idx_borrow_records_patron_return
+           ON borrow_records (patron_id, return_date)''',
+    ]),
+    (2, 'index borrowing history by patron', [
+        # get_patron_borrowing_history: WHERE patron_id = ? ORDER BY borrow_date DESC
+        '''CREATE INDEX IF NOT EXISTS idx_borrow_records_patron_borrow_date
+           ON borrow_records (patron_id, borrow_date)''',
+    ]),
+    (3, 'partial index of open loans by book', [
+        # update_borrow_record_return_date:
+        #   WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
+        '''CREATE INDEX IF NOT EXISTS idx_borrow_records_open_book
+           ON borrow_records (book_id, patron_id) WHERE return_date IS NULL''',
+    ]),
+    (4, 'full-text index of book titles and authors', [
+        _create_books_fts,
+    ]),
+    (5, 'index books by catalog sort order', [
+        # get_all_books keyset pages: WHERE (title, id) > (?, ?) ORDER BY title, id
+        '''CREATE INDEX IF NOT EXISTS idx_books_title_id
+           ON books (title, id)''',
+    ]),
+    (6, 'materialized open-loan counters per patron', [
+        _create_patron_counters,
+    ]),
+    (7, 'store loan dates as integer epoch seconds', [
+        _convert_loan_dates_to_epoch,
+        # Overdue scans: WHERE return_date IS NULL AND due_date <= ?
+        '''CREATE INDEX IF NOT EXISTS idx_borrow_records_open_due
+           ON borrow_records (due_date) WHERE return_date IS NULL''',
+    ]),
+    (8, 'per-loan late fee payment allocations', [
+        '''CREATE TABLE IF NOT EXISTS late_fee_payments (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               transaction_id TEXT NOT NULL,
+               patron_id TEXT NOT NULL,
+               loan_id INTEGER NOT NULL,
+               book_id INTEGER NOT NULL,
+               days_overdue INTEGER NOT NULL,
+               amount REAL NOT NULL,
+               paid_at INTEGER NOT NULL,
+               FOREIGN KEY (loan_id) REFERENCES borrow_records (id)
+           )''',
+        # get_patron_outstanding_fees: amount already paid per open loan
+        '''CREATE INDEX IF NOT EXISTS idx_late_fee_payments_patron_loan
+           ON late_fee_payments (patron_id, loan_id)''',
+        '''CREATE INDEX IF NOT EXISTS idx_late_fee_payments_transaction
+           ON late_fee_payments (transaction_id)''',
+    ]),
+    (9, 'payment intent outbox', [
+        '''CREATE TABLE IF NOT EXISTS payment_intents (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               idempotency_key TEXT UNIQUE NOT NULL,
+               patron_id TEXT NOT NULL,
+               amount REAL NOT NULL,
+               description TEXT NOT NULL,
+               items TEXT NOT NULL,
+               status TEXT NOT NULL DEFAULT 'pending',
+               attempts INTEGER NOT NULL DEFAULT 0,
+               next_attempt_at INTEGER NOT NULL,
+               transaction_id TEXT,
+               message TEXT,
+               created_at INTEGER NOT NULL,
+               updated_at INTEGER NOT NULL
+           )''',
+        # claim_payment_intents: WHERE status IN (...) AND next_attempt_at <= ?
+        '''CREATE INDEX IF NOT EXISTS idx_payment_intents_due
+           ON payment_intents (next_attempt_at) WHERE status IN ('pending', 'processing')''',
+        # At most one open intent per patron, so queued charges never overlap
+        '''CREATE UNIQUE INDEX IF NOT EXISTS idx_payment_intents_open_patron
+           ON payment_intents (patron_id) WHERE status IN ('pending', 'processing')''',
+    ]),
+    (10, 'catalog generation shared by every process', [
+        _create_catalog_generation,
+    ]),
+    (11, 'count catalog rewrites for the search index', [
+        _create_catalog_rewrites,
+    ]),
+    (12, 'index payments awaiting reconciliation', [
+        # claim_unknown_payments: WHERE status = 'unknown' AND next_attempt_at <= ?
+        '''CREATE INDEX IF NOT EXISTS idx_payment_intents_unknown
+           ON payment_intents (next_attempt_at) WHERE status = 'unknown' ''',
+    ]),
+    (13, 'expire payment intents no worker picked up', [
+        _add_payment_intent_expiry,
+    ]),
+]
+
+
+def _ensure_version_table(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    ''')
+    conn.commit()
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Get the highest applied migration version (0 if none)."""
+    _ensure_version_table(conn)
+    row = conn.execute('SELECT MAX(version) FROM schema_migrations').fetchone()
+    return row[0] or 0
+
+
+def apply_migrations(conn: sqlite3.Connection) -> List[int]:
+    """
+    Apply every pending migration on the given connection.
+
+    Each migration runs in its own BEGIN IMMEDIATE transaction and re-checks
+    the recorded version inside it, so concurrent workers never apply the same
+    migration twice.
+
+    Returns:
+        list: Versions applied by this call
+    """
+    _ensure_version_table(conn)
+    applied = []
+    for version, name, steps in MIGRATIONS:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            done = conn.execute(
+                'SELECT 1 FROM schema_migrations WHERE version = ?', (version,)
+            ).fetchone()
+            if not done:
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                conn.execute(
+                    'INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)',
+                    (version, name, datetime.now().isoformat())
+                )
+                applied.append(version)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return applied
+
+
+def run_migrations() -> List[int]:
+    """Apply pending migrations to the configured database."""
+    conn = get_db_connection()
+    try:
+        return apply_migrations(conn)
+    finally:
+        conn.close()
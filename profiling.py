@@ -0,0 +1,239 @@
+"""
+Profiling Module - On-demand cProfile / tracemalloc capture for single requests
+
+A request is profiled when it carries the X-Profile header with the
+LIBRARY_PROFILE_TOKEN value, or when its endpoint is picked by the sample
+rates in LIBRARY_PROFILE_SAMPLE (e.g. ``search.search_books=0.05,*=0.001``).
+X-Profile-Memory: 1 (or LIBRARY_PROFILE_MEMORY=1) also records allocations
+with tracemalloc. Each profile is written to LIBRARY_PROFILE_DIR as
+``<id>.pstats``, ``<id>.tracemalloc`` (when memory was traced) and an
+``<id>.json`` summary; only the newest LIBRARY_PROFILE_KEEP are kept.
+
+Only one request is profiled at a time: a second one arriving meanwhile
+runs unprofiled. tracemalloc is process-wide, so allocations made by other
+requests running at the same time show up in the snapshot too.
+"""
+
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Dict, List, Optional
+
+PROFILE_TOKEN = os.environ.get('LIBRARY_PROFILE_TOKEN') or None
+PROFILE_DIR = os.environ.get('LIBRARY_PROFILE_DIR', 'profiles')
+PROFILE_KEEP = int(os.environ.get('LIBRARY_PROFILE_KEEP', '100'))
+PROFILE_MEMORY = os.environ.get('LIBRARY_PROFILE_MEMORY', '0') == '1'
+
+# Frames kept per allocation traceback while tracemalloc runs
+TRACEMALLOC_FRAMES = 10
+
+# Functions and allocation sites listed in each profile's summary
+SUMMARY_SIZE = 20
+
+TOKEN_HEADER = 'X-Profile'
+MEMORY_HEADER = 'X-Profile-Memory'
+ID_HEADER = 'X-Profile-Id'
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """Read ``endpoint=rate,...`` ('*' matches every endpoint) into a dict."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        endpoint, sep, rate = item.partition('=')
+        try:
+            value = float(rate)
+        except ValueError:
+            value = -1
+        if not sep or not endpoint.strip() or not 0 <= value <= 1:
+            raise ValueError(f'Invalid profile sample rate: {item!r} (use endpoint=0..1)')
+        rates[endpoint.strip()] = value
+    return rates
+
+
+PROFILE_SAMPLE_RATES = parse_sample_rates(os.environ.get('LIBRARY_PROFILE_SAMPLE', ''))
+
+
+def profiling_enabled() -> bool:
+    """Whether any request can be profiled (a token or a sample rate is configured)."""
+    return PROFILE_TOKEN is not None or bool(PROFILE_SAMPLE_RATES)
+
+
+def token_matches(value: Optional[str]) -> bool:
+    return PROFILE_TOKEN is not None and value is not None and hmac.compare_digest(value, PROFILE_TOKEN)
+
+
+def choose(endpoint: str, token: Optional[str], memory_header: Optional[str]) -> Optional[Dict]:
+    """
+    Decide whether to profile a request.
+
+    Returns:
+        dict or None: How to profile it ('trigger' is 'header' or 'sample';
+        'memory' says whether to run tracemalloc), or None to skip it
+    """
+    if token_matches(token):
+        return {'trigger': 'header', 'memory': PROFILE_MEMORY or memory_header == '1'}
+    rate = PROFILE_SAMPLE_RATES.get(endpoint, PROFILE_SAMPLE_RATES.get('*', 0))
+    if rate and random.random() < rate:
+        return {'trigger': 'sample', 'memory': PROFILE_MEMORY}
+    return None
+
+
+class RequestProfile:
+    """cProfile (and optionally tracemalloc) running for one request."""
+
+    def __init__(self, endpoint: str, method: str, path: str, trigger: str, memory: bool):
+        self.endpoint = endpoint
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.memory = memory and not tracemalloc.is_tracing()
+        self.id = f"{datetime.now():%Y%m%dT%H%M%S%f}-{endpoint}-{os.urandom(3).hex()}"
+        self.profiler = cProfile.Profile()
+        self.started = None
+        self.seconds = None
+
+    def start(self):
+        if self.memory:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.started = time.perf_counter()
+        self.profiler.enable()
+
+    def stop(self) -> Optional[tracemalloc.Snapshot]:
+        self.profiler.disable()
+        self.seconds = time.perf_counter() - self.started
+        if not self.memory:
+            return None
+        try:
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+            ))
+            self.peak_bytes = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return snapshot
+
+    def write(self, status: int, snapshot: Optional[tracemalloc.Snapshot]) -> Dict:
+        """Save the profile files and summary to PROFILE_DIR; returns the summary."""
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, self.id)
+        self.profiler.dump_stats(base + '.pstats')
+        files = [self.id + '.pstats']
+
+        stats = pstats.Stats(self.profiler)
+        top = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:SUMMARY_SIZE]
+        summary = {
+            'id': self.id,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'endpoint': self.endpoint,
+            'method': self.method,
+            'path': self.path,
+            'status': status,
+            'trigger': self.trigger,
+            'seconds': round(self.seconds, 6),
+            'functions': [{'function': pstats.func_std_string(func), 'calls': calls,
+                           'own_seconds': round(own, 6), 'cumulative_seconds': round(cumulative, 6)}
+                          for func, (_, calls, own, cumulative, _) in top],
+        }
+        if snapshot is not None:
+            snapshot.dump(base + '.tracemalloc')
+            files.append(self.id + '.tracemalloc')
+            allocations = snapshot.statistics('lineno')
+            summary['memory'] = {
+                'peak_bytes': self.peak_bytes,
+                'allocated_bytes': sum(stat.size for stat in allocations),
+                'top': [{'location': str(stat.traceback[0]), 'bytes': stat.size, 'blocks': stat.count}
+                        for stat in allocations[:SUMMARY_SIZE]],
+            }
+        summary['files'] = files
+
+        with open(base + '.json.tmp', 'w') as f:
+            json.dump(summary, f, indent=2)
+        os.replace(base + '.json.tmp', base + '.json')
+        _prune()
+        return summary
+
+
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def begin(endpoint: str, method: str, path: str, token: Optional[str],
+          memory_header: Optional[str]) -> Optional[RequestProfile]:
+    """Start profiling this thread's request if it is chosen and no other request is being profiled."""
+    plan = choose(endpoint, token, memory_header)
+    if plan is None or not _lock.acquire(blocking=False):
+        return None
+    profile = _local.profile = RequestProfile(endpoint, method, path, **plan)
+    try:
+        profile.start()
+    except Exception:
+        _local.profile = None
+        _lock.release()
+        raise
+    return profile
+
+
+def end(status: int) -> Optional[Dict]:
+    """Stop and save the profile begun on this thread; returns its summary."""
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        return None
+    _local.profile = None
+    try:
+        return profile.write(status, profile.stop())
+    finally:
+        _lock.release()
+
+
+def abandon():
+    """Stop a profile that end() never saw (the request failed before a response was made)."""
+    profile = getattr(_local, 'profile', None)
+    if profile is not None:
+        _local.profile = None
+        try:
+            profile.stop()
+        finally:
+            _lock.release()
+
+
+def _summaries() -> List[Dict]:
+    try:
+        names = [name for name in os.listdir(PROFILE_DIR) if name.endswith('.json')]
+    except FileNotFoundError:
+        return []
+    summaries = []
+    for name in names:
+        try:
+            with open(os.path.join(PROFILE_DIR, name)) as f:
+                summaries.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return sorted(summaries, key=lambda summary: summary['id'], reverse=True)
+
+
+def list_profiles() -> List[Dict]:
+    """Saved profiles, newest first, without their per-function details."""
+    return [{key: value for key, value in summary.items() if key not in ('functions', 'memory')}
+            for summary in _summaries()]
+
+
+def get_profile(profile_id: str) -> Optional[Dict]:
+    return next((summary for summary in _summaries() if summary['id'] == profile_id), None)
+
+
+def _prune():
+    """Delete the oldest profiles beyond PROFILE_KEEP."""
+    for summary in _summaries()[PROFILE_KEEP:]:
+        for name in summary.get('files', []) + [summary['id'] + '.json']:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, name))
+            except FileNotFoundError:
+                pass
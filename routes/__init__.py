@@ -6,6 +6,10 @@ from .catalog_routes import catalog_bp
 from .borrowing_routes import borrowing_bp
 from .search_routes import search_bp
 from .api_routes import api_bp
+from .metrics_routes import metrics_bp
+from .profiling_routes import profiling_bp
+import metrics
+import profiling
 
 def register_blueprints(app):
     """Register all route blueprints with the Flask app."""
@@ -13,3 +17,7 @@ def register_blueprints(app):
     app.register_blueprint(borrowing_bp)
     app.register_blueprint(search_bp)
     app.register_blueprint(api_bp)
+    if metrics.METRICS_ENABLED:
+        app.register_blueprint(metrics_bp)
+    if profiling.profiling_enabled():
+        app.register_blueprint(profiling_bp)
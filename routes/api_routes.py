@@ -2,8 +2,15 @@
 API Routes - JSON API endpoints
 """
 
-from flask import Blueprint, jsonify, request
-from services.library_service import calculate_late_fee_for_book, search_books_in_catalog
+import json
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context, url_for
+from routes.http_cache import conditional_on_catalog
+from services.fee_engine import iter_overdue_report
+from services.payment_outbox import get_payment_status, submit_fee_payment
+from services.library_service import (
+    calculate_late_fee_for_book, search_books_in_catalog, next_page_cursor, parse_page_params,
+    borrow_books_in_batch, return_books_in_batch, MAX_BATCH_SIZE
+)
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
@@ -16,7 +23,44 @@ def get_late_fee(patron_id, book_id):
     result = calculate_late_fee_for_book(patron_id, book_id)
     return jsonify(result), 501 if 'not implemented' in result.get('status', '') else 200
 
+def _payment_json(intent):
+    return dict(intent, **{column: intent[column] and intent[column].isoformat()
+                           for column in ('next_attempt_at', 'expires_at', 'created_at', 'updated_at')},
+                status_url=url_for('api.payment_status_api', intent_id=intent['id']))
+
+@api_bp.route('/late_fees/<patron_id>/pay', methods=['POST'])
+def pay_all_late_fees_api(patron_id):
+    """
+    Queue one gateway charge for all of a patron's late fees.
+    Payment API for R5: Late Fee Calculation
+
+    Responds 202 as soon as the payment is queued; poll ``status_url`` for
+    the result. Send an ``Idempotency-Key`` header to make retries of this
+    request safe. Responds 503 when this deployment has no payment worker,
+    since a queued payment would never be charged.
+    """
+    if not current_app.config.get('PAYMENT_OUTBOX_DRAINED'):
+        return jsonify({'error': 'Payments are not available right now. Please try again later.'}), 503
+    
+    error, intent = submit_fee_payment(patron_id, request.headers.get('Idempotency-Key'))
+    if error:
+        return jsonify({'error': error}), 400
+    
+    body = _payment_json(intent)
+    return jsonify(body), 202, {'Location': body['status_url']}
+
+@api_bp.route('/payments/<int:intent_id>')
+def payment_status_api(intent_id):
+    """
+    Current state of a queued payment: pending, processing, succeeded or failed.
+    """
+    intent = get_payment_status(intent_id)
+    if intent is None:
+        return jsonify({'error': 'Payment not found'}), 404
+    return jsonify(_payment_json(intent))
+
 @api_bp.route('/search')
+@conditional_on_catalog
 def search_books_api():
     """
     Search for books via API endpoint.
@@ -24,16 +68,99 @@ def search_books_api():
     """
     search_term = request.args.get('q', '').strip()
     search_type = request.args.get('type', 'title')
+    mode = request.args.get('mode')
     
     if not search_term:
         return jsonify({'error': 'Search term is required'}), 400
     
+    try:
+        limit, after = parse_page_params(request.args.get('limit'), request.args.get('after'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     # Use business logic function
-    books = search_books_in_catalog(search_term, search_type)
+    books = search_books_in_catalog(search_term, search_type, mode, limit=limit, after=after)
     
     return jsonify({
         'search_term': search_term,
         'search_type': search_type,
         'results': books,
-        'count': len(books)
+        'count': len(books),
+        'next_cursor': next_page_cursor(books, limit)
+    })
+
+@api_bp.route('/reports/overdue')
+def overdue_report():
+    """
+    Library-wide overdue loans and per-patron late fee totals.
+    Collections report built on R5: Late Fee Calculation
+
+    Query parameters: ``fee_over`` (only patrons whose total fee is greater)
+    and ``min_days`` (only loans at least this many days overdue). The report
+    is streamed as JSON Lines, one patron per line.
+    """
+    try:
+        fee_over = float(request.args.get('fee_over', 0))
+        min_days = int(request.args.get('min_days', 1))
+    except ValueError:
+        return jsonify({'error': 'fee_over must be a number and min_days an integer'}), 400
+    
+    rows = iter_overdue_report(fee_over=fee_over, min_days_overdue=min_days)
+    lines = (json.dumps(row) + '\n' for row in rows)
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+def _batch_operations(payload):
+    """
+    Read a list of (patron_id, book_id) pairs from a batch request body.
+
+    Accepts ``{"operations": [...]}`` or a bare list, where each item is
+    ``{"patron_id": ..., "book_id": ...}`` or ``[patron_id, book_id]``.
+    Returns an error message instead when the body is malformed.
+    """
+    items = payload.get('operations') if isinstance(payload, dict) else payload
+    if not isinstance(items, list) or not items:
+        return None, 'A non-empty list of operations is required'
+    if len(items) > MAX_BATCH_SIZE:
+        return None, f'At most {MAX_BATCH_SIZE} operations are allowed per batch'
+    
+    operations = []
+    for item in items:
+        if isinstance(item, dict) and 'patron_id' in item and 'book_id' in item:
+            operations.append((item['patron_id'], item['book_id']))
+        elif isinstance(item, list) and len(item) == 2:
+            operations.append((item[0], item[1]))
+        else:
+            return None, 'Each operation needs a patron_id and a book_id'
+    return operations, None
+
+def _batch_response(results):
+    succeeded = sum(1 for result in results if result['success'])
+    return jsonify({
+        'results': results,
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded
     })
+
+@api_bp.route('/borrow/batch', methods=['POST'])
+def borrow_books_batch_api():
+    """
+    Borrow several books in one request (kiosk checkout).
+    Batch API for R3: Book Borrowing
+    """
+    operations, error = _batch_operations(request.get_json(silent=True))
+    if error:
+        return jsonify({'error': error}), 400
+    
+    return _batch_response(borrow_books_in_batch(operations))
+
+@api_bp.route('/return/batch', methods=['POST'])
+def return_books_batch_api():
+    """
+    Return several books in one request (drop-box sorter).
+    Batch API for R4: Book Return Processing
+    """
+    operations, error = _batch_operations(request.get_json(silent=True))
+    if error:
+        return jsonify({'error': error}), 400
+    
+    return _batch_response(return_books_in_batch(operations))
@@ -2,25 +2,61 @@
 Catalog Routes - Book catalog related endpoints
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash
-from database import get_all_books
-from services.library_service import add_book_to_catalog
+from itertools import chain
+from typing import Iterable, Iterator
+from flask import Blueprint, Response, render_template, stream_template, request, redirect, url_for, flash
+from database import get_all_books, iter_all_books
+from routes.http_cache import conditional_on_catalog
+from services.library_service import add_book_to_catalog, next_page_cursor, parse_page_params, DEFAULT_PAGE_SIZE
 
 catalog_bp = Blueprint('catalog', __name__)
 
+# Template fragments are joined into chunks of this many pieces when streaming
+STREAM_CHUNK_SIZE = 256
+
+def _buffered(fragments: Iterable[str], size: int) -> Iterator[str]:
+    """Join small template fragments into larger chunks before sending."""
+    buffer = []
+    for fragment in fragments:
+        buffer.append(fragment)
+        if len(buffer) >= size:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
 @catalog_bp.route('/')
 def index():
     """Home page redirects to catalog."""
     return redirect(url_for('catalog.catalog'))
 
 @catalog_bp.route('/catalog')
+@conditional_on_catalog
 def catalog():
     """
-    Display all books in the catalog.
+    Display one page of books in the catalog.
     Implements R2: Book Catalog Display
+
+    ``?all=1`` streams the full shelf list instead, rendering rows as they
+    are read from the database so memory use does not grow with the catalog.
     """
-    books = get_all_books()
-    return render_template('catalog.html', books=books)
+    if request.args.get('all') == '1':
+        books = iter_all_books()
+        first = next(books, None)
+        books = chain([first], books) if first is not None else []
+        fragments = stream_template('catalog.html', books=books, full_list=True, is_first_page=True)
+        return Response(_buffered(fragments, STREAM_CHUNK_SIZE), mimetype='text/html')
+    
+    try:
+        limit, after = parse_page_params(request.args.get('limit'), request.args.get('after'))
+    except ValueError as e:
+        flash(f'{e}.', 'error')
+        limit, after = DEFAULT_PAGE_SIZE, None
+    
+    books = get_all_books(limit=limit, after=after)
+    next_cursor = next_page_cursor(books, limit)
+    return render_template('catalog.html', books=books, limit=limit,
+                           next_cursor=next_cursor, is_first_page=after is None)
 
 @catalog_bp.route('/add_book', methods=['GET', 'POST'])
 def add_book():
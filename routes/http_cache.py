@@ -0,0 +1,40 @@
+"""
+HTTP Cache - Conditional GET support for catalog-backed pages
+ETags are derived from the catalog generation, so an unchanged catalog is
+answered with 304 Not Modified before any query or template rendering
+"""
+
+from functools import wraps
+from flask import Response, make_response, request, session
+from database import get_catalog_version
+
+
+def catalog_etag() -> str:
+    """Get the ETag value for responses built from the current catalog."""
+    return f'catalog-{get_catalog_version()}'
+
+
+def conditional_on_catalog(view):
+    """
+    Answer GETs with 304 when the client's ETag matches the catalog generation.
+
+    Responses that would show pending flash messages are always rendered, so
+    a message is never lost behind a cached page.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'GET' or '_flashes' in session:
+            return view(*args, **kwargs)
+
+        # Taken before the view runs: a write during rendering only makes the tag older
+        etag = catalog_etag()
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return wrapper
@@ -0,0 +1,37 @@
+"""
+Metrics Routes - Request timing hooks and the Prometheus scrape endpoint
+"""
+
+from functools import partial
+from inspect import isgenerator
+from flask import Blueprint, Response, request
+import metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.before_app_request
+def start_request_timer():
+    """Start timing the request and counting the SQL it runs."""
+    metrics.begin_request()
+
+@metrics_bp.after_app_request
+def record_request(response):
+    """
+    Record the request's latency and SQL work under its endpoint.
+
+    A streamed body (``/catalog?all=1``, ``/api/reports/overdue``) runs its
+    queries after the view returns, so the request is recorded when the
+    server closes the response instead, with the time spent sending it.
+    """
+    end = partial(metrics.end_request, request.endpoint or 'unmatched', request.method, response.status_code)
+    # Not is_streamed: error pages (HTTPException) are built before this runs
+    if isgenerator(response.response):
+        response.call_on_close(end)
+    else:
+        end()
+    return response
+
+@metrics_bp.route('/metrics')
+def metrics_endpoint():
+    """Every metric in the Prometheus text format (summed over all worker processes)."""
+    return Response(metrics.render(), mimetype=None, content_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,66 @@
+"""
+Profiling Routes - Per-request profiling hooks and the profile index
+"""
+
+import os
+from flask import Blueprint, abort, jsonify, request, send_from_directory, url_for
+import profiling
+
+profiling_bp = Blueprint('profiling', __name__, url_prefix='/profiles')
+
+@profiling_bp.before_app_request
+def start_profile():
+    """Profile the request if it carries the profiling token or its endpoint is sampled."""
+    if request.blueprint == 'profiling':
+        return
+    profiling.begin(request.endpoint or 'unmatched', request.method, request.full_path,
+                    request.headers.get(profiling.TOKEN_HEADER), request.headers.get(profiling.MEMORY_HEADER))
+
+@profiling_bp.after_app_request
+def save_profile(response):
+    """Save the request's profile and name it in the X-Profile-Id header."""
+    summary = profiling.end(response.status_code)
+    if summary is not None:
+        response.headers[profiling.ID_HEADER] = summary['id']
+    return response
+
+@profiling_bp.teardown_app_request
+def discard_profile(exc=None):
+    profiling.abandon()
+
+@profiling_bp.before_request
+def require_token():
+    """
+    The profile index is only served to requests carrying the profiling token.
+
+    Without a configured token (sampling only) the routes do not exist; the
+    profiles are read from LIBRARY_PROFILE_DIR instead.
+    """
+    if profiling.PROFILE_TOKEN is None:
+        abort(404)
+    if not profiling.token_matches(request.headers.get(profiling.TOKEN_HEADER)):
+        return jsonify({'error': f'Send the profiling token in the {profiling.TOKEN_HEADER} header'}), 403
+
+def _with_links(summary):
+    return dict(summary, url=url_for('profiling.profile_detail', profile_id=summary['id']),
+                files=[url_for('profiling.profile_file', name=name) for name in summary['files']])
+
+@profiling_bp.route('')
+def profile_index():
+    """Saved profiles, newest first."""
+    return jsonify({'profiles': [_with_links(summary) for summary in profiling.list_profiles()]})
+
+@profiling_bp.route('/<profile_id>')
+def profile_detail(profile_id):
+    """One profile's summary: slowest functions and, if traced, top allocation sites."""
+    summary = profiling.get_profile(profile_id)
+    if summary is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return jsonify(_with_links(summary))
+
+@profiling_bp.route('/files/<name>')
+def profile_file(name):
+    """Download a .pstats (load with pstats.Stats) or .tracemalloc (tracemalloc.Snapshot.load) file."""
+    if not name.endswith(('.pstats', '.tracemalloc')):
+        abort(404)
+    return send_from_directory(os.path.abspath(profiling.PROFILE_DIR), name, as_attachment=True)
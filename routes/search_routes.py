@@ -3,11 +3,13 @@ Search Routes - Book search functionality
 """
 
 from flask import Blueprint, render_template, request, flash
+from routes.http_cache import conditional_on_catalog
 from services.library_service import search_books_in_catalog
 
 search_bp = Blueprint('search', __name__)
 
 @search_bp.route('/search')
+@conditional_on_catalog
 def search_books():
     """
     Search for books in the catalog.
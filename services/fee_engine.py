@@ -0,0 +1,152 @@
+"""
+Fee Engine Module - Late fee rules (R5) for one loan or every open loan
+Holds the single copy of the fee formula used by returns, the late fee API,
+patron reports and library-wide billing
+"""
+
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from database import (
+    create_payment_intent, get_open_loan_fees, get_patron_outstanding_fees, iter_open_loan_due_dates,
+    iter_overdue_patrons
+)
+
+try:
+    import numpy as np
+except ImportError:  # optional: billing falls back to the SQL engine
+    np = None
+
+# R5 fee schedule
+FIRST_WEEK_DAYS = 7
+FIRST_WEEK_RATE = 0.50
+LATER_RATE = 1.00
+MAX_FEE_PER_BOOK = 15.00
+
+ENGINES = ('numpy', 'sql')
+
+_EPOCH = datetime(1970, 1, 1)
+_DAY_US = 86400 * 1000000
+
+
+def late_fee_for_days(days_overdue: int) -> float:
+    """Get the capped (unrounded) late fee for a loan this many days overdue."""
+    if days_overdue <= 0:
+        return 0.0
+    if days_overdue <= FIRST_WEEK_DAYS:
+        late_fee = days_overdue * FIRST_WEEK_RATE
+    else:
+        late_fee = (FIRST_WEEK_DAYS * FIRST_WEEK_RATE) + ((days_overdue - FIRST_WEEK_DAYS) * LATER_RATE)
+    return min(late_fee, MAX_FEE_PER_BOOK)
+
+
+def compute_late_fees(days_overdue):
+    """
+    Apply the fee schedule to many loans at once.
+
+    Takes a NumPy integer array (returns an array) or any sequence of ints
+    (returns a list).
+    """
+    if np is not None and isinstance(days_overdue, np.ndarray):
+        days = np.maximum(days_overdue, 0)
+        fees = np.where(
+            days <= FIRST_WEEK_DAYS,
+            days * FIRST_WEEK_RATE,
+            FIRST_WEEK_DAYS * FIRST_WEEK_RATE + (days - FIRST_WEEK_DAYS) * LATER_RATE,
+        )
+        return np.minimum(fees, MAX_FEE_PER_BOOK)
+    return [late_fee_for_days(days) for days in days_overdue]
+
+
+def _epoch_us(moment: datetime) -> int:
+    return (moment - _EPOCH) // timedelta(microseconds=1)
+
+
+def _numpy_open_loan_fees(as_of_us: int, batch_size: int) -> Dict:
+    loan_ids, patron_ids, book_ids, due = [], [], [], []
+    for rows in iter_open_loan_due_dates(batch_size):
+        columns = list(zip(*rows))
+        loan_ids.append(np.array(columns[0], dtype=np.int64))
+        patron_ids.append(np.array(columns[1], dtype=object))
+        book_ids.append(np.array(columns[2], dtype=np.int64))
+        due.append(np.array(columns[3], dtype=np.int64))
+
+    def joined(parts, dtype):
+        return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+
+    due_us = joined(due, np.int64)
+    days = np.maximum((as_of_us - due_us) // _DAY_US, 0)
+    return {
+        'loan_ids': joined(loan_ids, np.int64),
+        'patron_ids': joined(patron_ids, object),
+        'book_ids': joined(book_ids, np.int64),
+        'days_overdue': days,
+        'fees': compute_late_fees(days),
+    }
+
+
+def _sql_open_loan_fees(as_of_us: int) -> Dict:
+    rows = get_open_loan_fees(as_of_us, FIRST_WEEK_DAYS, FIRST_WEEK_RATE, LATER_RATE, MAX_FEE_PER_BOOK)
+    columns = list(zip(*rows)) or [(), (), (), (), ()]
+    return {
+        'loan_ids': list(columns[0]),
+        'patron_ids': list(columns[1]),
+        'book_ids': list(columns[2]),
+        'days_overdue': list(columns[3]),
+        'fees': list(columns[4]),
+    }
+
+
+def open_loan_fees(as_of: Optional[datetime] = None, engine: Optional[str] = None,
+                   batch_size: int = 100000) -> Dict:
+    """
+    Compute late fees for every open loan in one pass.
+
+    The 'numpy' engine loads due dates as integer arrays and evaluates the
+    schedule with array operations; the 'sql' engine runs the same schedule
+    as one set-based query. The default is NumPy when it is installed.
+
+    Returns:
+        dict: Parallel sequences loan_ids, patron_ids, book_ids, days_overdue
+        and fees (in loan id order), plus 'total' and the 'engine' used
+    """
+    engine = engine or ('numpy' if np is not None else 'sql')
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown fee engine: {engine}')
+    if engine == 'numpy' and np is None:
+        raise ValueError('The numpy fee engine requires NumPy')
+
+    as_of_us = _epoch_us(as_of or datetime.now())
+    if engine == 'numpy':
+        result = _numpy_open_loan_fees(as_of_us, batch_size)
+        result['total'] = round(float(result['fees'].sum()), 2)
+    else:
+        result = _sql_open_loan_fees(as_of_us)
+        result['total'] = round(sum(result['fees']), 2)
+    result['engine'] = engine
+    return result
+
+
+def iter_overdue_report(fee_over: float = 0.0, min_days_overdue: int = 1,
+                        as_of: Optional[datetime] = None) -> Iterator[Dict]:
+    """
+    Stream the library-wide overdue report, one patron at a time.
+
+    Fees are computed and grouped per patron inside SQLite, so memory use
+    does not depend on the number of patrons or loans.
+    """
+    return iter_overdue_patrons(_epoch_us(as_of or datetime.now()), FIRST_WEEK_DAYS, FIRST_WEEK_RATE,
+                                LATER_RATE, MAX_FEE_PER_BOOK, fee_over, min_days_overdue)
+
+
+def patron_outstanding_fees(patron_id: str, as_of: Optional[datetime] = None) -> List[Dict]:
+    """Get the unpaid fee on each of a patron's open loans (see get_patron_outstanding_fees)."""
+    return get_patron_outstanding_fees(patron_id, _epoch_us(as_of or datetime.now()), FIRST_WEEK_DAYS,
+                                       FIRST_WEEK_RATE, LATER_RATE, MAX_FEE_PER_BOOK)
+
+
+def queue_patron_fees(patron_id: str, idempotency_key: str, describe: Callable[[List[Dict]], Tuple[float, str]],
+                      as_of: Optional[datetime] = None, expires_in: Optional[int] = None) -> Tuple[str, Optional[Dict]]:
+    """Queue a payment intent for a patron's unpaid fees (see create_payment_intent)."""
+    return create_payment_intent(patron_id, idempotency_key, describe, _epoch_us(as_of or datetime.now()),
+                                 FIRST_WEEK_DAYS, FIRST_WEEK_RATE, LATER_RATE, MAX_FEE_PER_BOOK, expires_in)
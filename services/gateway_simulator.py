@@ -0,0 +1,153 @@
+"""
+Gateway Simulator Module - In-process stand-in for the payment gateway
+Charges and refunds take a configurable, randomly drawn latency, fail or time
+out at configurable rates, and are kept in a ledger that refunds are checked
+against, so payment paths can be load-tested offline
+"""
+
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from services.library_service import PaymentGateway
+
+# Defaults used when the simulator is created without arguments, e.g. through
+# LIBRARY_PAYMENT_GATEWAY=services.gateway_simulator:SimulatedGateway
+SIM_LATENCY = os.environ.get('LIBRARY_GATEWAY_SIM_LATENCY', 'lognormal:0.05,0.5')
+SIM_FAILURE_RATE = float(os.environ.get('LIBRARY_GATEWAY_SIM_FAILURE_RATE', '0'))
+SIM_TIMEOUT_RATE = float(os.environ.get('LIBRARY_GATEWAY_SIM_TIMEOUT_RATE', '0'))
+SIM_TIMEOUT = float(os.environ.get('LIBRARY_GATEWAY_SIM_TIMEOUT', '10'))
+
+LatencySampler = Callable[[random.Random], float]
+
+
+def parse_latency(spec: str) -> LatencySampler:
+    """
+    Build a latency sampler (seconds) from a ``'kind:args'`` spec.
+
+    Supported kinds:
+        constant:S            - always S
+        uniform:LOW,HIGH      - evenly spread between LOW and HIGH
+        exponential:MEAN      - memoryless, mean MEAN
+        lognormal:MEDIAN,SIGMA - long right tail, like most network services
+    """
+    kind, _, args = spec.partition(':')
+    try:
+        values = [float(arg) for arg in args.split(',')] if args else []
+    except ValueError:
+        raise ValueError(f'Invalid latency spec: {spec}')
+
+    if kind == 'constant' and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == 'uniform' and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == 'exponential' and len(values) == 1:
+        return lambda rng: rng.expovariate(1 / values[0]) if values[0] > 0 else 0.0
+    if kind == 'lognormal' and len(values) == 2:
+        if values[0] <= 0:
+            return lambda rng: 0.0
+        mu = math.log(values[0])
+        return lambda rng: rng.lognormvariate(mu, values[1])
+    raise ValueError(f'Invalid latency spec: {spec}')
+
+
+class SimulatedGateway(PaymentGateway):
+    """
+    Thread-safe simulated payment gateway.
+
+    Each call sleeps for a latency drawn from ``latency``. A charge is
+    declined with probability ``failure_rate``; any call times out with
+    probability ``timeout_rate``, sleeping ``timeout`` seconds and raising
+    TimeoutError. A timed-out charge is still applied (the worst case for
+    callers), so a retry must reuse its idempotency key to avoid charging
+    twice. Refunds are validated against the ledger of applied charges.
+    """
+
+    def __init__(self, latency: str = None, failure_rate: float = None, timeout_rate: float = None,
+                 timeout: float = None, seed: Optional[int] = None, sleep: Callable[[float], None] = time.sleep):
+        self.latency_spec = latency or SIM_LATENCY
+        self._sample_latency = parse_latency(self.latency_spec)
+        self.failure_rate = SIM_FAILURE_RATE if failure_rate is None else failure_rate
+        self.timeout_rate = SIM_TIMEOUT_RATE if timeout_rate is None else timeout_rate
+        self.timeout = SIM_TIMEOUT if timeout is None else timeout
+        self._sleep = sleep
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._ledger = {}
+        self._by_key = {}
+        self._stats = {'charges': 0, 'declines': 0, 'timeouts': 0, 'replays': 0,
+                       'refunds': 0, 'refunds_rejected': 0}
+
+    def _draw(self):
+        # One locked draw per call keeps a seeded run reproducible across threads
+        with self._lock:
+            return self._sample_latency(self._rng), self._rng.random(), self._rng.random()
+
+    def process_payment(self, patron_id: str, amount: float, description: str,
+                        idempotency_key: Optional[str] = None):
+        latency, timeout_roll, failure_roll = self._draw()
+        timed_out = timeout_roll < self.timeout_rate
+        self._sleep(self.timeout if timed_out else latency)
+
+        with self._lock:
+            if idempotency_key is not None and idempotency_key in self._by_key:
+                self._stats['replays'] += 1
+                result = self._by_key[idempotency_key]
+            elif amount <= 0:
+                result = (False, None, "Invalid amount")
+            elif failure_roll < self.failure_rate:
+                self._stats['declines'] += 1
+                result = (False, None, "Card declined")
+            else:
+                transaction_id = f"txn_{uuid.uuid4().hex[:16]}"
+                self._ledger[transaction_id] = {
+                    'transaction_id': transaction_id, 'patron_id': patron_id, 'amount': round(amount, 2),
+                    'description': description, 'refunded': 0.0, 'idempotency_key': idempotency_key
+                }
+                self._stats['charges'] += 1
+                result = (True, transaction_id, "Approved")
+            if idempotency_key is not None:
+                self._by_key[idempotency_key] = result
+            if timed_out:
+                self._stats['timeouts'] += 1
+
+        if timed_out:
+            raise TimeoutError(f"Gateway did not respond within {self.timeout:g}s")
+        return result
+
+    def refund_payment(self, transaction_id: str, amount: float):
+        latency, timeout_roll, _ = self._draw()
+        if timeout_roll < self.timeout_rate:
+            self._sleep(self.timeout)
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise TimeoutError(f"Gateway did not respond within {self.timeout:g}s")
+        self._sleep(latency)
+
+        with self._lock:
+            charge = self._ledger.get(transaction_id)
+            if charge is None:
+                self._stats['refunds_rejected'] += 1
+                return False, "Unknown transaction"
+            remaining = round(charge['amount'] - charge['refunded'], 2)
+            if amount <= 0 or round(amount, 2) > remaining:
+                self._stats['refunds_rejected'] += 1
+                return False, f"Refund exceeds the ${remaining:.2f} left on this transaction"
+            charge['refunded'] = round(charge['refunded'] + amount, 2)
+            self._stats['refunds'] += 1
+            return True, f"Refunded ${amount:.2f}"
+
+    def ledger(self) -> List[Dict]:
+        """Get a copy of every applied charge with the amount refunded so far."""
+        with self._lock:
+            return [dict(charge) for charge in self._ledger.values()]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats,
+                        charged=round(sum(c['amount'] for c in self._ledger.values()), 2),
+                        refunded=round(sum(c['refunded'] for c in self._ledger.values()), 2))
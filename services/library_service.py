@@ -3,42 +3,143 @@ Library Service Module - Business Logic Functions
 Contains all the core business logic for the Library Management System
 """
 
+import base64
+import json
+import os
+import threading
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 from database import (
     get_book_by_id, get_book_by_isbn, get_patron_borrow_count,
     get_patron_borrowed_books, get_patron_borrowing_history, insert_book, 
-    insert_borrow_record, update_book_availability, update_borrow_record_return_date, get_all_books
+    insert_borrow_record, update_book_availability, update_borrow_record_return_date, get_all_books,
+    get_books_by_ids, search_books_fulltext, borrow_book_atomic, return_book_atomic,
+    borrow_books_batch, return_books_batch, get_catalog_version, insert_fee_payment,
+    get_catalog_generation, get_books_added_after, to_epoch_seconds
 )
+from cache import LRUCache
+from services.fee_engine import compute_late_fees, late_fee_for_days, patron_outstanding_fees
+from services.search_index import TrigramIndex
+
+# Title/author search backend:
+#   'substring' - case-insensitive match anywhere in the text (linear scan)
+#   'fts'       - SQLite FTS5 word-prefix match, falls back to 'substring'
+#                 when the full-text index is unavailable
+#   'trigram'   - same results as 'substring', answered from an in-process
+#                 trigram index (see build_search_index)
+SEARCH_MODES = ('substring', 'fts', 'trigram')
+SEARCH_MODE = os.environ.get('LIBRARY_SEARCH_MODE', 'substring')
+
+# Keyset pagination defaults for the catalog and search APIs
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Most operations accepted by one batch borrow/return call
+MAX_BATCH_SIZE = 500
+
+# Rows fetched per query while scanning the catalog for substring matches
+SCAN_BATCH_SIZE = 1000
+
+# Search result cache (LIBRARY_SEARCH_CACHE_SIZE=0 disables it). Entries are
+# keyed by catalog version, so any write makes older results unreachable; the
+# TTL bounds staleness from writes made by other processes.
+SEARCH_CACHE_SIZE = int(os.environ.get('LIBRARY_SEARCH_CACHE_SIZE', '512'))
+SEARCH_CACHE_TTL = float(os.environ.get('LIBRARY_SEARCH_CACHE_TTL', '60'))
+
+_search_index: Optional[TrigramIndex] = None
+# Shared catalog counters the index was last brought up to date with
+_search_index_synced: Optional[Dict] = None
+_search_index_lock = threading.Lock()
+_search_cache = LRUCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+
+def build_search_index() -> TrigramIndex:
+    """(Re)build the trigram search index from every book in the catalog."""
+    with _search_index_lock:
+        return _build_search_index()
+
+def _build_search_index() -> TrigramIndex:
+    global _search_index, _search_index_synced
+    # Read the counters first: a write made while loading moves them on, so
+    # the next search catches up with it
+    synced = get_catalog_generation()
+    index = TrigramIndex()
+    index.add_all(get_all_books())
+    _search_index, _search_index_synced = index, synced
+    return index
+
+def get_search_index() -> TrigramIndex:
+    """
+    Get the trigram search index, building it on first use.
+
+    Writes from any process move the shared catalog generation. New books are
+    then added by id; deleted books and edited titles or authors (which bump
+    the rewrites counter) make the index be rebuilt.
+    """
+    global _search_index_synced
+    if _search_index is None:
+        return build_search_index()
+    current = get_catalog_generation()
+    if current is None or current == _search_index_synced:
+        return _search_index
+    with _search_index_lock:
+        index, synced = _search_index, _search_index_synced
+        if index is None or synced is None or \
+                (current['nonce'], current['rewrites']) != (synced['nonce'], synced['rewrites']):
+            return _build_search_index()
+        if current['generation'] != synced['generation']:
+            index.add_all(get_books_added_after(index.max_id))
+            _search_index_synced = current
+        return index
+
+def get_search_cache_stats() -> Dict:
+    """Get hit/miss/eviction counters for the search result cache."""
+    return _search_cache.stats()
 
 class PaymentGateway:
-    def process_payment(self, patron_id: str, amount: float, description: str):
+    # idempotency_key is sent by the payment outbox on every attempt at the
+    # same charge; gateways must return the original result for a key they
+    # have already processed instead of charging again
+    def process_payment(self, patron_id: str, amount: float, description: str,
+                        idempotency_key: Optional[str] = None):
         raise NotImplementedError
 
     def refund_payment(self, transaction_id: str, amount: float):
         raise NotImplementedError
 
-def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -> Tuple[bool, str]:
+def validate_book_fields(title: str, author: str, isbn: str, total_copies: int) -> Optional[str]:
     """
-    Implements R1: Book Catalog Management
+    Check the R1 field rules for a new book.
+
+    Returns:
+        Optional[str]: The error message for the first failing rule, or None
     """
     if not title or not title.strip():
-        return False, "Title is required"
+        return "Title is required"
     
     if len(title.strip()) > 200:
-        return False, "Title must be less than 200 characters"
+        return "Title must be less than 200 characters"
     
     if not author or not author.strip():
-        return False, "Author is required"
+        return "Author is required"
     
     if len(author.strip()) > 100:
-        return False, "Author must be less than 100 characters"
+        return "Author must be less than 100 characters"
     
     if len(isbn) != 13:
-        return False, "ISBN must be exactly 13 digits"
+        return "ISBN must be exactly 13 digits"
     
     if not isinstance(total_copies, int) or total_copies <= 0:
-        return False, "Total copies must be a positive integer"
+        return "Total copies must be a positive integer"
+    
+    return None
+
+def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -> Tuple[bool, str]:
+    """
+    Implements R1: Book Catalog Management
+    """
+    error = validate_book_fields(title, author, isbn, total_copies)
+    if error:
+        return False, error
     
     existing = get_book_by_isbn(isbn)
     if existing:
@@ -57,29 +158,28 @@ def borrow_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
         return False, "Invalid patron ID. Must be exactly 6 digits"
     
-    book = get_book_by_id(book_id)
-    if not book:
+    borrow_date = datetime.now()
+    due_date = borrow_date + timedelta(days=14)
+    
+    # Availability, limit check, loan insert and decrement commit together
+    status, book = borrow_book_atomic(patron_id, book_id, borrow_date, due_date, max_loans=5)
+    
+    return _borrow_outcome(status, book, due_date)
+
+def _borrow_outcome(status: str, book: Optional[Dict], due_date: datetime) -> Tuple[bool, str]:
+    """Turn a borrow status from the database layer into the R3 result."""
+    if status == 'not_found':
         return False, "Book not found"
     
-    if book['available_copies'] <= 0:
+    if status == 'unavailable':
         return False, "This book is currently not available"
     
-    current_borrowed = get_patron_borrow_count(patron_id)
-    
-    if current_borrowed > 5:
+    if status == 'limit':
         return False, "You have reached the maximum borrowing limit of 5 books"
     
-    borrow_date = datetime.now()
-    due_date = borrow_date + timedelta(days=14)
-    
-    borrow_success = insert_borrow_record(patron_id, book_id, borrow_date, due_date)
-    if not borrow_success:
+    if status != 'ok':
         return False, "Database error occurred while creating borrow record"
     
-    availability_success = update_book_availability(book_id, -1)
-    if not availability_success:
-        return False, "Database error occurred while updating book availability"
-    
     return True, f'Successfully borrowed "{book["title"]}". Due date: {due_date.strftime("%Y-%m-%d")}.'
 
 def return_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
@@ -92,52 +192,112 @@ def return_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     if not isinstance(book_id, int) or book_id <= 0:
         return False, "Invalid book ID"
     
-    book = get_book_by_id(book_id)
-    if not book:
-        return False, "Book not found"
-    
-    borrowed_books = get_patron_borrowed_books(patron_id)
-    book_borrowed = False
-    borrow_record = None
+    return_date = datetime.now()
     
-    for borrowed_book in borrowed_books:
-        if borrowed_book['book_id'] == book_id:
-            book_borrowed = True
-            borrow_record = borrowed_book
-            break
+    # Closing the loan and restoring availability commit together
+    status, book, due_date = return_book_atomic(patron_id, book_id, return_date)
     
-    if not book_borrowed:
-        return False, f"Book '{book['title']}' was not borrowed by this patron"
+    success, message, _, _ = _return_outcome(status, book, due_date, return_date)
+    return success, message
+
+def _return_outcome(status: str, book: Optional[Dict], due_date: Optional[datetime],
+                    return_date: datetime) -> Tuple[bool, str, int, float]:
+    """
+    Turn a return status from the database layer into the R4 result.
+
+    Returns:
+        tuple: (success, message, days_overdue, late_fee)
+    """
+    if status == 'not_found':
+        return False, "Book not found", 0, 0.0
     
-    return_date = datetime.now()
-    return_success = update_borrow_record_return_date(patron_id, book_id, return_date)
-    if not return_success:
-        return False, "Database error occurred while recording return date"
+    if status == 'not_borrowed':
+        return False, f"Book '{book['title']}' was not borrowed by this patron", 0, 0.0
     
-    availability_success = update_book_availability(book_id, 1)
-    if not availability_success:
-        return False, "Database error occurred while updating book availability"
+    if status != 'ok':
+        return False, "Database error occurred while recording return date", 0, 0.0
     
-    due_date = borrow_record['due_date']
     days_overdue = 0
     late_fee = 0.0
     
     if return_date > due_date:
         days_overdue = (return_date - due_date).days
-        
-        if days_overdue <= 7:
-            late_fee = days_overdue * 0.50
-        else:
-            late_fee = (7 * 0.50) + ((days_overdue - 7) * 1.00)
-        
-        late_fee = min(late_fee, 15.00)
+        late_fee = late_fee_for_days(days_overdue)
     
     if late_fee > 0:
         message = f'Successfully returned "{book["title"]}". Late fee: ${late_fee:.2f} ({days_overdue} days overdue)'
     else:
         message = f'Successfully returned "{book["title"]}". No late fees'
     
-    return True, message
+    return True, message, days_overdue, round(late_fee, 2)
+
+def _validate_batch(operations: List[Tuple[str, int]], check_book_id: bool) -> List[Optional[str]]:
+    """Get the per-item validation error (or None) for a batch of operations."""
+    errors = []
+    for patron_id, book_id in operations:
+        if not isinstance(patron_id, str) or not patron_id.isdigit() or len(patron_id) != 6:
+            errors.append("Invalid patron ID. Must be exactly 6 digits")
+        elif check_book_id and (not isinstance(book_id, int) or isinstance(book_id, bool) or book_id <= 0):
+            errors.append("Invalid book ID")
+        else:
+            errors.append(None)
+    return errors
+
+def borrow_books_in_batch(operations: List[Tuple[str, int]]) -> List[Dict]:
+    """
+    Borrow many books at once (e.g. a self-service kiosk session).
+
+    Every valid (patron_id, book_id) pair is applied in one transaction with
+    the same rules and messages as borrow_book_by_patron(); items are
+    processed in order, so later items see earlier ones' loans.
+
+    Returns:
+        list: One {'patron_id', 'book_id', 'success', 'message'} dict per item
+    """
+    errors = _validate_batch(operations, check_book_id=True)
+    valid = [op for op, error in zip(operations, errors) if error is None]
+    
+    borrow_date = datetime.now()
+    due_date = borrow_date + timedelta(days=14)
+    outcomes = iter(borrow_books_batch(valid, borrow_date, due_date, max_loans=5) if valid else [])
+    
+    results = []
+    for (patron_id, book_id), error in zip(operations, errors):
+        if error:
+            success, message = False, error
+        else:
+            status, book = next(outcomes)
+            success, message = _borrow_outcome(status, book, due_date)
+        results.append({'patron_id': patron_id, 'book_id': book_id, 'success': success, 'message': message})
+    return results
+
+def return_books_in_batch(operations: List[Tuple[str, int]]) -> List[Dict]:
+    """
+    Return many books at once (e.g. a drop-box sorter run).
+
+    Every valid (patron_id, book_id) pair is applied in one transaction with
+    the same rules, messages and late fees as return_book_by_patron().
+
+    Returns:
+        list: One {'patron_id', 'book_id', 'success', 'message',
+        'days_overdue', 'late_fee'} dict per item
+    """
+    errors = _validate_batch(operations, check_book_id=True)
+    valid = [op for op, error in zip(operations, errors) if error is None]
+    
+    return_date = datetime.now()
+    outcomes = iter(return_books_batch(valid, return_date) if valid else [])
+    
+    results = []
+    for (patron_id, book_id), error in zip(operations, errors):
+        if error:
+            success, message, days_overdue, late_fee = False, error, 0, 0.0
+        else:
+            status, book, due_date = next(outcomes)
+            success, message, days_overdue, late_fee = _return_outcome(status, book, due_date, return_date)
+        results.append({'patron_id': patron_id, 'book_id': book_id, 'success': success, 'message': message,
+                        'days_overdue': days_overdue, 'late_fee': late_fee})
+    return results
 
 def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
     """
@@ -182,20 +342,14 @@ def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
             'status': 'Book not borrowed by this patron'
         }
     
-    current_date = datetime.now()
+    current_date = to_epoch_seconds(datetime.now())
     due_date = borrow_record['due_date']
     days_overdue = 0
     late_fee = 0.0
     
     if current_date > due_date:
-        days_overdue = (current_date - due_date).days
-        
-        if days_overdue <= 7:
-            late_fee = days_overdue * 0.50
-        else:
-            late_fee = (7 * 0.50) + ((days_overdue - 7) * 1.00)
-        
-        late_fee = min(late_fee, 15.00)
+        days_overdue = (current_date - due_date) // 86400
+        late_fee = late_fee_for_days(days_overdue)
         
         return {
             'fee_amount': round(late_fee, 2),
@@ -209,9 +363,14 @@ def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
             'status': 'Not overdue'
         }
 
-def search_books_in_catalog(search_term: str, search_type: str) -> List[Dict]:
+def search_books_in_catalog(search_term: str, search_type: str, mode: Optional[str] = None,
+                            limit: Optional[int] = None, after: Optional[Tuple[str, int]] = None) -> List[Dict]:
     """
     Implements R6: Book Search Functionality
+
+    ``mode`` selects the title/author backend (see SEARCH_MODES); it defaults
+    to SEARCH_MODE. ISBN search is always an exact match. Results are ordered
+    by title; ``limit`` and ``after`` (a decoded page cursor) return one page.
     """
     if not search_term or not search_term.strip():
         return []
@@ -219,38 +378,121 @@ def search_books_in_catalog(search_term: str, search_type: str) -> List[Dict]:
     if search_type not in ['title', 'author', 'isbn']:
         return []
     
-    all_books = get_all_books()
+    mode = mode or SEARCH_MODE
+    if mode not in SEARCH_MODES:
+        return []
+    
+    # Every backend matches case-insensitively, so the lowercased term is the key
+    key = (get_catalog_version(), search_term.strip().lower(), search_type, mode,
+           limit, tuple(after) if after is not None else None)
+    results = _search_cache.get(key)
+    if results is None:
+        generation = _search_cache.generation
+        results = _search_books(search_term, search_type, mode, limit, after)
+        _search_cache.put(key, results, generation)
+    return [dict(result) for result in results]
+
+def _search_books(search_term: str, search_type: str, mode: str, limit: Optional[int],
+                  after: Optional[Tuple[str, int]]) -> List[Dict]:
+    if mode == 'fts' and search_type in ('title', 'author'):
+        books = search_books_fulltext(search_term.strip(), search_type, limit, after)
+        if books is not None:
+            return [_search_result(book) for book in books]
+    
+    if mode == 'trigram' and search_type in ('title', 'author'):
+        # Only the requested page is loaded from the database
+        book_ids = get_search_index().page(search_term.strip(), search_type, limit, after)
+        return [_search_result(book) for book in get_books_by_ids(book_ids)]
+    
     search_term = search_term.strip().lower()
     results = []
+    cursor = after
     
-    for book in all_books:
-        match = False
+    while True:
+        batch = get_all_books(limit=SCAN_BATCH_SIZE, after=cursor)
         
-        if search_type == 'title':
-            if search_term in book['title'].lower():
-                match = True
-        elif search_type == 'author':
-            if search_term in book['author'].lower():
-                match = True
-        elif search_type == 'isbn':
-            if search_term == book['isbn']:
-                match = True
+        for book in batch:
+            match = False
+            
+            if search_type == 'title':
+                if search_term in book['title'].lower():
+                    match = True
+            elif search_type == 'author':
+                if search_term in book['author'].lower():
+                    match = True
+            elif search_type == 'isbn':
+                if search_term == book['isbn']:
+                    match = True
+            
+            if match:
+                results.append(_search_result(book))
+                if limit is not None and len(results) >= limit:
+                    return results
         
-        if match:
-            results.append({
-                'id': book['id'],
-                'title': book['title'],
-                'author': book['author'],
-                'isbn': book['isbn'],
-                'available_copies': book['available_copies'],
-                'total_copies': book['total_copies']
-            })
-    
-    return results
+        if len(batch) < SCAN_BATCH_SIZE:
+            return results
+        cursor = (batch[-1]['title'], batch[-1]['id'])
+
+def _search_result(book: Dict) -> Dict:
+    """Shape a book row the way R6 search results are returned."""
+    return {
+        'id': book['id'],
+        'title': book['title'],
+        'author': book['author'],
+        'isbn': book['isbn'],
+        'available_copies': book['available_copies'],
+        'total_copies': book['total_copies']
+    }
+
+def encode_cursor(book: Dict) -> str:
+    """Encode the sort key of the last book on a page as an opaque cursor."""
+    raw = json.dumps([book['title'], book['id']]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """Decode a page cursor back into its ``(title, id)`` sort key."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        title, book_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid page cursor')
+    if not isinstance(title, str) or not isinstance(book_id, int):
+        raise ValueError('Invalid page cursor')
+    return title, book_id
+
+def parse_page_params(limit: Optional[str], after: Optional[str]) -> Tuple[int, Optional[Tuple[str, int]]]:
+    """
+    Validate raw ``limit``/``after`` request parameters.
+
+    Returns:
+        tuple: (limit: int, after: Optional[(title, id)])
+
+    Raises:
+        ValueError: If the limit is not a positive integer or the cursor is invalid
+    """
+    if limit is None or limit == '':
+        page_size = DEFAULT_PAGE_SIZE
+    else:
+        try:
+            page_size = int(limit)
+        except ValueError:
+            raise ValueError('Limit must be a positive integer')
+        if page_size <= 0:
+            raise ValueError('Limit must be a positive integer')
+    return min(page_size, MAX_PAGE_SIZE), decode_cursor(after) if after else None
+
+def next_page_cursor(results: List[Dict], limit: int) -> Optional[str]:
+    """Get the cursor for the page after ``results``, or None on the last page."""
+    if limit and len(results) >= limit:
+        return encode_cursor(results[-1])
+    return None
 
 def get_patron_status_report(patron_id: str) -> Dict:
     """
     Implements R7: Patron Status Report
+
+    Loan dates in the report are epoch seconds; decode them with
+    database.from_epoch_seconds() when formatting them for display.
     """
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
         return {
@@ -265,18 +507,9 @@ def get_patron_status_report(patron_id: str) -> Dict:
     
     borrowing_history = get_patron_borrowing_history(patron_id)
     
-    total_late_fees = 0.0
-    current_date = datetime.now()
-    
-    for book in borrowed_books:
-        if book['is_overdue']:
-            days_overdue = (current_date - book['due_date']).days
-            if days_overdue <= 7:
-                late_fee = days_overdue * 0.50
-            else:
-                late_fee = (7 * 0.50) + ((days_overdue - 7) * 1.00)
-            late_fee = min(late_fee, 15.00)
-            total_late_fees += late_fee
+    current_date = to_epoch_seconds(datetime.now())
+    overdue_days = [(current_date - book['due_date']) // 86400 for book in borrowed_books if book['is_overdue']]
+    total_late_fees = sum(compute_late_fees(overdue_days))
     
     return {
         'borrowed_books': borrowed_books,
@@ -305,25 +538,78 @@ def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway
         mock_gateway.process_payment.return_value = (True, "txn_123", "Success")
         success, msg, txn = pay_late_fees("123456", 1, mock_gateway)
     """
-    # Validate patron ID
-    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
-        return False, "Invalid patron ID. Must be exactly 6 digits.", None
+    error, fee_amount, description, items = prepare_late_fee_payment(patron_id, book_id)
+    if error:
+        return False, error, None
     
-    # Calculate late fee first
-    fee_info = calculate_late_fee_for_book(patron_id, book_id)
+    if payment_gateway is None:
+        payment_gateway = PaymentGateway()
     
-    # Check if there's a fee to pay
-    if not fee_info or 'fee_amount' not in fee_info:
-        return False, "Unable to calculate late fees.", None
+    try:
+        success, transaction_id, message = payment_gateway.process_payment(
+            patron_id=patron_id,
+            amount=fee_amount,
+            description=description
+        )
+    except Exception as e:
+        # Handle payment gateway errors
+        return False, f"Payment processing error: {str(e)}", None
     
-    fee_amount = fee_info.get('fee_amount', 0.0)
+    success, message, transaction_id, _ = fee_payment_outcome(
+        patron_id, payment_outcome(success, transaction_id, message), items)
+    return success, message, transaction_id
+
+def prepare_late_fee_payment(patron_id: str, book_id: int) -> Tuple[Optional[str], float, str, List[Dict]]:
+    """
+    Validate a late fee payment and work out what to charge.
+
+    The amount is what the patron still owes on that book's loan, the same
+    ledger pay_all_late_fees() uses, so fees already paid or reserved by a
+    queued payment are not charged again.
+
+    Returns:
+        tuple: (error message or None, fee amount, charge description, items)
+    """
+    # Validate patron ID
+    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+        return "Invalid patron ID. Must be exactly 6 digits.", 0.0, '', []
     
-    if fee_amount <= 0:
-        return False, "No late fees to pay for this book.", None
+    if not isinstance(book_id, int) or book_id <= 0:
+        return "Invalid book ID.", 0.0, '', []
     
-    book = get_book_by_id(book_id)
-    if not book:
-        return False, "Book not found.", None
+    items = [item for item in patron_outstanding_fees(patron_id) if item['book_id'] == book_id]
+    if not items:
+        return "No late fees to pay for this book.", 0.0, '', []
+    
+    fee_amount, _ = describe_fee_items(items)
+    return None, fee_amount, f"Late fees for '{items[0]['title']}'", items
+
+def payment_outcome(success: bool, transaction_id: Optional[str], message: str) -> Tuple[bool, str, Optional[str]]:
+    """Turn a gateway charge result into the (success, message, transaction_id) reply."""
+    if success:
+        return True, f"Payment successful! {message}", transaction_id
+    return False, f"Payment failed: {message}", None
+
+
+def pay_all_late_fees(patron_id: str, payment_gateway: PaymentGateway = None) -> Tuple[bool, str, Optional[str], List[Dict]]:
+    """
+    Pay every late fee a patron owes with a single gateway charge.
+
+    The charge description itemizes each overdue book, and on success the
+    amount is recorded against each loan so the same fees are never charged
+    twice.
+
+    Args:
+        patron_id: 6-digit library card ID
+        payment_gateway: Payment gateway instance (injectable for testing)
+
+    Returns:
+        tuple: (success, message, transaction_id, items) where items lists
+        loan_id, book_id, title, days_overdue and amount per book charged
+    """
+    error, total, description, items = prepare_patron_fee_payment(patron_id)
+    if error:
+        return False, error, None, []
     
     if payment_gateway is None:
         payment_gateway = PaymentGateway()
@@ -331,18 +617,49 @@ def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway
     try:
         success, transaction_id, message = payment_gateway.process_payment(
             patron_id=patron_id,
-            amount=fee_amount,
-            description=f"Late fees for '{book['title']}'"
+            amount=total,
+            description=description
         )
-        
-        if success:
-            return True, f"Payment successful! {message}", transaction_id
-        else:
-            return False, f"Payment failed: {message}", None
-            
     except Exception as e:
-        # Handle payment gateway errors
-        return False, f"Payment processing error: {str(e)}", None
+        return False, f"Payment processing error: {str(e)}", None, items
+    
+    return fee_payment_outcome(patron_id, payment_outcome(success, transaction_id, message), items)
+
+def prepare_patron_fee_payment(patron_id: str) -> Tuple[Optional[str], float, str, List[Dict]]:
+    """
+    Validate a pay-all request and work out the itemized charge.
+
+    Returns:
+        tuple: (error message or None, total amount, charge description, items)
+    """
+    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+        return "Invalid patron ID. Must be exactly 6 digits.", 0.0, '', []
+    
+    items = patron_outstanding_fees(patron_id)
+    if not items:
+        return "No late fees to pay.", 0.0, '', []
+    
+    total, description = describe_fee_items(items)
+    return None, total, description, items
+
+def describe_fee_items(items: List[Dict]) -> Tuple[float, str]:
+    """Get the total and itemized charge description for a list of per-loan fees."""
+    # The total is the sum of the rounded per-book amounts, so the recorded
+    # allocation always adds up to exactly what was charged
+    total = round(sum(item['amount'] for item in items), 2)
+    lines = '; '.join(f"'{item['title']}' ({item['days_overdue']} days) ${item['amount']:.2f}" for item in items)
+    count = len(items)
+    return total, f"Late fees for {count} book{'s' if count != 1 else ''}: {lines}"
+
+def fee_payment_outcome(patron_id: str, outcome: Tuple[bool, str, Optional[str]],
+                        items: List[Dict]) -> Tuple[bool, str, Optional[str], List[Dict]]:
+    """Record a successful pay-all charge (a payment_outcome() reply) against its loans."""
+    success, message, transaction_id = outcome
+    if success and not insert_fee_payment(transaction_id, patron_id, items, datetime.now()):
+        # The patron was charged; keep the transaction ID so it can be reconciled
+        return True, f"{message} (allocation not recorded; reconcile transaction {transaction_id})", \
+            transaction_id, items
+    return success, message, transaction_id, items
 
 
 def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway: PaymentGateway = None) -> Tuple[bool, str]:
@@ -359,15 +676,9 @@ def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway:
     Returns:
         tuple: (success: bool, message: str)
     """
-    # Validate inputs
-    if not transaction_id or not transaction_id.startswith("txn_"):
-        return False, "Invalid transaction ID."
-    
-    if amount <= 0:
-        return False, "Refund amount must be greater than 0."
-    
-    if amount > 15.00:  # Maximum late fee per book
-        return False, "Refund amount exceeds maximum late fee."
+    error = validate_refund(transaction_id, amount)
+    if error:
+        return False, error
     
     # Use provided gateway or create new one
     if payment_gateway is None:
@@ -377,11 +688,26 @@ def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway:
     # THIS IS WHAT YOU SHOULD MOCK IN YOUR TESTS!
     try:
         success, message = payment_gateway.refund_payment(transaction_id, amount)
-        
-        if success:
-            return True, message
-        else:
-            return False, f"Refund failed: {message}"
+        return refund_outcome(success, message)
             
     except Exception as e:
-        return False, f"Refund processing error: {str(e)}"
\ No newline at end of file
+        return False, f"Refund processing error: {str(e)}"
+
+def validate_refund(transaction_id: str, amount: float) -> Optional[str]:
+    """Check a refund request; returns the error message or None."""
+    if not transaction_id or not transaction_id.startswith("txn_"):
+        return "Invalid transaction ID."
+    
+    if amount <= 0:
+        return "Refund amount must be greater than 0."
+    
+    if amount > 15.00:  # Maximum late fee per book
+        return "Refund amount exceeds maximum late fee."
+    
+    return None
+
+def refund_outcome(success: bool, message: str) -> Tuple[bool, str]:
+    """Turn a gateway refund result into the (success, message) reply."""
+    if success:
+        return True, message
+    return False, f"Refund failed: {message}"
\ No newline at end of file
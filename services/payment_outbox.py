@@ -0,0 +1,198 @@
+"""
+Payment Outbox Module - Queued late fee payments
+"Pay fees" requests only write a payment intent; a background worker drains
+the queue through the gateway with retries, so request latency does not
+depend on gateway latency
+"""
+
+import importlib
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from database import (
+    claim_payment_intents, claim_unknown_payments, complete_payment_intent, expire_payment_intents,
+    fail_payment_intent, get_payment_intent, mark_payment_unknown
+)
+from services.fee_engine import queue_patron_fees
+from services.library_service import PaymentGateway, describe_fee_items, payment_outcome
+
+# Intents claimed per batch, and seconds to sleep when the queue is empty
+OUTBOX_BATCH_SIZE = int(os.environ.get('LIBRARY_OUTBOX_BATCH_SIZE', '20'))
+OUTBOX_POLL_INTERVAL = float(os.environ.get('LIBRARY_OUTBOX_POLL_INTERVAL', '1'))
+
+# Gateway errors are retried after RETRY_BACKOFF seconds, doubling per attempt
+# up to MAX_BACKOFF; after MAX_ATTEMPTS the intent's outcome is 'unknown' and
+# it is left to reconciliation (see _reconcile)
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('LIBRARY_OUTBOX_MAX_ATTEMPTS', '5'))
+OUTBOX_RETRY_BACKOFF = float(os.environ.get('LIBRARY_OUTBOX_RETRY_BACKOFF', '2'))
+OUTBOX_MAX_BACKOFF = 300
+
+# Seconds a claimed intent stays with one worker before another may retry it
+CLAIM_LEASE_SECONDS = 120
+
+# Seconds a queued intent may wait for its first attempt before it expires
+# and releases its fees (0: never)
+OUTBOX_PENDING_EXPIRY = int(os.environ.get('LIBRARY_OUTBOX_PENDING_EXPIRY', '900'))
+
+# Gateway class used by the worker ('package.module:ClassName'), and who
+# drains the outbox: a background thread of the web process ('thread', so
+# configuring a gateway is enough to take payments), `flask --app app
+# payment-worker` processes ('process'), or nobody ('off', so the pay API
+# answers 503 rather than queue payments that never run)
+PAYMENT_GATEWAY_CLASS = os.environ.get('LIBRARY_PAYMENT_GATEWAY', '')
+OUTBOX_WORKER_MODE = os.environ.get('LIBRARY_OUTBOX_WORKER', 'thread')
+WORKER_MODES = ('thread', 'process')
+
+
+def load_gateway(spec: str) -> PaymentGateway:
+    """Instantiate a gateway class named as ``'package.module:ClassName'``."""
+    module_name, _, class_name = spec.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def submit_fee_payment(patron_id: str, idempotency_key: Optional[str] = None) -> Tuple[Optional[str], Optional[Dict]]:
+    """
+    Queue a charge for all of a patron's unpaid late fees.
+
+    Resubmitting with the same ``idempotency_key``, or while the patron
+    already has a queued payment, returns the existing intent. An intent no
+    worker attempts within OUTBOX_PENDING_EXPIRY seconds expires.
+
+    Returns:
+        tuple: (error message or None, payment intent)
+    """
+    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+        return "Invalid patron ID. Must be exactly 6 digits.", None
+
+    status, intent = queue_patron_fees(patron_id, idempotency_key or uuid.uuid4().hex, describe_fee_items,
+                                       expires_in=OUTBOX_PENDING_EXPIRY or None)
+    if status == 'no_fees':
+        return "No late fees to pay.", None
+    if status == 'conflict':
+        return "Idempotency key was already used for another patron.", None
+    if status == 'error':
+        return "Unable to queue payment. Please try again.", None
+    return None, intent
+
+
+def get_payment_status(intent_id: int) -> Optional[Dict]:
+    """Get a queued payment's current state."""
+    expire_payment_intents(datetime.now())
+    return get_payment_intent(intent_id)
+
+
+def _retry_delay(attempts: int) -> float:
+    return min(OUTBOX_RETRY_BACKOFF * 2 ** (attempts - 1), OUTBOX_MAX_BACKOFF)
+
+
+def _attempt(gateway: PaymentGateway, intent: Dict):
+    """Make one gateway attempt for a claimed intent and record the outcome."""
+    try:
+        success, transaction_id, message = gateway.process_payment(
+            patron_id=intent['patron_id'],
+            amount=intent['amount'],
+            description=intent['description'],
+            idempotency_key=intent['idempotency_key']
+        )
+    except Exception as e:
+        # The charge may or may not have gone through; retrying with the same
+        # idempotency key is safe either way. Once the attempts run out it is
+        # still not known, so the fees stay reserved and the key is replayed
+        # by reconciliation instead of being released to a new charge
+        message = f"Payment processing error: {str(e)}"
+        now = datetime.now()
+        if intent['attempts'] >= OUTBOX_MAX_ATTEMPTS:
+            mark_payment_unknown(intent['id'], f"Payment outcome unknown: {message}", now,
+                                 now + timedelta(seconds=_retry_delay(intent['attempts'])))
+        else:
+            fail_payment_intent(intent['id'], message, now,
+                                retry_at=now + timedelta(seconds=_retry_delay(intent['attempts'])))
+        return
+
+    # A decline is final; the patron can submit a new payment
+    success, message, transaction_id = payment_outcome(success, transaction_id, message)
+    if success:
+        complete_payment_intent(intent['id'], transaction_id, message, datetime.now())
+    else:
+        fail_payment_intent(intent['id'], message, datetime.now())
+
+
+def _reconcile(gateway: PaymentGateway, intent: Dict):
+    """Replay an 'unknown' charge's idempotency key to learn how it ended."""
+    try:
+        success, transaction_id, message = gateway.process_payment(
+            patron_id=intent['patron_id'],
+            amount=intent['amount'],
+            description=intent['description'],
+            idempotency_key=intent['idempotency_key']
+        )
+    except Exception:
+        # Still unknown; the fees stay reserved and the next lease retries
+        return
+
+    success, message, transaction_id = payment_outcome(success, transaction_id, message)
+    if success:
+        complete_payment_intent(intent['id'], transaction_id, message, datetime.now(), from_status='unknown')
+    else:
+        fail_payment_intent(intent['id'], message, datetime.now(), from_status='unknown')
+
+
+def process_outbox_batch(gateway: PaymentGateway, batch_size: int = OUTBOX_BATCH_SIZE,
+                         now: Optional[datetime] = None) -> int:
+    """
+    Claim due intents and send each one to the gateway, then reconcile due
+    charges whose outcome is unknown (see record_unknown_payment).
+
+    Returns:
+        int: Number of intents attempted
+    """
+    now = now or datetime.now()
+    intents = claim_payment_intents(now, CLAIM_LEASE_SECONDS, batch_size)
+    for intent in intents:
+        _attempt(gateway, intent)
+    unknown = claim_unknown_payments(now, CLAIM_LEASE_SECONDS, batch_size)
+    for intent in unknown:
+        _reconcile(gateway, intent)
+    return len(intents) + len(unknown)
+
+
+class OutboxWorker:
+    """
+    Drain the payment outbox until stopped.
+
+    start() runs the loop in a daemon thread inside the web process; run()
+    can be called directly to drain from a separate worker process.
+    """
+
+    def __init__(self, gateway: PaymentGateway, batch_size: int = OUTBOX_BATCH_SIZE,
+                 poll_interval: float = OUTBOX_POLL_INTERVAL):
+        self.gateway = gateway
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                attempted = process_outbox_batch(self.gateway, self.batch_size)
+            except Exception:
+                attempted = 0  # e.g. database locked; the intents stay queued
+            # A full batch means more may be waiting; otherwise sleep
+            if attempted < self.batch_size:
+                self._stopping.wait(self.poll_interval)
+
+    def start(self) -> 'OutboxWorker':
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self.run, name='payment-outbox', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
@@ -0,0 +1,247 @@
+"""
+Payments Module - Asynchronous late fee payments
+Runs gateway calls on an asyncio event loop with a timeout per call and a cap
+on concurrent calls, so a slow gateway cannot hold a worker indefinitely.
+A charge that times out may still go through at the gateway, so it is
+recorded as 'unknown' (its fees stay reserved) and reconciled later by the
+payment worker replaying its idempotency key.
+"""
+
+import asyncio
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from database import record_unknown_payment
+from services.library_service import (
+    PaymentGateway, prepare_late_fee_payment, payment_outcome, validate_refund, refund_outcome,
+    prepare_patron_fee_payment, fee_payment_outcome
+)
+from services.payment_outbox import CLAIM_LEASE_SECONDS
+
+# Seconds to wait for one gateway call, and most gateway calls in flight at once
+PAYMENT_TIMEOUT = float(os.environ.get('LIBRARY_PAYMENT_TIMEOUT', '10'))
+PAYMENT_CONCURRENCY = int(os.environ.get('LIBRARY_PAYMENT_CONCURRENCY', '8'))
+
+# Seconds between checks for a free thread when every gateway thread is busy
+SLOT_POLL_INTERVAL = 0.01
+
+
+class AsyncPaymentGateway:
+    """
+    Asynchronous counterpart of PaymentGateway.
+
+    Takes the same arguments and returns the same results:
+    process_payment -> (success, transaction_id, message) and
+    refund_payment -> (success, message). Like PaymentGateway, a repeated
+    idempotency_key must return the original result instead of charging again.
+    """
+
+    async def process_payment(self, patron_id: str, amount: float, description: str,
+                              idempotency_key: Optional[str] = None):
+        raise NotImplementedError
+
+    async def refund_payment(self, transaction_id: str, amount: float):
+        raise NotImplementedError
+
+
+class ThreadedGateway(AsyncPaymentGateway):
+    """
+    Run a synchronous PaymentGateway's calls on a bounded pool of threads.
+
+    A call that times out keeps its thread until the gateway really returns,
+    so at most ``max_workers`` calls are ever in flight; further calls wait
+    for a free thread. The pool is not the event loop's default executor, so
+    asyncio.run() does not wait for stuck calls when it shuts down.
+    """
+
+    def __init__(self, gateway: PaymentGateway, max_workers: int = PAYMENT_CONCURRENCY):
+        self.gateway = gateway
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='payment-gateway')
+        # A slot is taken before a call is submitted and given back by its
+        # thread, so calls never queue inside the executor
+        self._slots = threading.BoundedSemaphore(max_workers)
+
+    async def _call(self, function, *args, **kwargs):
+        try:
+            # A threading semaphore, unlike an asyncio one, can be given back
+            # from the worker thread and shared between event loops
+            while not self._slots.acquire(blocking=False):
+                await asyncio.sleep(SLOT_POLL_INTERVAL)
+        except asyncio.CancelledError:
+            # Timed out before the call started: nothing was sent
+            raise RuntimeError('no gateway thread became free in time') from None
+
+        def run():
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._slots.release()
+
+        try:
+            future = self._executor.submit(run)
+        except BaseException:
+            self._slots.release()
+            raise
+        return await asyncio.wrap_future(future)
+
+    async def process_payment(self, patron_id: str, amount: float, description: str,
+                              idempotency_key: Optional[str] = None):
+        return await self._call(self.gateway.process_payment, patron_id=patron_id, amount=amount,
+                                description=description, idempotency_key=idempotency_key)
+
+    async def refund_payment(self, transaction_id: str, amount: float):
+        return await self._call(self.gateway.refund_payment, transaction_id, amount)
+
+    def close(self):
+        """Accept no more calls; calls already running finish in the background."""
+        self._executor.shutdown(wait=False)
+
+
+AnyGateway = Union[AsyncPaymentGateway, PaymentGateway]
+
+
+def as_async_gateway(gateway: Optional[AnyGateway], max_workers: int = PAYMENT_CONCURRENCY) -> AsyncPaymentGateway:
+    """Wrap a synchronous gateway so it can be awaited (async gateways pass through)."""
+    if gateway is None:
+        gateway = PaymentGateway()
+    if isinstance(gateway, AsyncPaymentGateway):
+        return gateway
+    return ThreadedGateway(gateway, max_workers)
+
+
+def _release(gateway: AsyncPaymentGateway, payment_gateway: Optional[AnyGateway]):
+    """Shut down the thread pool of a ThreadedGateway that as_async_gateway() made for one call."""
+    if isinstance(gateway, ThreadedGateway) and gateway is not payment_gateway:
+        gateway.close()
+
+
+async def _charge(gateway: AsyncPaymentGateway, patron_id: str, amount: float, description: str,
+                  timeout: float, idempotency_key: str) -> Tuple[Optional[bool], str, Optional[str]]:
+    """
+    Make one gateway charge and shape the reply like pay_late_fees().
+
+    Returns success None when the call timed out: the gateway may still
+    complete the charge.
+    """
+    try:
+        success, transaction_id, message = await asyncio.wait_for(
+            gateway.process_payment(patron_id=patron_id, amount=amount, description=description,
+                                    idempotency_key=idempotency_key), timeout)
+        return payment_outcome(success, transaction_id, message)
+    except asyncio.TimeoutError:
+        return None, f"gateway timed out after {timeout:g}s", None
+    except Exception as e:
+        return False, f"Payment processing error: {str(e)}", None
+
+
+def _record_unknown(patron_id: str, idempotency_key: str, amount: float, description: str,
+                    items: List[Dict], reason: str) -> str:
+    """Keep a timed-out charge's fees reserved until the payment worker reconciles it."""
+    message = f"Payment outcome unknown: {reason}"
+    now = datetime.now()
+    if record_unknown_payment(patron_id, idempotency_key, amount, description, items, message, now,
+                              now + timedelta(seconds=CLAIM_LEASE_SECONDS)) is None:
+        return f"{message}; not recorded, reconcile idempotency key {idempotency_key} with the gateway"
+    return f"{message}; it will be reconciled with the gateway (idempotency key {idempotency_key})"
+
+
+async def pay_late_fees_async(patron_id: str, book_id: int, payment_gateway: Optional[AnyGateway] = None,
+                              timeout: float = PAYMENT_TIMEOUT) -> Tuple[bool, str, Optional[str]]:
+    """
+    Asynchronous pay_late_fees() with a timeout on the gateway call.
+
+    A charge that times out is recorded as 'unknown', like in
+    settle_patron_fees_async().
+    """
+    error, fee_amount, description, items = prepare_late_fee_payment(patron_id, book_id)
+    if error:
+        return False, error, None
+
+    gateway = as_async_gateway(payment_gateway)
+    idempotency_key = uuid.uuid4().hex
+    try:
+        outcome = await _charge(gateway, patron_id, fee_amount, description, timeout, idempotency_key)
+    finally:
+        _release(gateway, payment_gateway)
+    if outcome[0] is None:
+        return False, _record_unknown(patron_id, idempotency_key, fee_amount, description, items, outcome[1]), None
+    success, message, transaction_id, _ = fee_payment_outcome(patron_id, outcome, items)
+    return success, message, transaction_id
+
+
+async def refund_late_fee_payment_async(transaction_id: str, amount: float,
+                                        payment_gateway: Optional[AnyGateway] = None,
+                                        timeout: float = PAYMENT_TIMEOUT) -> Tuple[bool, str]:
+    """Asynchronous refund_late_fee_payment() with a timeout on the gateway call."""
+    error = validate_refund(transaction_id, amount)
+    if error:
+        return False, error
+
+    gateway = as_async_gateway(payment_gateway)
+    try:
+        success, message = await asyncio.wait_for(gateway.refund_payment(transaction_id, amount), timeout)
+        return refund_outcome(success, message)
+    except asyncio.TimeoutError:
+        return False, f"Refund processing error: gateway timed out after {timeout:g}s"
+    except Exception as e:
+        return False, f"Refund processing error: {str(e)}"
+    finally:
+        _release(gateway, payment_gateway)
+
+
+async def settle_patron_fees_async(patron_ids: Iterable[str], payment_gateway: Optional[AnyGateway] = None,
+                                   timeout: float = PAYMENT_TIMEOUT,
+                                   max_concurrency: int = PAYMENT_CONCURRENCY) -> List[Dict]:
+    """
+    Charge every listed patron's outstanding late fees, one charge per patron.
+
+    Fees are worked out first; the gateway calls then run concurrently, at
+    most ``max_concurrency`` at a time and each limited to ``timeout`` seconds.
+    Each charge carries its own idempotency key, and is itemized and recorded
+    against its loans like pay_all_late_fees(), so settled fees are not
+    charged again. A charge that times out is recorded as 'unknown' and keeps
+    its fees reserved until the payment worker reconciles it.
+
+    Returns:
+        list: One dict per patron (input order) with patron_id, amount,
+        success, status ('succeeded', 'failed' or 'unknown'), message and
+        transaction_id
+    """
+    gateway = as_async_gateway(payment_gateway, max_concurrency)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def settle(patron_id: str) -> Dict:
+        result = {'patron_id': patron_id, 'amount': 0.0, 'success': False, 'status': 'failed',
+                  'message': '', 'transaction_id': None}
+        error, amount, description, items = prepare_patron_fee_payment(patron_id)
+        result['amount'] = amount
+        if error:
+            result['message'] = error
+            return result
+
+        idempotency_key = uuid.uuid4().hex
+        async with semaphore:
+            outcome = await _charge(gateway, patron_id, amount, description, timeout, idempotency_key)
+        if outcome[0] is None:
+            result['status'] = 'unknown'
+            result['message'] = _record_unknown(patron_id, idempotency_key, amount, description, items, outcome[1])
+            return result
+        result['success'], result['message'], result['transaction_id'], _ = fee_payment_outcome(
+            patron_id, outcome, items)
+        result['status'] = 'succeeded' if result['success'] else 'failed'
+        return result
+
+    try:
+        return list(await asyncio.gather(*(settle(patron_id) for patron_id in patron_ids)))
+    finally:
+        _release(gateway, payment_gateway)
+
+
+def settle_patron_fees(patron_ids: Iterable[str], payment_gateway: Optional[AnyGateway] = None,
+                       timeout: float = PAYMENT_TIMEOUT, max_concurrency: int = PAYMENT_CONCURRENCY) -> List[Dict]:
+    """Run settle_patron_fees_async() to completion from synchronous code."""
+    return asyncio.run(settle_patron_fees_async(patron_ids, payment_gateway, timeout, max_concurrency))
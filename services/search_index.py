@@ -0,0 +1,116 @@
+"""
+Search Index Module - In-process trigram index for R6 partial matching
+Answers case-insensitive substring queries on titles and authors without
+scanning every book
+"""
+
+import heapq
+import sys
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+FIELDS = ('title', 'author')
+
+
+def trigrams(text: str) -> set:
+    """Get the distinct 3-character substrings of a lowercased string."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """
+    Trigram inverted index over book titles and authors.
+
+    Each field maps trigram -> array of book ids (in insertion order) and keeps
+    the lowercased text per id. A query looks up its own trigrams, walks the
+    shortest posting list and confirms each candidate with a substring check,
+    so results match the linear scan exactly. The original titles are kept
+    too, so a page of matches can be cut in catalog order without loading
+    every matching book.
+    """
+
+    def __init__(self):
+        self._postings = {field: {} for field in FIELDS}
+        self._text = {field: {} for field in FIELDS}
+        self._titles = {}
+        self.max_id = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._text['title'])
+
+    def add(self, book: Dict):
+        """Index a book row (needs 'id', 'title' and 'author'); books already indexed are skipped."""
+        with self._lock:
+            if book['id'] in self._titles:
+                return
+            self._titles[book['id']] = book['title']
+            self.max_id = max(self.max_id, book['id'])
+            for field in FIELDS:
+                text = book[field].lower()
+                self._text[field][book['id']] = text
+                postings = self._postings[field]
+                for gram in trigrams(text):
+                    ids = postings.get(gram)
+                    if ids is None:
+                        ids = postings[gram] = array('i')
+                    ids.append(book['id'])
+
+    def add_all(self, books: Iterable[Dict]):
+        for book in books:
+            self.add(book)
+
+    def search(self, search_term: str, field: str) -> List[int]:
+        """Get ids of books whose field contains search_term (case-insensitive)."""
+        term = search_term.lower()
+        texts = self._text[field]
+        with self._lock:
+            grams = trigrams(term)
+            if not grams:
+                # Shorter than a trigram: nothing to look up, check every text
+                return [book_id for book_id, text in texts.items() if term in text]
+            postings = self._postings[field]
+            lists = []
+            for gram in grams:
+                ids = postings.get(gram)
+                if ids is None:
+                    return []
+                lists.append(ids)
+            candidates = min(lists, key=len)
+            return [book_id for book_id in candidates if term in texts[book_id]]
+
+    def page(self, search_term: str, field: str, limit: Optional[int] = None,
+             after: Optional[Tuple[str, int]] = None) -> List[int]:
+        """Get ids of matching books in catalog order (title, id), after a cursor and up to limit."""
+        titles = self._titles
+        keys = ((titles[book_id], book_id) for book_id in self.search(search_term, field))
+        if after is not None:
+            after = tuple(after)
+            keys = (key for key in keys if key > after)
+        keys = sorted(keys) if limit is None else heapq.nsmallest(limit, keys)
+        return [book_id for _, book_id in keys]
+
+    def memory_usage(self) -> Dict:
+        """Approximate memory held by the index, in bytes."""
+        with self._lock:
+            postings = 0
+            text = 0
+            grams = 0
+            for field in FIELDS:
+                table = self._postings[field]
+                postings += sys.getsizeof(table)
+                for gram, ids in table.items():
+                    postings += sys.getsizeof(gram) + sys.getsizeof(ids)
+                grams += len(table)
+                texts = self._text[field]
+                text += sys.getsizeof(texts)
+                text += sum(sys.getsizeof(t) for t in texts.values())
+            text += sys.getsizeof(self._titles) + sum(sys.getsizeof(t) for t in self._titles.values())
+        return {
+            'books': len(self),
+            'trigrams': grams,
+            'postings_bytes': postings,
+            'text_bytes': text,
+            'total_bytes': postings + text,
+        }
@@ -0,0 +1,210 @@
+"""
+SQL Trace Module - Opt-in slow-query log with the calling service function and query plan
+
+Set LIBRARY_SLOW_QUERY_MS to turn tracing on. Each @traced helper in
+database.py then times the statements it runs, seen through a sqlite3 trace
+callback on its connection (with bound parameters, as SQLite expands them).
+A statement slower than the threshold is logged with the helper, the
+service function that called it and its EXPLAIN QUERY PLAN. Only
+LIBRARY_SLOW_QUERY_SAMPLE_RATE of helper calls are traced, so the cost
+under full traffic can be bounded.
+"""
+
+import inspect
+import logging
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from functools import wraps
+from typing import Callable, Dict, List
+
+# Statements slower than this many milliseconds are logged (unset: tracing off)
+SLOW_QUERY_MS = float(os.environ['LIBRARY_SLOW_QUERY_MS']) if os.environ.get('LIBRARY_SLOW_QUERY_MS') else None
+SAMPLE_RATE = float(os.environ.get('LIBRARY_SLOW_QUERY_SAMPLE_RATE', '1'))
+EXPLAIN = os.environ.get('LIBRARY_SLOW_QUERY_EXPLAIN', '1') != '0'
+
+# Most recent slow statements kept for get_slow_queries()
+HISTORY_SIZE = 100
+
+# Statements EXPLAIN QUERY PLAN is run for
+_EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+logger = logging.getLogger(__name__)
+
+_history = deque(maxlen=HISTORY_SIZE)
+_history_lock = threading.Lock()
+_local = threading.local()
+_clock = time.perf_counter
+
+
+def trace_active() -> bool:
+    """Whether a sampled helper call on this thread wants its connection's statements."""
+    return getattr(_local, 'trace', None) is not None
+
+
+class _Trace:
+    """Statement timings for one traced helper call on this thread."""
+
+    def __init__(self, helper: str, caller: str, threshold: float):
+        self.helper = helper
+        self.caller = caller
+        self.threshold = threshold
+        self.slow: List[Dict] = []
+        self.sql = None
+        self.executions = 0
+        self.seconds = 0.0
+        self.resumed = _clock()
+
+    def statement(self, sql: str):
+        now = _clock()
+        if sql == self.sql:
+            # Trigger steps and repeated runs report the same text; keep one span
+            self.executions += 1
+            return
+        self._close(now)
+        self.sql, self.executions, self.seconds, self.resumed = sql, 1, 0.0, now
+
+    def pause(self):
+        """Stop the clock while control is outside the helper (a generator yielded)."""
+        now = _clock()
+        self.seconds += now - self.resumed
+        self.resumed = now
+
+    def resume(self):
+        self.resumed = _clock()
+
+    def finish(self):
+        self._close(_clock())
+        self.sql = None
+
+    def _close(self, now: float):
+        if self.sql is None:
+            return
+        self.seconds += now - self.resumed
+        if self.seconds * 1000 >= self.threshold:
+            self.slow.append({'statement': self.sql, 'ms': round(self.seconds * 1000, 3),
+                              'executions': self.executions})
+
+
+def trace_statement(sql: str):
+    """sqlite3 trace callback: attribute the statement to this thread's traced helper call."""
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.statement(sql)
+
+
+def _caller() -> str:
+    """The first function up the stack outside the database layer."""
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_globals.get('__name__') in ('database', __name__, 'contextlib'):
+        frame = frame.f_back
+    if frame is None:
+        return 'unknown'
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__')}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def explain(sql: str) -> List[str]:
+    """EXPLAIN QUERY PLAN for a statement, indented like the sqlite3 shell."""
+    import database
+
+    previous, _local.trace = getattr(_local, 'trace', None), None
+    conn = database.get_db_connection()
+    try:
+        rows = conn.execute(f'EXPLAIN QUERY PLAN {sql}').fetchall()
+    except sqlite3.Error as e:
+        return [f'(no plan: {e})']
+    finally:
+        conn.close()
+        _local.trace = previous
+    depth, lines = {}, []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node] + detail)
+    return lines
+
+
+def _report(trace: _Trace):
+    for entry in trace.slow:
+        plan = []
+        if EXPLAIN and entry['statement'].lstrip().split(None, 1)[0].upper() in _EXPLAINABLE:
+            plan = explain(entry['statement'])
+        entry.update(helper=trace.helper, caller=trace.caller, plan=plan,
+                     at=datetime.now().isoformat(timespec='milliseconds'))
+        with _history_lock:
+            _history.append(entry)
+        logger.warning('Slow SQL (%.1f ms, %d run%s) in %s called from %s: %s%s', entry['ms'],
+                       entry['executions'], '' if entry['executions'] == 1 else 's', trace.helper, trace.caller,
+                       ' '.join(entry['statement'].split()), ''.join(f'\n    {line}' for line in plan))
+
+
+def _sampled() -> bool:
+    return SAMPLE_RATE >= 1 or random.random() < SAMPLE_RATE
+
+
+def _finish(trace: _Trace):
+    trace.finish()
+    if trace.slow:
+        _report(trace)
+
+
+def _traced_steps(rows, trace: _Trace):
+    """Run a generator helper, timing only its own steps and not the consumer's work between them."""
+    try:
+        while True:
+            previous = getattr(_local, 'trace', None)
+            _local.trace = trace
+            trace.resume()
+            try:
+                item = next(rows)
+            except StopIteration:
+                return
+            finally:
+                trace.pause()
+                _local.trace = previous
+            yield item
+    finally:
+        rows.close()
+        _finish(trace)
+
+
+def traced(helper: Callable) -> Callable:
+    """Time the statements a database helper runs and log the slow ones (when tracing is on)."""
+    name = f'{helper.__module__}.{helper.__qualname__}'
+
+    if inspect.isgeneratorfunction(helper):
+        @wraps(helper)
+        def generator_wrapper(*args, **kwargs):
+            if SLOW_QUERY_MS is None or not _sampled():
+                return helper(*args, **kwargs)
+            return _traced_steps(helper(*args, **kwargs), _Trace(name, _caller(), SLOW_QUERY_MS))
+        return generator_wrapper
+
+    @wraps(helper)
+    def wrapper(*args, **kwargs):
+        # Helpers called by a traced helper are part of its trace
+        if SLOW_QUERY_MS is None or getattr(_local, 'trace', None) is not None or not _sampled():
+            return helper(*args, **kwargs)
+        trace = _local.trace = _Trace(name, _caller(), SLOW_QUERY_MS)
+        try:
+            return helper(*args, **kwargs)
+        finally:
+            _local.trace = None
+            _finish(trace)
+    return wrapper
+
+
+def get_slow_queries() -> List[Dict]:
+    """The most recent slow statements, oldest first."""
+    with _history_lock:
+        return list(_history)
+
+
+def clear_slow_queries():
+    with _history_lock:
+        _history.clear()
@@ -11,16 +11,39 @@ if PROJECT_ROOT not in sys.path:
 # Ensure tests run against the project-local SQLite file
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'library.db')
 
+import database
+
+# The path the database module uses by default, before any fixture changes it
+DEFAULT_DATABASE = database.DATABASE
+
+# The browser tests need the `page` fixture from pytest-playwright
+try:
+    import pytest_playwright  # noqa: F401
+except ImportError:
+    collect_ignore = ['test_e2e.py']
+
 
 @pytest.fixture(autouse=True)
 def reset_db():
     """Reset the SQLite DB before each test to ensure isolation."""
+    # test_e2e.py points the database module at its own file for the whole
+    # session; make every test use the file reset here, then put it back
+    original_database = database.DATABASE
+    database.DATABASE = DEFAULT_DATABASE
+    database.close_pool()
+
     # Drop and recreate tables to provide a clean slate for each test
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
 
     cur.execute('DROP TABLE IF EXISTS borrow_records')
     cur.execute('DROP TABLE IF EXISTS books')
+    cur.execute('DROP TABLE IF EXISTS books_fts')
+    cur.execute('DROP TABLE IF EXISTS patrons')
+    cur.execute('DROP TABLE IF EXISTS late_fee_payments')
+    cur.execute('DROP TABLE IF EXISTS payment_intents')
+    cur.execute('DROP TABLE IF EXISTS catalog_generation')
+    cur.execute('DROP TABLE IF EXISTS schema_migrations')
 
     cur.execute(
         '''
@@ -50,8 +73,39 @@ def reset_db():
     )
 
     conn.commit()
+
+    from migrations import apply_migrations
+    apply_migrations(conn)
     conn.close()
 
+    # Book ids are reused after the drop; forget lookups cached by earlier tests
+    database.clear_book_cache()
+
     yield
 
+    database.close_pool()
+    database.DATABASE = original_database
+    database.clear_book_cache()
+
+
+
+
+@pytest.fixture
+def client():
+    """Flask test client over an empty catalog."""
+    from app import create_app
+    import database
+
+    app = create_app()
+    app.config['TESTING'] = True
+
+    # create_app() seeds sample data; start each test from an empty catalog
+    conn = database.get_db_connection()
+    conn.execute('DELETE FROM borrow_records')
+    conn.execute('DELETE FROM books')
+    conn.commit()
+    conn.close()
+    database.clear_book_cache()
 
+    with app.test_client() as test_client:
+        yield test_client
@@ -0,0 +1,186 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from services.library_service import prepare_patron_fee_payment
+from services.payment_outbox import CLAIM_LEASE_SECONDS, process_outbox_batch
+from services.payments import (
+    AsyncPaymentGateway, pay_late_fees_async, refund_late_fee_payment_async,
+    settle_patron_fees, settle_patron_fees_async
+)
+
+
+class FakeGateway(AsyncPaymentGateway):
+    """Local stand-in gateway that sleeps ``latency`` seconds per call."""
+
+    def __init__(self, latency=0.0, fail=False):
+        self.latency = latency
+        self.fail = fail
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.charges = []
+
+    async def process_payment(self, patron_id, amount, description, idempotency_key=None):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        if self.fail:
+            return False, None, "Card declined"
+        self.charges.append((patron_id, amount, description))
+        return True, f"txn_{len(self.charges)}", "Approved"
+
+    async def refund_payment(self, transaction_id, amount):
+        await asyncio.sleep(self.latency)
+        return True, "Refunded"
+
+
+class SlowSyncGateway:
+    """Synchronous gateway; a replayed idempotency key returns the first result at once."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.by_key = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def process_payment(self, patron_id, amount, description, idempotency_key=None):
+        if idempotency_key in self.by_key:
+            return self.by_key[idempotency_key]
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        result = True, f"txn_{patron_id}", "Approved"
+        self.by_key[idempotency_key] = result
+        return result
+
+    def refund_payment(self, transaction_id, amount):
+        return True, "Refunded"
+
+
+@pytest.fixture
+def overdue_book():
+    """A book patron 123456 borrowed 24 days ago; 10 days overdue, so $6.50 is owed."""
+    database.insert_book('Overdue Book', 'Author', '5555555555555', 20, 20)
+    book_id = database.get_book_by_isbn('5555555555555')['id']
+    now = datetime.now()
+    database.insert_borrow_record('123456', book_id, now - timedelta(days=24), now - timedelta(days=10))
+    return book_id
+
+
+def _overdue_patrons(book_id, count):
+    now = datetime.now()
+    patrons = [f'{200000 + i}' for i in range(count)]
+    for patron_id in patrons:
+        database.insert_borrow_record(patron_id, book_id, now - timedelta(days=24), now - timedelta(days=10))
+    return patrons
+
+
+def test_async_payment_charges_the_fee(overdue_book):
+    gateway = FakeGateway()
+    success, message, txn = asyncio.run(pay_late_fees_async('123456', overdue_book, gateway))
+    assert success and txn == 'txn_1'
+    assert gateway.charges == [('123456', 6.5, "Late fees for 'Overdue Book'")]
+
+
+def test_async_payment_times_out(overdue_book):
+    success, message, txn = asyncio.run(
+        pay_late_fees_async('123456', overdue_book, FakeGateway(latency=1.0), timeout=0.05))
+    assert not success and txn is None
+    assert 'timed out' in message
+
+
+def test_async_payment_validates_before_calling_gateway():
+    gateway = FakeGateway()
+    success, message, _ = asyncio.run(pay_late_fees_async('12345', 1, gateway))
+    assert not success and 'Invalid patron ID' in message
+    assert gateway.charges == []
+
+
+def test_async_refund_timeout_and_validation():
+    assert asyncio.run(refund_late_fee_payment_async('txn_1', 5.0, FakeGateway())) == (True, 'Refunded')
+    ok, message = asyncio.run(refund_late_fee_payment_async('txn_1', 5.0, FakeGateway(latency=1.0), timeout=0.05))
+    assert not ok and 'timed out' in message
+    assert asyncio.run(refund_late_fee_payment_async('bad', 5.0, FakeGateway()))[0] is False
+
+
+def test_settle_runs_calls_concurrently_up_to_the_limit(overdue_book):
+    patrons = _overdue_patrons(overdue_book, 6)
+    gateway = FakeGateway(latency=0.1)
+    start = time.perf_counter()
+    results = asyncio.run(settle_patron_fees_async(patrons, gateway, max_concurrency=3))
+    elapsed = time.perf_counter() - start
+    assert [r['patron_id'] for r in results] == patrons
+    assert all(r['success'] and r['amount'] == 6.5 for r in results)
+    assert gateway.max_in_flight == 3
+    assert elapsed < 0.5  # two waves of 0.1s, not six
+
+
+def test_settle_reports_each_patron_separately(overdue_book):
+    results = settle_patron_fees(['123456', '999999', 'abc'], FakeGateway(fail=True))
+    assert results[0]['amount'] == 6.5 and not results[0]['success']
+    assert 'Card declined' in results[0]['message']
+    assert results[1]['message'] == 'No late fees to pay.'
+    assert 'Invalid patron ID' in results[2]['message']
+
+
+def test_sync_gateways_run_in_threads(overdue_book):
+    patrons = _overdue_patrons(overdue_book, 4)
+    start = time.perf_counter()
+    results = settle_patron_fees(patrons, SlowSyncGateway(0.1), max_concurrency=4)
+    assert all(r['success'] for r in results)
+    assert time.perf_counter() - start < 0.35
+
+
+def test_settle_timeout_does_not_wait_for_a_sync_gateway(overdue_book):
+    gateway = SlowSyncGateway(1.0)
+    start = time.perf_counter()
+    [result] = settle_patron_fees(['123456'], gateway, timeout=0.2)
+    assert time.perf_counter() - start < 0.6
+    assert result['status'] == 'unknown' and not result['success']
+    assert 'outcome unknown' in result['message']
+    # The charge may still go through, so its fees are not offered again
+    assert prepare_patron_fee_payment('123456')[0] == 'No late fees to pay.'
+
+
+def test_unknown_charges_are_reconciled_by_idempotency_key(overdue_book):
+    gateway = SlowSyncGateway(0.3)
+    [result] = settle_patron_fees(['123456'], gateway, timeout=0.05)
+    assert result['status'] == 'unknown'
+    deadline = time.monotonic() + 2
+    while not gateway.by_key and time.monotonic() < deadline:
+        time.sleep(0.05)
+    [key] = gateway.by_key
+
+    later = datetime.now() + timedelta(seconds=CLAIM_LEASE_SECONDS + 1)
+    assert process_outbox_batch(gateway, now=later) == 1
+    conn = database.get_db_connection()
+    intent = conn.execute('SELECT * FROM payment_intents WHERE idempotency_key = ?', (key,)).fetchone()
+    conn.close()
+    assert intent['status'] == 'succeeded' and intent['transaction_id'] == 'txn_123456'
+    assert prepare_patron_fee_payment('123456')[0] == 'No late fees to pay.'
+    assert process_outbox_batch(gateway, now=later) == 0
+
+
+def test_timed_out_calls_keep_their_thread(overdue_book):
+    patrons = _overdue_patrons(overdue_book, 4)
+    gateway = SlowSyncGateway(0.3)
+    results = settle_patron_fees(patrons, gateway, max_concurrency=2, timeout=0.05)
+    assert [r['status'] for r in results] == ['unknown', 'unknown', 'failed', 'failed']
+    # Calls that never got a thread were not sent, so their fees are still owed
+    assert 'no gateway thread' in results[2]['message']
+    assert prepare_patron_fee_payment(patrons[2])[1] == 6.5
+    time.sleep(0.5)
+    assert gateway.max_in_flight == 2
@@ -0,0 +1,106 @@
+import threading
+from datetime import datetime, timedelta
+
+import database
+import services.library_service as ls
+
+
+def _book(copies=1, isbn="1234567890123"):
+    ls.add_book_to_catalog("Contended", "Author", isbn, copies)
+    return database.get_book_by_isbn(isbn)['id']
+
+
+def _open_loans(book_id):
+    conn = database.get_db_connection()
+    try:
+        return conn.execute(
+            'SELECT COUNT(*) FROM borrow_records WHERE book_id = ? AND return_date IS NULL', (book_id,)
+        ).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _run_concurrently(target, args_list):
+    barrier = threading.Barrier(len(args_list))
+    results = []
+
+    def worker(*args):
+        barrier.wait()
+        results.append(target(*args))
+
+    threads = [threading.Thread(target=worker, args=args) for args in args_list]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_borrow_is_one_transaction_with_one_commit():
+    book_id = _book()
+    statements = []
+    with database.connection_scope() as conn:
+        conn.set_trace_callback(statements.append)
+        ok, _ = ls.borrow_book_by_patron("123456", book_id)
+        conn.set_trace_callback(None)
+    assert ok is True
+    assert statements[0] == 'BEGIN IMMEDIATE'
+    assert statements.count('COMMIT') == 1
+    assert database.get_book_by_id(book_id)['available_copies'] == 0
+    assert _open_loans(book_id) == 1
+
+
+def test_concurrent_borrows_never_oversell():
+    book_id = _book(copies=2)
+    patrons = [(f"{100000 + i}", book_id) for i in range(8)]
+    results = _run_concurrently(ls.borrow_book_by_patron, patrons)
+    assert sum(ok for ok, _ in results) == 2
+    assert all("not available" in msg for ok, msg in results if not ok)
+    assert database.get_book_by_id(book_id)['available_copies'] == 0
+    assert _open_loans(book_id) == 2
+
+
+def test_concurrent_returns_of_one_loan_succeed_once():
+    book_id = _book()
+    assert ls.borrow_book_by_patron("123456", book_id)[0] is True
+    results = _run_concurrently(ls.return_book_by_patron, [("123456", book_id)] * 6)
+    assert sum(ok for ok, _ in results) == 1
+    assert database.get_book_by_id(book_id)['available_copies'] == 1
+    assert _open_loans(book_id) == 0
+
+
+def test_limit_check_counts_open_loans_only():
+    for i in range(5):
+        book_id = _book(isbn=f"{5000000000000 + i}")
+        assert ls.borrow_book_by_patron("123456", book_id)[0] is True
+    extra = _book(isbn="5000000000099")
+    ok, msg = ls.borrow_book_by_patron("123456", extra)
+    assert ok is False and "maximum borrowing limit" in msg
+    ls.return_book_by_patron("123456", book_id)
+    assert ls.borrow_book_by_patron("123456", extra)[0] is True
+
+
+def test_rejected_borrow_leaves_no_trace():
+    book_id = _book()
+    assert ls.borrow_book_by_patron("111111", book_id)[0] is True
+    ok, _ = ls.borrow_book_by_patron("222222", book_id)
+    assert ok is False
+    assert _open_loans(book_id) == 1
+    assert database.get_book_by_id(book_id)['available_copies'] == 0
+
+
+def test_return_closes_oldest_open_loan_only():
+    book_id = _book(copies=2)
+    now = datetime.now()
+    database.insert_borrow_record("123456", book_id, now - timedelta(days=30), now - timedelta(days=16))
+    database.insert_borrow_record("123456", book_id, now - timedelta(days=1), now + timedelta(days=13))
+    database.update_book_availability(book_id, -2)
+    ok, msg = ls.return_book_by_patron("123456", book_id)
+    assert ok is True and "Late fee: $12.50 (16 days overdue)" in msg
+    assert _open_loans(book_id) == 1
+    assert database.get_book_by_id(book_id)['available_copies'] == 1
+
+
+def test_atomic_helpers_report_missing_book():
+    assert database.borrow_book_atomic("123456", 999, datetime.now(), datetime.now(), 5) == ('not_found', None)
+    assert database.return_book_atomic("123456", 999, datetime.now()) == ('not_found', None, None)
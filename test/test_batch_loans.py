@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+import database
+import services.library_service as ls
+
+
+def _book(isbn, copies=1, title="Batch Book"):
+    ls.add_book_to_catalog(title, "Author", isbn, copies)
+    return database.get_book_by_isbn(isbn)['id']
+
+
+def test_batch_borrow_applies_items_in_order():
+    a = _book("1000000000001", copies=1, title="A")
+    b = _book("1000000000002", copies=2, title="B")
+    results = ls.borrow_books_in_batch([
+        ("111111", a), ("222222", a), ("111111", b), ("12345", b), ("111111", 999),
+    ])
+    assert [r['success'] for r in results] == [True, False, True, False, False]
+    assert "not available" in results[1]['message']
+    assert "Invalid patron ID" in results[3]['message']
+    assert results[4]['message'] == "Book not found"
+    assert database.get_book_by_id(a)['available_copies'] == 0
+    assert database.get_book_by_id(b)['available_copies'] == 1
+    assert database.get_patron_borrow_count("111111") == 2
+
+
+def test_batch_borrow_counts_earlier_items_against_limit():
+    ids = [_book(f"20000000000{i:02d}") for i in range(8)]
+    results = ls.borrow_books_in_batch([("123456", book_id) for book_id in ids])
+    assert [r['success'] for r in results] == [True] * 5 + [False] * 3
+    assert "maximum borrowing limit" in results[5]['message']
+
+
+def test_batch_borrow_is_one_transaction():
+    ids = [_book(f"30000000000{i:02d}") for i in range(4)]
+    statements = []
+    with database.connection_scope() as conn:
+        conn.set_trace_callback(statements.append)
+        ls.borrow_books_in_batch([(f"{400000 + i}", book_id) for i, book_id in enumerate(ids)])
+        conn.set_trace_callback(None)
+    assert statements.count('BEGIN IMMEDIATE') == 1
+    assert statements.count('COMMIT') == 1
+
+
+def test_batch_return_reports_late_fees_like_single_return():
+    late = _book("4000000000001", title="Late")
+    on_time = _book("4000000000002", title="On Time")
+    now = datetime.now()
+    database.insert_borrow_record("123456", late, now - timedelta(days=30), now - timedelta(days=10))
+    database.update_book_availability(late, -1)
+    ls.borrow_book_by_patron("123456", on_time)
+
+    results = ls.return_books_in_batch([("123456", late), ("123456", on_time), ("123456", late)])
+    assert results[0]['success'] is True
+    assert (results[0]['days_overdue'], results[0]['late_fee']) == (10, 6.5)
+    assert "Late fee: $6.50 (10 days overdue)" in results[0]['message']
+    assert (results[1]['success'], results[1]['late_fee']) == (True, 0.0)
+    assert results[2]['success'] is False and "was not borrowed" in results[2]['message']
+    assert database.get_book_by_id(late)['available_copies'] == 1
+    assert database.get_patron_borrow_count("123456") == 0
+
+
+def test_batch_return_validates_book_ids():
+    results = ls.return_books_in_batch([("123456", 0), ("123456", "7")])
+    assert [r['message'] for r in results] == ["Invalid book ID", "Invalid book ID"]
+
+
+def test_batch_api_endpoints(client):
+    book_id = _book("5000000000001", copies=2)
+    response = client.post('/api/borrow/batch', json={'operations': [
+        {'patron_id': '111111', 'book_id': book_id}, ['222222', book_id], ['333333', book_id],
+    ]})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert (data['succeeded'], data['failed']) == (2, 1)
+
+    data = client.post('/api/return/batch', json=[['111111', book_id]]).get_json()
+    assert data['results'][0]['success'] is True
+    assert data['results'][0]['late_fee'] == 0.0
+
+
+def test_batch_api_rejects_malformed_bodies(client, monkeypatch):
+    assert client.post('/api/borrow/batch', json={'operations': []}).status_code == 400
+    assert client.post('/api/borrow/batch', json=[{'patron_id': '111111'}]).status_code == 400
+    assert client.post('/api/return/batch', data='not json').status_code == 400
+    monkeypatch.setattr('routes.api_routes.MAX_BATCH_SIZE', 2)
+    assert client.post('/api/return/batch', json=[['111111', 1]] * 3).status_code == 400
@@ -0,0 +1,98 @@
+import json
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+import database
+from benchmarks import datagen, service_suite
+
+AS_OF = datetime(2026, 1, 15, 12, 0)
+
+
+def _dump(path):
+    conn = sqlite3.connect(path)
+    try:
+        return (conn.execute('SELECT * FROM books ORDER BY id').fetchall(),
+                conn.execute('SELECT * FROM borrow_records ORDER BY id').fetchall())
+    finally:
+        conn.close()
+
+
+def test_generated_data_is_deterministic(tmp_path):
+    first = datagen.generate(str(tmp_path / 'a.db'), 2000, seed=5, as_of=AS_OF)
+    second = datagen.generate(str(tmp_path / 'b.db'), 2000, seed=5, as_of=AS_OF)
+    third = datagen.generate(str(tmp_path / 'c.db'), 2000, seed=6, as_of=AS_OF)
+
+    assert _dump(tmp_path / 'a.db') == _dump(tmp_path / 'b.db')
+    assert _dump(tmp_path / 'a.db') != _dump(tmp_path / 'c.db')
+    assert {k: v for k, v in first.items() if k != 'seconds'} == {k: v for k, v in second.items() if k != 'seconds'}
+    assert (first['books'], first['loans'], first['patrons']) == (2000, 2000, 200)
+    assert database.DATABASE == 'library.db'
+
+
+def test_generated_data_is_consistent(tmp_path):
+    path = str(tmp_path / 'lib.db')
+    counts = datagen.generate(path, 3000, as_of=AS_OF)
+    conn = sqlite3.connect(path)
+    try:
+        open_per_book = dict(conn.execute(
+            'SELECT book_id, COUNT(*) FROM borrow_records WHERE return_date IS NULL GROUP BY book_id'))
+        for book_id, total, available in conn.execute('SELECT id, total_copies, available_copies FROM books'):
+            assert available == total - open_per_book.get(book_id, 0) >= 0
+        most, total = conn.execute('SELECT MAX(open_loans), SUM(open_loans) FROM patrons').fetchone()
+        assert most <= datagen.MAX_OPEN_LOANS_PER_PATRON and total == counts['open_loans']
+        assert conn.execute('SELECT COUNT(*) FROM books_fts').fetchone()[0] == 3000
+    finally:
+        conn.close()
+    assert 0 < counts['overdue_loans'] < counts['open_loans']
+
+
+def test_generate_refuses_to_overwrite(tmp_path):
+    path = tmp_path / 'lib.db'
+    path.write_text('')
+    with pytest.raises(FileExistsError):
+        datagen.generate(str(path), 10)
+
+
+@pytest.mark.parametrize('text, scale', [('10k', 10_000), ('1M', 1_000_000), ('2500', 2500), ('10_000', 10_000)])
+def test_parse_scale(text, scale):
+    assert datagen.parse_scale(text) == scale
+
+
+@pytest.mark.parametrize('text', ['huge', '0', '-5'])
+def test_parse_scale_rejects(text):
+    with pytest.raises(ValueError):
+        datagen.parse_scale(text)
+
+
+def test_suite_times_every_service_function(tmp_path):
+    report = service_suite.run_suite(['1000'], repeat=3, data_dir=str(tmp_path))
+
+    functions = report['scales']['1000']['functions']
+    assert set(functions) >= {
+        'add_book_to_catalog', 'borrow_book_by_patron', 'return_book_by_patron', 'calculate_late_fee_for_book',
+        'get_patron_status_report', 'search_books_in_catalog[title,substring]', 'pay_late_fees',
+        'refund_late_fee_payment', 'pay_all_late_fees', 'open_loan_fees', 'iter_overdue_report',
+    }
+    assert all(stats['calls'] > 0 for stats in functions.values())
+    assert functions['return_book_by_patron']['calls'] == functions['borrow_book_by_patron']['calls']
+    json.dumps(report)
+    assert database.DATABASE == 'library.db'
+
+    # The generated database is reused and left untouched by the timed writes
+    cached = tmp_path / 'library_1000_seed327.db'
+    before = _dump(cached)
+    rerun = service_suite.run_suite(['1000'], repeat=3, data_dir=str(tmp_path), only=['search'])
+    assert rerun['scales']['1000']['data'] is None
+    assert all('search' in name for name in rerun['scales']['1000']['functions'])
+    assert _dump(cached) == before
+
+
+def test_compare_flags_slower_medians():
+    def report(p50):
+        return {'scales': {'10k': {'functions': {'f': {'p50_ms': p50}, 'g': {'p50_ms': 1.0}}}}}
+
+    assert service_suite.compare(report(1.2), report(1.0)) == []
+    regressions = service_suite.compare(report(2.0), report(1.0))
+    assert [(r['function'], r['ratio']) for r in regressions] == [('f', 2.0)]
@@ -0,0 +1,95 @@
+import pytest
+
+import cache
+import database
+from cache import LRUCache
+from services.library_service import borrow_book_by_patron, return_book_by_patron
+
+
+@pytest.fixture
+def book_id():
+    database.insert_book('Cached Book', 'Author', '1111111111111', 2, 2)
+    return database.get_book_by_isbn('1111111111111')['id']
+
+
+def test_lru_evicts_least_recently_used():
+    lru = LRUCache(maxsize=2)
+    lru.put('a', 1)
+    lru.put('b', 2)
+    assert lru.get('a') == 1
+    lru.put('c', 3)
+    assert lru.get('b') is None
+    assert (lru.get('a'), lru.get('c')) == (1, 3)
+    stats = lru.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['size']) == (3, 1, 1, 2)
+
+
+def test_lru_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    lru = LRUCache(maxsize=4, ttl=30)
+    lru.put('a', 1)
+    now[0] += 29
+    assert lru.get('a') == 1
+    now[0] += 2
+    assert lru.get('a') is None
+    assert len(lru) == 0
+
+
+def test_put_after_invalidation_is_dropped():
+    lru = LRUCache(maxsize=4)
+    generation = lru.generation
+    lru.invalidate('a')
+    lru.put('a', 'stale', generation)
+    assert lru.get('a') is None
+
+
+def test_zero_size_disables_caching():
+    lru = LRUCache(maxsize=0)
+    lru.put('a', 1)
+    assert lru.get('a') is None
+
+
+def test_repeat_lookups_are_served_from_cache(book_id):
+    before = database.get_book_cache_stats()
+    database.get_book_by_id(book_id)
+    database.get_book_by_id(book_id)
+    database.get_book_by_isbn('1111111111111')
+    after = database.get_book_cache_stats()
+    assert after['hits'] - before['hits'] == 3
+    assert after['misses'] == before['misses']
+
+
+def test_callers_get_private_copies(book_id):
+    database.get_book_by_id(book_id)['available_copies'] = 99
+    assert database.get_book_by_id(book_id)['available_copies'] == 2
+
+
+def test_availability_is_fresh_after_borrow_and_return(book_id):
+    assert database.get_book_by_id(book_id)['available_copies'] == 2
+    assert borrow_book_by_patron('123456', book_id)[0]
+    assert database.get_book_by_id(book_id)['available_copies'] == 1
+    assert database.get_book_by_isbn('1111111111111')['available_copies'] == 1
+    assert return_book_by_patron('123456', book_id)[0]
+    assert database.get_book_by_id(book_id)['available_copies'] == 2
+
+
+def test_update_book_availability_invalidates(book_id):
+    database.get_book_by_id(book_id)
+    assert database.update_book_availability(book_id, -1)
+    assert database.get_book_by_id(book_id)['available_copies'] == 1
+
+
+def test_unknown_books_are_not_cached():
+    assert database.get_book_by_isbn('2222222222222') is None
+    database.insert_book('Late Arrival', 'Author', '2222222222222', 1, 1)
+    book = database.get_book_by_isbn('2222222222222')
+    assert book['title'] == 'Late Arrival'
+    assert database.get_book_by_id(book['id'])['title'] == 'Late Arrival'
+
+
+def test_cache_follows_database_path(book_id, tmp_path, monkeypatch):
+    database.get_book_by_id(book_id)
+    monkeypatch.setattr(database, 'DATABASE', str(tmp_path / 'other.db'))
+    database.init_database()
+    assert database.get_book_by_id(book_id) is None
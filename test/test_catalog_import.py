@@ -0,0 +1,108 @@
+import io
+import json
+
+import database
+import services.library_service as ls
+from services.catalog_import import import_books, import_file, main, read_rows
+
+
+def _csv(*lines):
+    return io.StringIO('title,author,isbn,total_copies\n' + '\n'.join(lines) + '\n')
+
+
+def test_csv_import_inserts_valid_rows():
+    report = import_books(read_rows(_csv(
+        'Dune,Frank Herbert,9780441172719,3',
+        'Emma,Jane Austen,9780141439587,1',
+    ), 'csv'))
+    assert report['rows'] == 2 and report['imported'] == 2 and report['errors'] == []
+    assert report['rows_per_second'] > 0
+    dune = database.get_book_by_isbn('9780441172719')
+    assert dune['total_copies'] == 3 and dune['available_copies'] == 3
+
+
+def test_rows_are_validated_with_r1_rules():
+    report = import_books(read_rows(_csv(
+        ',Nobody,1111111111111,1',
+        'Short ISBN,Someone,123,1',
+        'No Copies,Someone,2222222222222,0',
+        'Bad Copies,Someone,3333333333333,many',
+        'Good,Someone,4444444444444,2',
+    ), 'csv'))
+    assert report['imported'] == 1
+    assert [(e['row'], e['error']) for e in report['errors']] == [
+        (1, "Title is required"),
+        (2, "ISBN must be exactly 13 digits"),
+        (3, "Total copies must be a positive integer"),
+        (4, "Total copies must be a positive integer"),
+    ]
+
+
+def test_duplicates_against_database_and_within_batch():
+    ls.add_book_to_catalog("Existing", "Author", "5555555555555", 1)
+    report = import_books(read_rows(_csv(
+        'Again,Author,5555555555555,1',
+        'First,Author,6666666666666,1',
+        'Second,Author,6666666666666,1',
+    ), 'csv'), chunk_size=1)
+    assert report['imported'] == 1
+    assert [(e['row'], e['error']) for e in report['errors']] == [
+        (1, "A book with this ISBN already exists"),
+        (3, "A book with this ISBN already exists"),
+    ]
+    assert database.get_book_by_isbn('6666666666666')['title'] == 'First'
+
+
+def test_jsonl_import_reports_malformed_lines():
+    lines = [
+        json.dumps({'title': 'Ulysses', 'author': 'James Joyce', 'isbn': '9780199535675', 'total_copies': 2}),
+        '{not json',
+        '',
+        json.dumps(['not', 'an', 'object']),
+    ]
+    report = import_books(read_rows(io.StringIO('\n'.join(lines)), 'jsonl'))
+    assert report['imported'] == 1
+    assert [e['error'] for e in report['errors']] == ['Malformed JSON line', 'Malformed JSON line']
+
+
+def test_chunks_are_inserted_with_executemany(mocker):
+    import services.catalog_import as ci
+    spy = mocker.spy(ci, 'insert_books')
+    rows = [{'title': f'T{i}', 'author': 'A', 'isbn': f'{7000000000000 + i}', 'total_copies': 1}
+            for i in range(25)]
+    report = import_books(rows, chunk_size=10)
+    assert report['imported'] == 25
+    assert [len(call.args[0]) for call in spy.call_args_list] == [10, 10, 5]
+    assert len(database.get_all_books()) == 25
+
+
+def test_failed_chunk_falls_back_to_row_inserts(mocker):
+    ls.add_book_to_catalog("Taken", "A", "8000000000001", 1)
+    # Pretend the duplicate appeared after the ISBN check ran
+    mocker.patch('services.catalog_import.get_books_by_isbns', return_value=[])
+    rows = [
+        {'title': 'New', 'author': 'A', 'isbn': '8000000000000', 'total_copies': 1},
+        {'title': 'Clash', 'author': 'A', 'isbn': '8000000000001', 'total_copies': 1},
+    ]
+    report = import_books(rows)
+    assert report['imported'] == 1
+    assert [e['row'] for e in report['errors']] == [2]
+    assert database.get_book_by_isbn('8000000000000') is not None
+
+
+def test_import_updates_search_index(monkeypatch):
+    monkeypatch.setattr(ls, '_search_index', None)
+    ls.build_search_index()
+    import_books([{'title': 'Imported Gatsby', 'author': 'A', 'isbn': '9000000000000', 'total_copies': 1}])
+    assert [b['title'] for b in ls.search_books_in_catalog('atsb', 'title', mode='trigram')] == ['Imported Gatsby']
+
+
+def test_cli_imports_file(tmp_path, capsys, monkeypatch):
+    path = tmp_path / 'books.jsonl'
+    path.write_text(json.dumps({'title': 'CLI', 'author': 'A', 'isbn': '9100000000000', 'total_copies': 1}) + '\n')
+    db_path = str(tmp_path / 'cli.db')
+    monkeypatch.setattr(database, 'DATABASE', database.DATABASE)
+    assert main([str(path), '--database', db_path]) == 0
+    assert 'Imported 1 of 1 rows' in capsys.readouterr().out
+    assert [b['title'] for b in database.get_all_books()] == ['CLI']
+    assert import_file(str(path))['errors'][0]['error'] == 'A book with this ISBN already exists'
@@ -0,0 +1,45 @@
+import database
+import services.library_service as ls
+
+
+def _add_books(count):
+    for i in range(count):
+        ls.add_book_to_catalog(f"Shelf {i:03d}", "Author", f"{4000000000000 + i}", 1)
+
+
+def test_iter_all_books_yields_catalog_in_order():
+    _add_books(12)
+    assert list(database.iter_all_books(batch_size=5)) == database.get_all_books()
+
+
+def test_iter_all_books_releases_connection_when_closed():
+    _add_books(3)
+    database.close_pool()
+    books = database.iter_all_books(batch_size=1)
+    next(books)
+    assert database.get_pool_stats()['idle'] == 0
+    books.close()
+    assert database.get_pool_stats()['idle'] == 1
+
+
+def test_full_list_is_streamed_with_every_book(client):
+    _add_books(250)
+    response = client.get('/catalog?all=1')
+    assert response.status_code == 200
+    assert response.is_streamed
+    body = response.get_data(as_text=True)
+    assert body.count('<tr>') == 251  # header row + one per book
+    assert body.index('Shelf 000') < body.index('Shelf 249')
+    assert 'Next Page' not in body
+
+
+def test_full_list_of_empty_catalog(client):
+    response = client.get('/catalog?all=1')
+    assert response.status_code == 200
+    assert 'No books in catalog' in response.get_data(as_text=True)
+
+
+def test_paged_catalog_links_to_full_list(client):
+    _add_books(1)
+    body = client.get('/catalog').get_data(as_text=True)
+    assert 'Full shelf list' in body
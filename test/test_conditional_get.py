@@ -0,0 +1,88 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import database
+from services import library_service
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def book(client):
+    database.insert_book('Conditional Book', 'Some Author', '3333333333333', 2, 2)
+    return database.get_book_by_isbn('3333333333333')
+
+
+@pytest.mark.parametrize('url', ['/catalog', '/search?q=Conditional', '/api/search?q=Conditional'])
+def test_unchanged_catalog_returns_304(client, book, url, mocker):
+    first = client.get(url)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert first.headers['Cache-Control'] == 'no-cache'
+
+    execute = mocker.spy(database.PooledConnection, 'execute')
+    render = mocker.patch('flask.templating._render', side_effect=AssertionError('template rendered'))
+    second = client.get(url, headers={'If-None-Match': etag})
+    assert second.status_code == 304
+    assert second.headers['ETag'] == etag
+    assert second.data == b''
+    # Only the shared catalog version is read
+    assert [call.args[1] for call in execute.call_args_list] == [
+        'SELECT nonce, generation FROM catalog_generation WHERE id = 1']
+    render.assert_not_called()
+
+
+def test_borrow_changes_the_etag(client, book):
+    etag = client.get('/api/search?q=Conditional').headers['ETag']
+    assert library_service.borrow_book_by_patron('123456', book['id'])[0]
+    response = client.get('/api/search?q=Conditional', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.get_json()['results'][0]['available_copies'] == 1
+
+
+def test_new_book_changes_the_etag(client, book):
+    etag = client.get('/catalog').headers['ETag']
+    assert library_service.add_book_to_catalog('Another Book', 'Author', '4444444444444', 1)[0]
+    response = client.get('/catalog', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'Another Book' in response.data
+
+
+def test_weak_etag_from_proxy_still_matches(client, book):
+    etag = client.get('/catalog').headers['ETag']
+    response = client.get('/catalog', headers={'If-None-Match': 'W/' + etag})
+    assert response.status_code == 304
+
+
+def test_pending_flash_messages_bypass_304(client, book):
+    etag = client.get('/catalog').headers['ETag']
+    with client.session_transaction() as session:
+        session['_flashes'] = [('error', 'Something to show')]
+    response = client.get('/catalog', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'Something to show' in response.data
+
+
+def test_errors_are_not_tagged(client):
+    response = client.get('/api/search')
+    assert response.status_code == 400
+    assert 'ETag' not in response.headers
+
+
+def test_writes_from_another_process_change_the_etag(client, book, tmp_path):
+    etag = client.get('/api/search?q=Conditional').headers['ETag']
+    source = tmp_path / 'books.csv'
+    source.write_text('title,author,isbn,total_copies\nConditional Import,Other Author,5555555555555,1\n')
+
+    subprocess.run([sys.executable, '-m', 'services.catalog_import', str(source),
+                    '--database', os.path.abspath(database.DATABASE)],
+                   cwd=PROJECT_ROOT, check=True, capture_output=True)
+
+    response = client.get('/api/search?q=Conditional', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert {book['title'] for book in response.get_json()['results']} == {'Conditional Book', 'Conditional Import'}
@@ -0,0 +1,107 @@
+import sqlite3
+import threading
+
+import pytest
+
+import database
+from migrations import run_migrations
+
+
+@pytest.fixture
+def pool_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DATABASE', str(tmp_path / 'pool.db'))
+    monkeypatch.setattr(database, 'POOL_ENABLED', True)
+    database.close_pool()
+    database.init_database()
+    run_migrations()
+    database.add_sample_data()
+    yield
+    database.close_pool()
+
+
+def test_helpers_reuse_pooled_connection(pool_db):
+    database.close_pool()
+    database.get_book_by_id(1)
+    database.get_patron_borrow_count('123456')
+    database.get_book_by_isbn('9780743273565')
+    stats = database.get_pool_stats()
+    assert stats['opened'] == 1
+    assert stats['reused'] == 2
+    assert stats['idle'] == 1
+
+
+def test_connection_pragmas_applied(pool_db):
+    conn = database.get_db_connection()
+    try:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1
+        assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+    finally:
+        conn.close()
+
+
+def test_release_rolls_back_uncommitted_work(pool_db):
+    conn = database.get_db_connection()
+    conn.execute('UPDATE books SET available_copies = 99 WHERE id = 1')
+    conn.close()
+    assert database.get_book_by_id(1)['available_copies'] == 3
+
+
+def test_double_close_does_not_corrupt_pool(pool_db):
+    conn = database.get_db_connection()
+    conn.close()
+    conn.close()
+    assert database.get_pool_stats()['idle'] == 1
+    assert database.get_book_by_id(1) is not None
+
+
+def test_pool_is_bounded(pool_db, monkeypatch):
+    monkeypatch.setattr(database, 'POOL_SIZE', 1)
+    monkeypatch.setattr(database, 'POOL_TIMEOUT', 0.05)
+    database.close_pool()
+    held = database.get_db_connection()
+    with pytest.raises(sqlite3.OperationalError, match='exhausted'):
+        database.get_db_connection()
+    held.close()
+    assert database.get_book_by_id(1) is not None
+
+
+def test_connection_scope_pins_one_connection(pool_db):
+    database.close_pool()
+    with database.connection_scope() as conn:
+        assert database.get_db_connection() is conn
+        database.get_book_by_id(1)
+        database.update_book_availability(1, -1)
+        assert database.get_book_by_id(1)['available_copies'] == 2
+    stats = database.get_pool_stats()
+    assert stats['opened'] == 1 and stats['checkouts'] == 1
+    assert stats['idle'] == 1
+
+
+def test_scopes_are_per_thread(pool_db):
+    seen = []
+
+    def worker():
+        with database.connection_scope() as conn:
+            seen.append(conn)
+
+    with database.connection_scope() as conn:
+        t = threading.Thread(target=worker)
+        t.start()
+        t.join()
+        assert seen[0] is not conn
+
+
+def test_pool_follows_database_path(pool_db, tmp_path, monkeypatch):
+    database.get_book_by_id(1)
+    monkeypatch.setattr(database, 'DATABASE', str(tmp_path / 'other.db'))
+    database.init_database()
+    assert database.get_all_books() == []
+    assert database.get_pool().database == str(tmp_path / 'other.db')
+
+
+def test_pool_disabled_opens_fresh_connections(pool_db, monkeypatch):
+    monkeypatch.setattr(database, 'POOL_ENABLED', False)
+    database.close_pool()
+    assert database.get_book_by_id(1)['title'] == 'The Great Gatsby'
+    assert database.get_pool_stats()['checkouts'] == 0
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from migrations import MIGRATIONS, apply_migrations
+
+
+@pytest.fixture
+def legacy_db(tmp_path, monkeypatch):
+    """A database with ISO text loan dates, migrated up to just before version 7."""
+    monkeypatch.setattr(database, 'DATABASE', str(tmp_path / 'legacy.db'))
+    database.close_pool()
+    database.init_database()
+    conn = database.get_db_connection()
+    monkeypatch.setattr('migrations.MIGRATIONS', [m for m in MIGRATIONS if m[0] < 7])
+    apply_migrations(conn)
+    conn.execute("INSERT INTO books (title, author, isbn, total_copies, available_copies) "
+                 "VALUES ('Book', 'Author', '1234567890123', 3, 1)")
+    conn.executemany('''
+        INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date, return_date)
+        VALUES (?, 1, ?, ?, ?)
+    ''', [
+        ('123456', '2024-01-01T09:30:00.250000', '2024-01-15T09:30:00.250000', '2024-01-10T12:00:00'),
+        ('123456', '2024-02-01T08:00:00', '2024-02-15T08:00:00', None),
+        ('654321', '2024-03-01T10:00:00', '2024-03-15T10:00:00', None),
+    ])
+    conn.commit()
+    monkeypatch.setattr('migrations.MIGRATIONS', MIGRATIONS)
+    yield conn
+    conn.close()
+    database.close_pool()
+
+
+def test_migration_converts_iso_dates_to_epoch_seconds(legacy_db):
+    assert apply_migrations(legacy_db) == [version for version, _, _ in MIGRATIONS if version >= 7]
+    rows = legacy_db.execute('''
+        SELECT typeof(borrow_date), typeof(due_date), borrow_date, return_date
+        FROM borrow_records ORDER BY id
+    ''').fetchall()
+    assert {(r[0], r[1]) for r in rows} == {('integer', 'integer')}
+    assert rows[0][2] == database.to_epoch_seconds(datetime(2024, 1, 1, 9, 30))
+    assert rows[0][3] == database.to_epoch_seconds(datetime(2024, 1, 10, 12))
+    assert rows[1][3] is None
+
+
+def test_migration_keeps_indexes_triggers_and_sequence(legacy_db):
+    apply_migrations(legacy_db)
+    names = {r[0] for r in legacy_db.execute("SELECT name FROM sqlite_master WHERE tbl_name = 'borrow_records'")}
+    assert {'idx_borrow_records_patron_return', 'idx_borrow_records_patron_borrow_date',
+            'idx_borrow_records_open_book', 'idx_borrow_records_open_due',
+            'patrons_loan_opened', 'patrons_loan_closed'} <= names
+
+    assert database.get_patron_borrow_count('123456') == 1
+    now = datetime.now()
+    assert database.insert_borrow_record('123456', 1, now, now + timedelta(days=14))
+    assert database.get_patron_borrow_count('123456') == 2
+    new_id = legacy_db.execute('SELECT MAX(id) FROM borrow_records').fetchone()[0]
+    assert new_id == 4
+
+
+def test_history_dates_decode_to_original_values(legacy_db):
+    apply_migrations(legacy_db)
+    history = database.get_patron_borrowing_history('123456')
+    decode = database.from_epoch_seconds
+    assert [decode(h['borrow_date']) for h in history] == [datetime(2024, 2, 1, 8), datetime(2024, 1, 1, 9, 30)]
+    assert history[0]['return_date'] is None and history[0]['is_overdue']
+    assert decode(history[1]['return_date']) == datetime(2024, 1, 10, 12)
+    assert history[1]['is_returned'] and not history[1]['is_overdue']
+
+    borrowed = database.get_patron_borrowed_books('123456')
+    assert borrowed == [{'book_id': 1, 'title': 'Book', 'author': 'Author',
+                         'borrow_date': database.to_epoch_seconds(datetime(2024, 2, 1, 8)),
+                         'due_date': database.to_epoch_seconds(datetime(2024, 2, 15, 8)),
+                         'is_overdue': True}]
+
+
+def test_round_trip_drops_only_subseconds():
+    moment = datetime(2025, 6, 30, 23, 59, 59, 999999)
+    assert database.from_epoch_seconds(database.to_epoch_seconds(moment)) == moment.replace(microsecond=0)
+
+
+def test_due_range_scan_uses_index():
+    conn = database.get_db_connection()
+    try:
+        plan = [row['detail'] for row in conn.execute('''
+            EXPLAIN QUERY PLAN
+            SELECT id FROM borrow_records WHERE return_date IS NULL AND due_date <= ?
+        ''', (0,))]
+    finally:
+        conn.close()
+    assert any('idx_borrow_records_open_due' in detail for detail in plan), plan
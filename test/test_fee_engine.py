@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from services import fee_engine
+from services.fee_engine import compute_late_fees, late_fee_for_days, open_loan_fees
+
+SCHEDULE = [(-3, 0.0), (0, 0.0), (1, 0.5), (7, 3.5), (8, 4.5), (18, 14.5), (19, 15.0), (400, 15.0)]
+
+
+@pytest.mark.parametrize('days, fee', SCHEDULE)
+def test_late_fee_schedule(days, fee):
+    assert late_fee_for_days(days) == fee
+
+
+def test_compute_late_fees_on_lists():
+    assert compute_late_fees([days for days, _ in SCHEDULE]) == [fee for _, fee in SCHEDULE]
+
+
+def test_compute_late_fees_on_numpy_arrays():
+    np = pytest.importorskip('numpy')
+    days = np.arange(-5, 40)
+    assert compute_late_fees(days).tolist() == [late_fee_for_days(int(d)) for d in days]
+
+
+@pytest.fixture
+def loans():
+    """Open loans due at assorted offsets (in days) from AS_OF, plus one returned loan."""
+    as_of = datetime(2025, 3, 1, 12, 0, 0, 500000)
+    database.insert_book('Book', 'Author', '1234567890123', 50, 50)
+    offsets = [-30, -1, 0, 0.5, 1, 6.99, 7, 8, 18.5, 19, 45]
+    for i, offset in enumerate(offsets):
+        due = as_of - timedelta(days=offset)
+        database.insert_borrow_record(f'{100000 + i}', 1, due - timedelta(days=14), due)
+    database.insert_borrow_record('999999', 1, as_of - timedelta(days=60), as_of - timedelta(days=46))
+    database.update_borrow_record_return_date('999999', 1, as_of)
+    expected = [late_fee_for_days(int(offset)) if offset > 0 else 0.0 for offset in offsets]
+    return as_of, expected
+
+
+def test_sql_engine_matches_schedule(loans):
+    as_of, expected = loans
+    result = open_loan_fees(as_of, engine='sql')
+    assert result['engine'] == 'sql'
+    assert result['fees'] == expected
+    assert result['patron_ids'][0] == '100000'
+    assert result['total'] == round(sum(expected), 2)
+
+
+def test_numpy_engine_matches_sql_engine(loans):
+    pytest.importorskip('numpy')
+    as_of, expected = loans
+    vectorized = open_loan_fees(as_of, engine='numpy', batch_size=4)
+    assert vectorized['fees'].tolist() == expected
+    sql = open_loan_fees(as_of, engine='sql')
+    assert vectorized['days_overdue'].tolist() == sql['days_overdue']
+    assert vectorized['loan_ids'].tolist() == sql['loan_ids']
+    assert vectorized['total'] == sql['total']
+
+
+def test_engines_handle_no_open_loans():
+    for engine in fee_engine.ENGINES:
+        if engine == 'numpy' and fee_engine.np is None:
+            continue
+        result = open_loan_fees(engine=engine)
+        assert len(result['fees']) == 0 and result['total'] == 0
+
+
+def test_default_engine_falls_back_to_sql(monkeypatch):
+    monkeypatch.setattr(fee_engine, 'np', None)
+    assert open_loan_fees()['engine'] == 'sql'
+    with pytest.raises(ValueError):
+        open_loan_fees(engine='numpy')
+    with pytest.raises(ValueError):
+        open_loan_fees(engine='abacus')
@@ -0,0 +1,120 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from benchmarks import payments as payments_benchmark
+from services.gateway_simulator import SimulatedGateway, parse_latency
+from services.library_service import pay_late_fees, refund_late_fee_payment
+from services.payment_outbox import process_outbox_batch, submit_fee_payment
+
+
+def _gateway(**kwargs):
+    sleeps = []
+    kwargs.setdefault('latency', 'constant:0.05')
+    gateway = SimulatedGateway(seed=1, sleep=sleeps.append, **kwargs)
+    return gateway, sleeps
+
+
+@pytest.mark.parametrize('spec, low, high', [
+    ('constant:0.2', 0.2, 0.2),
+    ('uniform:0.1,0.3', 0.1, 0.3),
+    ('exponential:0.05', 0.0, float('inf')),
+    ('lognormal:0.05,0.5', 0.0, float('inf')),
+])
+def test_latency_specs(spec, low, high):
+    sample = parse_latency(spec)
+    rng = random.Random(0)
+    assert all(low <= sample(rng) <= high for _ in range(200))
+
+
+@pytest.mark.parametrize('spec', ['', 'normal:1', 'uniform:1', 'constant:x'])
+def test_invalid_latency_spec(spec):
+    with pytest.raises(ValueError):
+        parse_latency(spec)
+
+
+def test_charge_sleeps_and_is_recorded():
+    gateway, sleeps = _gateway()
+    success, txn, message = gateway.process_payment('123456', 6.5, 'Late fees')
+
+    assert success and txn.startswith('txn_') and message == 'Approved'
+    assert sleeps == [0.05]
+    assert [(c['transaction_id'], c['amount']) for c in gateway.ledger()] == [(txn, 6.5)]
+
+
+def test_failure_rate_declines():
+    gateway, _ = _gateway(failure_rate=1.0)
+    assert gateway.process_payment('123456', 6.5, 'Late fees') == (False, None, 'Card declined')
+    assert gateway.ledger() == [] and gateway.stats()['declines'] == 1
+
+
+def test_timed_out_charge_is_applied_and_replayed_by_key():
+    gateway, sleeps = _gateway(timeout_rate=1.0, timeout=2.0)
+    with pytest.raises(TimeoutError):
+        gateway.process_payment('123456', 6.5, 'Late fees', idempotency_key='k1')
+    assert sleeps == [2.0] and len(gateway.ledger()) == 1
+
+    gateway.timeout_rate = 0.0
+    success, txn, _ = gateway.process_payment('123456', 6.5, 'Late fees', idempotency_key='k1')
+    assert success and txn == gateway.ledger()[0]['transaction_id']
+    assert gateway.stats()['charges'] == 1 and gateway.stats()['replays'] == 1
+
+
+def test_refunds_are_validated_against_the_ledger():
+    gateway, _ = _gateway()
+    _, txn, _ = gateway.process_payment('123456', 6.5, 'Late fees')
+
+    assert gateway.refund_payment('txn_unknown', 1.0) == (False, 'Unknown transaction')
+    assert gateway.refund_payment(txn, 4.0) == (True, 'Refunded $4.00')
+    success, message = gateway.refund_payment(txn, 3.0)
+    assert not success and '$2.50 left' in message
+    assert gateway.refund_payment(txn, 2.5)[0]
+    assert gateway.stats()['refunded'] == 6.5
+
+
+def test_seeded_runs_are_reproducible():
+    draws = []
+    for _ in range(2):
+        sleeps = []
+        gateway = SimulatedGateway('lognormal:0.05,0.5', failure_rate=0.3, seed=7, sleep=sleeps.append)
+        outcomes = [gateway.process_payment('123456', 1.0, 'x')[0] for _ in range(20)]
+        draws.append((sleeps, outcomes))
+    assert draws[0] == draws[1]
+
+
+def test_service_layer_pays_and_refunds_through_the_simulator():
+    database.insert_book('Overdue Book', 'Author', '5555555555555', 5, 5)
+    book_id = database.get_book_by_isbn('5555555555555')['id']
+    now = datetime.now()
+    database.insert_borrow_record('123456', book_id, now - timedelta(days=24), now - timedelta(days=10))
+    gateway, _ = _gateway()
+
+    success, message, txn = pay_late_fees('123456', book_id, gateway)
+    assert success and txn == gateway.ledger()[0]['transaction_id']
+    assert refund_late_fee_payment(txn, 6.5, gateway) == (True, 'Refunded $6.50')
+    assert refund_late_fee_payment(txn, 1.0, gateway)[0] is False
+
+
+def test_outbox_retry_after_timeout_charges_once():
+    database.insert_book('Overdue Book', 'Author', '5555555555555', 5, 5)
+    book_id = database.get_book_by_isbn('5555555555555')['id']
+    now = datetime.now()
+    database.insert_borrow_record('123456', book_id, now - timedelta(days=24), now - timedelta(days=10))
+    gateway, _ = _gateway(timeout_rate=1.0)
+
+    _, intent = submit_fee_payment('123456')
+    process_outbox_batch(gateway)
+    gateway.timeout_rate = 0.0
+    process_outbox_batch(gateway, now=datetime.now() + timedelta(hours=1))
+
+    assert database.get_payment_intent(intent['id'])['status'] == 'succeeded'
+    assert len(gateway.ledger()) == 1 and gateway.stats()['replays'] == 1
+
+
+def test_payments_benchmark_runs():
+    results = payments_benchmark.benchmark(patrons=20, threads=4, latency='constant:0', timeout_rate=0.1,
+                                           timeout=0)
+    assert results['pay']['calls'] == 20 and results['ledger_consistent']
+    assert results['pay']['p50_ms'] <= results['pay']['p99_ms']
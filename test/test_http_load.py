@@ -0,0 +1,48 @@
+import pytest
+
+from benchmarks import datagen, http_load
+
+
+def test_route_weights_split_reads_and_writes():
+    shares = http_load.route_weights(0.25)
+
+    assert sum(shares.values()) == pytest.approx(1.0)
+    assert sum(share for name, share in shares.items() if http_load.ROUTES[name][0] == 'write') == pytest.approx(0.25)
+    assert 'overdue_report' not in shares
+    assert shares['borrow'] == pytest.approx(4 * shares['add_book'])
+
+
+def test_route_weight_overrides():
+    shares = http_load.route_weights(0.0, {'catalog': 0, 'overdue_report': 1})
+
+    assert 'catalog' not in shares and 'overdue_report' in shares
+    assert all(http_load.ROUTES[name][0] == 'read' for name in shares)
+
+
+@pytest.mark.parametrize('write_ratio, mix', [
+    (1.5, None),
+    (0.2, {'nope': 1}),
+    (0.2, {'borrow': 0, 'return': 0, 'add_book': 0, 'borrow_batch': 0, 'return_batch': 0}),
+])
+def test_route_weights_reject(write_ratio, mix):
+    with pytest.raises(ValueError):
+        http_load.route_weights(write_ratio, mix)
+
+
+def test_load_run_drives_every_blueprint(tmp_path):
+    report = http_load.run_load('300', configs=['default', 'no-pool-no-cache'], clients=2, duration=1.5,
+                                write_ratio=0.5, data_dir=str(tmp_path))
+
+    for name, result in report['configs'].items():
+        assert result['errors'] == 0 and result['server_errors'] == 0, name
+        assert result['requests'] > 0 and result['requests_per_sec'] > 0
+        called = {route for route, stats in result['routes'].items() if stats['calls']}
+        assert {'catalog', 'search', 'api_search', 'late_fee', 'borrow', 'return'} <= called
+        assert result['routes']['borrow']['status'] == {'302': result['routes']['borrow']['calls']}
+    assert report['configs']['no-pool-no-cache']['settings'] == {'pool': False, 'cache': False}
+    assert list(tmp_path.iterdir()) == [tmp_path / 'library_300_seed327.db']
+
+
+def test_unknown_configuration():
+    with pytest.raises(ValueError):
+        http_load.run_load('300', configs=['turbo'])
@@ -0,0 +1,181 @@
+import os
+import re
+import shutil
+import sqlite3
+import threading
+
+import pytest
+
+import database
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    metrics.REGISTRY.reset()
+    yield
+    metrics.REGISTRY.reset()
+
+
+def _sample(text, name, **labels):
+    """Value of one sample in Prometheus text output (None when absent)."""
+    wanted = ','.join(f'{key}="{value}"' for key, value in labels.items())
+    pattern = '^' + re.escape(name) + (r'\{' + re.escape(wanted) + r'\}' if labels else '') + r' (\S+)$'
+    match = re.search(pattern, text, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+
+def test_metrics_endpoint_reports_requests_per_endpoint(client):
+    client.get('/catalog')
+    client.get('/catalog')
+    client.get('/api/search?q=dune')
+    client.get('/no-such-page')
+
+    response = client.get('/metrics')
+    text = response.get_data(as_text=True)
+
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'text/plain; version=0.0.4; charset=utf-8'
+    assert '# TYPE library_http_request_duration_seconds histogram' in text
+    assert _sample(text, 'library_http_request_duration_seconds_count',
+                   endpoint='catalog.catalog', method='GET', status='200') == 2
+    assert _sample(text, 'library_http_request_duration_seconds_bucket',
+                   endpoint='catalog.catalog', method='GET', status='200', le='+Inf') == 2
+    assert _sample(text, 'library_http_request_duration_seconds_count',
+                   endpoint='api.search_books_api', method='GET', status='200') == 1
+    assert _sample(text, 'library_http_request_duration_seconds_count',
+                   endpoint='unmatched', method='GET', status='404') == 1
+    assert _sample(text, 'library_http_request_queries_count', endpoint='catalog.catalog') == 2
+    assert _sample(text, 'library_http_request_queries_sum', endpoint='catalog.catalog') >= 2
+
+
+def test_request_sql_work_is_counted():
+    database.insert_books([(f'Book {i}', 'Author', f'{1000000000000 + i}', 1, 1) for i in range(3)])
+    conn = database.get_db_connection()
+
+    metrics.begin_request()
+    assert sum(1 for _ in conn.execute('SELECT * FROM books')) == 3
+    assert len(conn.execute('SELECT * FROM books').fetchall()) == 3
+    assert conn.execute('SELECT * FROM books WHERE id = -1').fetchone() is None
+    metrics.end_request('catalog.catalog', 'GET', 200)
+    conn.close()
+
+    assert metrics.SQL_QUERIES.values[()] == 3
+    assert metrics.SQL_ROWS.values[()] == 6
+    assert metrics.SQL_SECONDS.values[()] > 0
+    assert metrics.REQUEST_QUERIES.values[('catalog.catalog',)][-1] == 3
+    assert metrics.REQUEST_QUERIES.values[('catalog.catalog',)][metrics.QUERY_COUNT_BUCKETS.index(5)] == 1
+
+
+def test_queries_outside_requests_are_folded_in_when_collected():
+    def worker():
+        conn = database.get_db_connection()
+        conn.execute('SELECT 1').fetchone()
+        conn.close()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+
+    text = metrics.render()
+    assert _sample(text, 'library_sql_queries_total') >= 1
+    assert _sample(text, 'library_sql_rows_total') >= 1
+    assert _sample(metrics.render(), 'library_sql_queries_total') == _sample(text, 'library_sql_queries_total')
+
+
+def test_connection_sources_are_counted():
+    database.get_db_connection().close()
+    with database.connection_scope():
+        database.get_db_connection()
+
+    assert metrics.DB_CONNECTIONS.values[('scoped',)] == 1
+    assert metrics.DB_CONNECTIONS.values[('pooled' if database.POOL_ENABLED else 'new',)] >= 2
+
+
+def test_histogram_buckets_are_cumulative():
+    for seconds in (0.0005, 0.003, 0.003, 20):
+        with metrics.REGISTRY.lock:
+            metrics.REQUEST_SECONDS.observe(('x', 'GET', '200'), seconds)
+    text = metrics.render()
+
+    def bucket(le):
+        return _sample(text, 'library_http_request_duration_seconds_bucket',
+                       endpoint='x', method='GET', status='200', le=le)
+
+    assert (bucket('0.001'), bucket('0.005'), bucket('10'), bucket('+Inf')) == (1, 3, 3, 4)
+    assert _sample(text, 'library_http_request_duration_seconds_sum',
+                   endpoint='x', method='GET', status='200') == pytest.approx(20.0065)
+
+
+def test_worker_processes_are_summed(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path))
+    metrics.begin_request()
+    metrics.end_request('catalog.catalog', 'GET', 200)
+    metrics.flush()
+
+    # A second worker process with the same counts
+    own = os.path.join(tmp_path, metrics._PROCESS_FILE)
+    shutil.copyfile(own, tmp_path / 'other-worker.json')
+    (tmp_path / 'partial.json').write_text('{"library_sql_q')
+
+    text = metrics.render()
+    assert _sample(text, 'library_http_request_duration_seconds_count',
+                   endpoint='catalog.catalog', method='GET', status='200') == 2
+
+
+def test_snapshots_are_written_at_most_once_per_interval(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path))
+    monkeypatch.setattr(metrics, 'FLUSH_INTERVAL', 3600)
+    monkeypatch.setattr(metrics, '_last_flush', float('-inf'))
+    path = tmp_path / metrics._PROCESS_FILE
+
+    metrics.begin_request()
+    metrics.end_request('catalog.catalog', 'GET', 200)
+    written = path.read_text()
+    metrics.begin_request()
+    metrics.end_request('catalog.catalog', 'GET', 200)
+
+    assert path.read_text() == written
+    metrics.flush()
+    assert path.read_text() != written
+
+
+def test_disabled_metrics_use_plain_cursors(monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_ENABLED', False)
+    from app import create_app
+
+    conn = database.get_db_connection()
+    assert type(conn.execute('SELECT 1')) is sqlite3.Cursor
+    conn.close()
+    assert create_app().test_client().get('/metrics').status_code == 404
+
+
+def test_streamed_body_queries_are_charged_to_the_request(client):
+    database.insert_books([(f'Book {i}', 'Author', f'{1000000000000 + i}', 1, 1) for i in range(3)])
+    background = metrics._thread_stats().queries
+    response = client.get('/catalog?all=1')
+    assert _sample(metrics.render(), 'library_http_request_queries_count', endpoint='catalog.catalog') is None
+
+    response.get_data()
+    response.close()
+    text = metrics.render()
+    assert _sample(text, 'library_http_request_queries_count', endpoint='catalog.catalog') == 1
+    assert _sample(text, 'library_http_request_queries_sum', endpoint='catalog.catalog') >= 1
+    assert metrics._thread_stats().queries == background
+
+
+def test_threads_that_ended_are_forgotten():
+    def worker():
+        conn = database.get_db_connection()
+        conn.execute('SELECT 1').fetchone()
+        conn.close()
+
+    before = len(metrics._background)
+    for _ in range(50):
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+    text = metrics.render()
+
+    assert len(metrics._background) <= before
+    assert _sample(text, 'library_sql_queries_total') >= 50
@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from migrations import MIGRATIONS, apply_migrations, get_schema_version, run_migrations
+
+
+@pytest.fixture
+def traced_statements():
+    """Collect the SQL the database helpers execute on the scoped connection."""
+    statements = []
+    with database.connection_scope() as conn:
+        conn.set_trace_callback(statements.append)
+        yield statements
+        conn.set_trace_callback(None)
+
+
+def _query_plan(sql):
+    conn = database.get_db_connection()
+    try:
+        return [row['detail'] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+    finally:
+        conn.close()
+
+
+def _seed_loans():
+    database.insert_book('Book', 'Author', '1234567890123', 3, 3)
+    now = datetime.now()
+    database.insert_borrow_record('123456', 1, now, now + timedelta(days=14))
+
+
+def test_migrations_are_recorded_and_idempotent():
+    latest = MIGRATIONS[-1][0]
+    assert run_migrations() == []
+    conn = database.get_db_connection()
+    try:
+        assert get_schema_version(conn) == latest
+        assert apply_migrations(conn) == []
+        count = conn.execute('SELECT COUNT(*) FROM schema_migrations').fetchone()[0]
+    finally:
+        conn.close()
+    assert count == len(MIGRATIONS)
+
+
+def test_migration_versions_are_strictly_increasing():
+    versions = [version for version, _, _ in MIGRATIONS]
+    assert versions == sorted(set(versions))
+
+
+def test_failed_migration_rolls_back(monkeypatch):
+    def broken(conn):
+        conn.execute('CREATE TABLE half_done (id INTEGER)')
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr('migrations.MIGRATIONS', MIGRATIONS + [(999, 'broken', [broken])])
+    with pytest.raises(RuntimeError):
+        run_migrations()
+    conn = database.get_db_connection()
+    try:
+        assert get_schema_version(conn) == MIGRATIONS[-1][0]
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        conn.close()
+    assert 'half_done' not in tables
+
+
+@pytest.mark.parametrize('call', [
+    lambda: database.get_patron_borrow_count('123456'),
+    lambda: database.get_patron_borrowed_books('123456'),
+    lambda: database.get_patron_borrowing_history('123456'),
+    lambda: database.update_borrow_record_return_date('123456', 1, datetime.now()),
+])
+def test_hot_loan_queries_use_an_index(call, traced_statements):
+    _seed_loans()
+    del traced_statements[:]
+    call()
+    queries = [s for s in traced_statements if 'borrow_records' in s or 'patrons' in s]
+    assert queries
+    for sql in queries:
+        plan = _query_plan(sql)
+        loan_steps = [d for d in plan if ' br ' in f' {d} ' or 'borrow_records' in d or 'patrons' in d]
+        assert loan_steps, plan
+        for detail in loan_steps:
+            assert detail.startswith('SEARCH') and 'INDEX' in detail, plan
+        assert not any('TEMP B-TREE' in d for d in plan), plan
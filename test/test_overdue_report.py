@@ -0,0 +1,68 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from services.fee_engine import iter_overdue_report
+
+NOW = datetime.now()
+
+
+def _loan(patron_id, book_id, days_overdue, returned=False):
+    due = NOW - timedelta(days=days_overdue, hours=1)
+    database.insert_borrow_record(patron_id, book_id, due - timedelta(days=14), due)
+    if returned:
+        database.update_borrow_record_return_date(patron_id, book_id, NOW)
+
+
+@pytest.fixture(autouse=True)
+def loans():
+    for i in range(3):
+        database.insert_book(f'Book {i}', 'Author', f'{1000000000000 + i}', 5, 5)
+    _loan('111111', 1, 3)     # 1.50
+    _loan('111111', 2, 30)    # 15.00 (capped)
+    _loan('222222', 1, 10)    # 6.50
+    _loan('222222', 2, -2)    # not yet due
+    _loan('333333', 3, 40, returned=True)
+    _loan('444444', 3, 1)     # 0.50
+
+
+def test_report_groups_overdue_loans_per_patron():
+    report = list(iter_overdue_report())
+    assert [(r['patron_id'], r['overdue_count'], r['total_fee']) for r in report] == [
+        ('111111', 2, 16.5), ('222222', 1, 6.5), ('444444', 1, 0.5),
+    ]
+    loans = {loan['book_id']: loan for loan in report[0]['loans']}
+    assert loans[2]['title'] == 'Book 1'
+    assert (loans[2]['days_overdue'], loans[2]['fee']) == (30, 15.0)
+
+
+def test_report_thresholds():
+    assert [r['patron_id'] for r in iter_overdue_report(fee_over=10)] == ['111111']
+    report = list(iter_overdue_report(min_days_overdue=5))
+    assert [(r['patron_id'], r['total_fee']) for r in report] == [('111111', 15.0), ('222222', 6.5)]
+
+
+def test_report_is_a_lazy_generator():
+    report = iter_overdue_report()
+    assert next(report)['patron_id'] == '111111'
+    report.close()
+
+
+def test_overdue_report_endpoint_streams_json_lines(client):
+    # the client fixture empties the catalog after the autouse loans are made
+    database.insert_book('Report Book', 'Author', '2000000000000', 5, 5)
+    book_id = database.get_book_by_isbn('2000000000000')['id']
+    _loan('111111', book_id, 3)
+    _loan('222222', book_id, 12)
+    response = client.get('/api/reports/overdue?fee_over=2')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [(r['patron_id'], r['total_fee']) for r in rows] == [('222222', 8.5)]
+
+
+def test_overdue_report_endpoint_rejects_bad_thresholds(client):
+    assert client.get('/api/reports/overdue?fee_over=lots').status_code == 400
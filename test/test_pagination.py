@@ -0,0 +1,122 @@
+import pytest
+
+import database
+import services.library_service as ls
+
+
+@pytest.fixture
+def shelf():
+    """25 books whose titles collide in pairs, to exercise the id tie-breaker."""
+    for i in range(25):
+        ls.add_book_to_catalog(f"Volume {i // 2:02d}", f"Author {i % 3}", f"{1000000000000 + i}", 1)
+    return database.get_all_books()
+
+
+def _walk(fetch, limit):
+    """Follow next cursors until the last page; return every page."""
+    pages, after = [], None
+    while True:
+        page = fetch(limit, after)
+        pages.append(page)
+        cursor = ls.next_page_cursor(page, limit)
+        if cursor is None:
+            return pages
+        after = ls.decode_cursor(cursor)
+
+
+def test_get_all_books_keyset_pages_cover_catalog(shelf):
+    pages = _walk(lambda limit, after: database.get_all_books(limit=limit, after=after), 7)
+    assert [len(p) for p in pages] == [7, 7, 7, 4]
+    assert [b['id'] for p in pages for b in p] == [b['id'] for b in shelf]
+
+
+def test_get_all_books_orders_by_title_then_id(shelf):
+    keys = [(b['title'], b['id']) for b in shelf]
+    assert keys == sorted(keys)
+
+
+def test_keyset_page_query_uses_title_index(shelf):
+    statements = []
+    with database.connection_scope() as conn:
+        conn.set_trace_callback(statements.append)
+        database.get_all_books(limit=5, after=('Volume 05', 11))
+        conn.set_trace_callback(None)
+        plan = [r['detail'] for r in conn.execute('EXPLAIN QUERY PLAN ' + statements[-1])]
+    assert any('idx_books_title_id' in d and d.startswith('SEARCH') for d in plan), plan
+    assert not any('TEMP B-TREE' in d for d in plan), plan
+
+
+def test_cursor_round_trip_and_rejection():
+    cursor = ls.encode_cursor({'title': 'Ünïcode / title', 'id': 42})
+    assert ls.decode_cursor(cursor) == ('Ünïcode / title', 42)
+    for bad in ('not-a-cursor', ls.encode_cursor({'title': 5, 'id': 'x'})):
+        with pytest.raises(ValueError):
+            ls.decode_cursor(bad)
+
+
+def test_parse_page_params():
+    assert ls.parse_page_params(None, None) == (ls.DEFAULT_PAGE_SIZE, None)
+    assert ls.parse_page_params('10', None) == (10, None)
+    assert ls.parse_page_params(str(ls.MAX_PAGE_SIZE + 1), None)[0] == ls.MAX_PAGE_SIZE
+    for bad in ('0', '-3', 'ten'):
+        with pytest.raises(ValueError):
+            ls.parse_page_params(bad, None)
+
+
+@pytest.mark.parametrize('mode', ['substring', 'fts', 'trigram'])
+def test_search_pages_match_unpaged_results(shelf, mode, monkeypatch):
+    monkeypatch.setattr(ls, '_search_index', None)
+    monkeypatch.setattr(ls, 'SCAN_BATCH_SIZE', 4)
+    everything = ls.search_books_in_catalog("volume", "title", mode=mode)
+    assert len(everything) == 25
+    pages = _walk(lambda limit, after: ls.search_books_in_catalog(
+        "volume", "title", mode=mode, limit=limit, after=after), 6)
+    assert [b['id'] for p in pages for b in p] == [b['id'] for b in everything]
+
+
+def test_substring_page_stops_scanning_once_full(shelf, monkeypatch):
+    monkeypatch.setattr(ls, 'SCAN_BATCH_SIZE', 5)
+    calls = []
+    real = ls.get_all_books
+    monkeypatch.setattr(ls, 'get_all_books', lambda **kw: calls.append(kw) or real(**kw))
+    ls.search_books_in_catalog("author 0", "author", limit=2)
+    assert len(calls) == 1
+
+
+def test_catalog_route_pages(client):
+    for i in range(5):
+        ls.add_book_to_catalog(f"Book {i}", "Author", f"{2000000000000 + i}", 1)
+    first = client.get('/catalog?limit=2')
+    assert first.status_code == 200
+    assert b'Book 0' in first.data and b'Book 2' not in first.data
+    assert b'Next Page' in first.data
+
+    cursor = ls.encode_cursor(database.get_all_books(limit=2)[-1])
+    second = client.get(f'/catalog?limit=2&after={cursor}')
+    assert b'Book 2' in second.data and b'Book 0' not in second.data
+    assert b'First Page' in second.data
+
+
+def test_catalog_route_rejects_bad_cursor(client):
+    ls.add_book_to_catalog("Only", "Author", "2000000000009", 1)
+    response = client.get('/catalog?after=garbage')
+    assert response.status_code == 200
+    assert b'Invalid page cursor' in response.data
+    assert b'Only' in response.data
+
+
+def test_api_search_pages(client):
+    for i in range(3):
+        ls.add_book_to_catalog(f"Paged {i}", "Author", f"{3000000000000 + i}", 1)
+    data = client.get('/api/search?q=paged&limit=2').get_json()
+    assert [b['title'] for b in data['results']] == ["Paged 0", "Paged 1"]
+    assert data['count'] == 2 and data['next_cursor']
+
+    data = client.get(f"/api/search?q=paged&limit=2&after={data['next_cursor']}").get_json()
+    assert [b['title'] for b in data['results']] == ["Paged 2"]
+    assert data['next_cursor'] is None
+
+
+def test_api_search_rejects_bad_paging(client):
+    assert client.get('/api/search?q=x&limit=0').status_code == 400
+    assert client.get('/api/search?q=x&after=garbage').status_code == 400
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+import database
+from app import create_app
+from services.library_service import borrow_book_by_patron, borrow_books_in_batch, return_book_by_patron
+
+
+def _counter(patron_id):
+    conn = database.get_db_connection()
+    try:
+        row = conn.execute('SELECT open_loans FROM patrons WHERE patron_id = ?', (patron_id,)).fetchone()
+    finally:
+        conn.close()
+    return row['open_loans'] if row else None
+
+
+def _add_book(isbn, copies=5):
+    database.insert_book(f'Book {isbn}', 'Author', isbn, copies, copies)
+    return database.get_book_by_isbn(isbn)['id']
+
+
+def test_counter_follows_borrow_and_return():
+    book_id = _add_book('1000000000001')
+    assert database.get_patron_borrow_count('111111') == 0
+    assert borrow_book_by_patron('111111', book_id)[0]
+    assert borrow_book_by_patron('111111', book_id)[0]
+    assert _counter('111111') == 2
+    assert return_book_by_patron('111111', book_id)[0]
+    assert database.get_patron_borrow_count('111111') == 1
+
+
+def test_counter_follows_batch_borrow():
+    first, second = _add_book('1000000000002'), _add_book('1000000000003')
+    borrow_books_in_batch([('222222', first), ('222222', second), ('333333', first)])
+    assert _counter('222222') == 2
+    assert _counter('333333') == 1
+
+
+def test_counter_follows_direct_writes_and_deletes():
+    book_id = _add_book('1000000000004')
+    now = datetime.now()
+    database.insert_borrow_record('444444', book_id, now, now + timedelta(days=14))
+    assert _counter('444444') == 1
+    conn = database.get_db_connection()
+    conn.execute('DELETE FROM borrow_records WHERE patron_id = ?', ('444444',))
+    conn.commit()
+    conn.close()
+    assert _counter('444444') == 0
+
+
+def test_limit_check_reads_counter():
+    book_id = _add_book('1000000000005')
+    conn = database.get_db_connection()
+    conn.execute("INSERT INTO patrons (patron_id, open_loans) VALUES ('555555', 5)")
+    conn.commit()
+    conn.close()
+    success, message = borrow_book_by_patron('555555', book_id)
+    assert not success
+    assert 'maximum borrowing limit' in message
+
+
+def test_reconcile_fixes_drifted_counters():
+    book_id = _add_book('1000000000006')
+    now = datetime.now()
+    database.insert_borrow_record('666666', book_id, now, now + timedelta(days=14))
+    conn = database.get_db_connection()
+    conn.execute("UPDATE patrons SET open_loans = 9 WHERE patron_id = '666666'")
+    conn.execute("INSERT INTO patrons (patron_id, open_loans) VALUES ('777777', 3)")
+    conn.commit()
+    conn.close()
+
+    result = database.reconcile_patron_loan_counts()
+    assert result['corrected'] == 2
+    assert _counter('666666') == 1
+    assert _counter('777777') == 0
+    assert database.reconcile_patron_loan_counts()['corrected'] == 0
+
+
+def test_reconcile_cli_command():
+    runner = create_app().test_cli_runner()
+    result = runner.invoke(args=['reconcile-loan-counts'])
+    assert result.exit_code == 0
+    assert 'corrected 0 counters' in result.output
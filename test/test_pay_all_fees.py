@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+import pytest
+
+import database
+from services.library_service import pay_all_late_fees, pay_late_fees, prepare_patron_fee_payment
+from services.payment_outbox import submit_fee_payment
+from services.payments import settle_patron_fees
+
+NOW = datetime.now()
+
+
+def _loan(patron_id, book_id, days_overdue):
+    due = NOW - timedelta(days=days_overdue, hours=1)
+    database.insert_borrow_record(patron_id, book_id, due - timedelta(days=14), due)
+
+
+def _gateway(success=True):
+    gateway = Mock()
+    gateway.process_payment.return_value = (
+        (True, 'txn_123', 'Approved') if success else (False, None, 'Card declined'))
+    return gateway
+
+
+@pytest.fixture(autouse=True)
+def loans():
+    for i, title in enumerate(['Dune', 'Emma', 'Ulysses']):
+        database.insert_book(title, 'Author', f'{1000000000000 + i}', 5, 5)
+    _loan('123456', 1, 10)    # 6.50
+    _loan('123456', 2, 3)     # 1.50
+    _loan('123456', 3, -2)    # not yet due
+    _loan('654321', 3, 40)    # 15.00 (capped), another patron
+
+
+def test_pay_all_charges_every_overdue_book_once():
+    gateway = _gateway()
+    success, message, txn, items = pay_all_late_fees('123456', gateway)
+
+    assert success and txn == 'txn_123' and 'Payment successful!' in message
+    gateway.process_payment.assert_called_once_with(
+        patron_id='123456', amount=8.0,
+        description="Late fees for 2 books: 'Dune' (10 days) $6.50; 'Emma' (3 days) $1.50")
+    assert [(item['book_id'], item['amount']) for item in items] == [(1, 6.5), (2, 1.5)]
+
+
+def test_allocation_is_recorded_and_not_charged_again():
+    _, _, txn, _ = pay_all_late_fees('123456', _gateway())
+
+    allocations = database.get_fee_payment_allocations(txn)
+    assert [(a['book_id'], a['days_overdue'], a['amount']) for a in allocations] == [(1, 10, 6.5), (2, 3, 1.5)]
+
+    gateway = _gateway()
+    success, message, _, _ = pay_all_late_fees('123456', gateway)
+    assert not success and message == 'No late fees to pay.'
+    gateway.process_payment.assert_not_called()
+
+
+def test_fees_accrued_after_a_payment_are_charged_as_the_difference():
+    pay_all_late_fees('123456', _gateway())
+    later = NOW + timedelta(days=2)
+    items = database.get_patron_outstanding_fees('123456', database.to_epoch_seconds(later) * 1000000,
+                                                 7, 0.5, 1.0, 15.0)
+    # Dune 12 days (8.50 - 6.50 paid), Emma 5 days (2.50 - 1.50), Ulysses not yet due
+    assert [(item['book_id'], item['amount']) for item in items] == [(1, 2.0), (2, 1.0)]
+
+
+def test_declined_charge_records_nothing():
+    success, message, txn, items = pay_all_late_fees('123456', _gateway(success=False))
+
+    assert not success and txn is None and message == 'Payment failed: Card declined'
+    assert len(items) == 2
+    assert prepare_patron_fee_payment('123456')[1] == 8.0
+
+
+def test_gateway_error_is_reported():
+    gateway = Mock()
+    gateway.process_payment.side_effect = ConnectionError('Network down')
+    success, message, txn, _ = pay_all_late_fees('123456', gateway)
+    assert not success and txn is None and 'Network down' in message
+
+
+@pytest.mark.parametrize('patron_id', ['', '12345', 'abcdef', '1234567'])
+def test_invalid_patron_is_rejected_without_charging(patron_id):
+    gateway = _gateway()
+    success, message, _, items = pay_all_late_fees(patron_id, gateway)
+    assert not success and 'Invalid patron ID' in message and items == []
+    gateway.process_payment.assert_not_called()
+
+
+def test_settle_shares_the_allocation_with_pay_all():
+    results = settle_patron_fees(['123456', '654321'], _gateway())
+    assert [(r['patron_id'], r['amount'], r['success']) for r in results] == [
+        ('123456', 8.0, True), ('654321', 15.0, True)]
+
+    success, message, _, _ = pay_all_late_fees('654321', _gateway())
+    assert not success and message == 'No late fees to pay.'
+
+
+def test_paying_one_book_after_paying_all_charges_nothing():
+    pay_all_late_fees('123456', _gateway())
+
+    gateway = _gateway()
+    success, message, txn = pay_late_fees('123456', 1, gateway)
+    assert not success and message == 'No late fees to pay for this book.' and txn is None
+    gateway.process_payment.assert_not_called()
+
+
+def test_paying_one_book_is_recorded_against_its_loan():
+    success, _, txn = pay_late_fees('123456', 1, _gateway())
+    assert success
+    assert [(a['book_id'], a['amount']) for a in database.get_fee_payment_allocations(txn)] == [(1, 6.5)]
+
+    gateway = _gateway()
+    pay_all_late_fees('123456', gateway)
+    gateway.process_payment.assert_called_once_with(
+        patron_id='123456', amount=1.5, description="Late fees for 1 book: 'Emma' (3 days) $1.50")
+
+
+def test_fees_reserved_by_a_queued_intent_are_not_charged_per_book():
+    submit_fee_payment('123456')
+
+    gateway = _gateway()
+    assert pay_late_fees('123456', 2, gateway)[1] == 'No late fees to pay for this book.'
+    gateway.process_payment.assert_not_called()
@@ -3,6 +3,7 @@ from datetime import datetime, timedelta
 from unittest.mock import Mock
 
 import services.library_service as ls
+from database import to_epoch_seconds
 
 
 class PaymentGateway:
@@ -12,13 +13,14 @@ class PaymentGateway:
 		raise NotImplementedError
 
 
+def _owed(book_id, title, amount, days_overdue):
+	return [{"loan_id": 10 + book_id, "book_id": book_id, "title": title,
+			 "days_overdue": days_overdue, "amount": amount}]
+
+
 def test_pay_late_fees_successful_payment(mocker):
-	mocker.patch('services.library_service.calculate_late_fee_for_book', return_value={
-		"fee_amount": 6.5, "days_overdue": 3, "status": "Overdue"
-	})
-	mocker.patch('services.library_service.get_book_by_id', return_value={
-		"id": 1, "title": "Clean Code"
-	})
+	mocker.patch('services.library_service.patron_outstanding_fees', return_value=_owed(1, "Clean Code", 6.5, 3))
+	record = mocker.patch('services.library_service.insert_fee_payment', return_value=True)
 	gateway = Mock(spec=PaymentGateway)
 	gateway.process_payment.return_value = (True, "txn_123", "Success")
 	success, msg, txn = ls.pay_late_fees("123456", 1, payment_gateway=gateway)
@@ -29,15 +31,12 @@ def test_pay_late_fees_successful_payment(mocker):
 	gateway.process_payment.assert_called_with(
 		patron_id="123456", amount=6.5, description="Late fees for 'Clean Code'"
 	)
+	record.assert_called_once()
+	assert record.call_args.args[:3] == ("txn_123", "123456", _owed(1, "Clean Code", 6.5, 3))
 
 
 def test_pay_late_fees_payment_declined(mocker):
-	mocker.patch('services.library_service.calculate_late_fee_for_book', return_value={
-		"fee_amount": 4.0, "days_overdue": 2, "status": "Overdue"
-	})
-	mocker.patch('services.library_service.get_book_by_id', return_value={
-		"id": 2, "title": "Refactoring"
-	})
+	mocker.patch('services.library_service.patron_outstanding_fees', return_value=_owed(2, "Refactoring", 4.0, 2))
 	gateway = Mock(spec=PaymentGateway)
 	gateway.process_payment.return_value = (False, None, "Card declined")
 	success, msg, txn = ls.pay_late_fees("123456", 2, payment_gateway=gateway)
@@ -50,10 +49,7 @@ def test_pay_late_fees_payment_declined(mocker):
 
 
 def test_pay_late_fees_invalid_patron_id_mock_not_called(mocker):
-	mocker.patch('services.library_service.calculate_late_fee_for_book', return_value={
-		"fee_amount": 5.0, "days_overdue": 1, "status": "Overdue"
-	})
-	mocker.patch('services.library_service.get_book_by_id', return_value={"id": 1, "title": "X"})
+	mocker.patch('services.library_service.patron_outstanding_fees', return_value=_owed(1, "X", 5.0, 1))
 	gateway = Mock(spec=PaymentGateway)
 	success, msg, txn = ls.pay_late_fees("12345", 1, payment_gateway=gateway)
 	assert success is False
@@ -63,10 +59,7 @@ def test_pay_late_fees_invalid_patron_id_mock_not_called(mocker):
 
 
 def test_pay_late_fees_zero_fees_mock_not_called(mocker):
-	mocker.patch('services.library_service.calculate_late_fee_for_book', return_value={
-		"fee_amount": 0.0, "days_overdue": 0, "status": "Not overdue"
-	})
-	mocker.patch('services.library_service.get_book_by_id', return_value={"id": 1, "title": "Y"})
+	mocker.patch('services.library_service.patron_outstanding_fees', return_value=[])
 	gateway = Mock(spec=PaymentGateway)
 	success, msg, txn = ls.pay_late_fees("123456", 1, payment_gateway=gateway)
 	assert success is False
@@ -76,10 +69,7 @@ def test_pay_late_fees_zero_fees_mock_not_called(mocker):
 
 
 def test_pay_late_fees_network_error_exception_handling(mocker):
-	mocker.patch('services.library_service.calculate_late_fee_for_book', return_value={
-		"fee_amount": 2.5, "days_overdue": 1, "status": "Overdue"
-	})
-	mocker.patch('services.library_service.get_book_by_id', return_value={"id": 1, "title": "Z"})
+	mocker.patch('services.library_service.patron_outstanding_fees', return_value=_owed(1, "Z", 2.5, 1))
 	gateway = Mock(spec=PaymentGateway)
 	gateway.process_payment.side_effect = RuntimeError("network error")
 	success, msg, txn = ls.pay_late_fees("123456", 1, payment_gateway=gateway)
@@ -134,52 +124,47 @@ def test_refund_amount_exceeds_max_not_called(mocker):
 
 
 def test_borrow_book_book_not_found(mocker):
-	mocker.patch('services.library_service.get_book_by_id', return_value=None)
+	mocker.patch('services.library_service.borrow_book_atomic', return_value=('not_found', None))
 	success, msg = ls.borrow_book_by_patron("123456", 1)
 	assert success is False
 	assert "book not found" in msg.lower()
 
 
 def test_borrow_book_no_available_copies(mocker):
-	mocker.patch('services.library_service.get_book_by_id', return_value={
-		"id": 1, "title": "X", "available_copies": 0
-	})
+	mocker.patch('services.library_service.borrow_book_atomic', return_value=(
+		'unavailable', {"id": 1, "title": "X", "available_copies": 0}
+	))
 	success, msg = ls.borrow_book_by_patron("123456", 1)
 	assert success is False
 	assert "not available" in msg.lower()
 
 
 def test_borrow_book_max_limit_exceeded(mocker):
-	mocker.patch('services.library_service.get_book_by_id', return_value={
-		"id": 1, "title": "X", "available_copies": 2
-	})
-	mocker.patch('services.library_service.get_patron_borrow_count', return_value=6)
+	mocker.patch('services.library_service.borrow_book_atomic', return_value=(
+		'limit', {"id": 1, "title": "X", "available_copies": 2}
+	))
 	success, msg = ls.borrow_book_by_patron("123456", 1)
 	assert success is False
 	assert "maximum borrowing limit" in msg.lower()
 
 
 def test_borrow_book_insert_record_failure(mocker):
-	mocker.patch('services.library_service.get_book_by_id', return_value={
-		"id": 1, "title": "X", "available_copies": 2
-	})
-	mocker.patch('services.library_service.get_patron_borrow_count', return_value=0)
-	mocker.patch('services.library_service.insert_borrow_record', return_value=False)
+	mocker.patch('services.library_service.borrow_book_atomic', return_value=('error', None))
 	success, msg = ls.borrow_book_by_patron("123456", 1)
 	assert success is False
 	assert "creating borrow record" in msg.lower()
 
 
-def test_borrow_book_update_availability_failure(mocker):
-	mocker.patch('services.library_service.get_book_by_id', return_value={
-		"id": 1, "title": "X", "available_copies": 2
-	})
-	mocker.patch('services.library_service.get_patron_borrow_count', return_value=0)
-	mocker.patch('services.library_service.insert_borrow_record', return_value=True)
-	mocker.patch('services.library_service.update_book_availability', return_value=False)
+def test_borrow_book_passes_due_date_and_limit(mocker):
+	atomic = mocker.patch('services.library_service.borrow_book_atomic', return_value=(
+		'ok', {"id": 1, "title": "X", "available_copies": 1}
+	))
 	success, msg = ls.borrow_book_by_patron("123456", 1)
-	assert success is False
-	assert "updating book availability" in msg.lower()
+	assert success is True
+	patron_id, book_id, borrow_date, due_date = atomic.call_args.args
+	assert (patron_id, book_id) == ("123456", 1)
+	assert due_date - borrow_date == timedelta(days=14)
+	assert atomic.call_args.kwargs == {"max_loans": 5}
 
 
 def test_return_book_invalid_book_id():
@@ -189,45 +174,35 @@ def test_return_book_invalid_book_id():
 
 
 def test_return_book_book_not_found(mocker):
-	mocker.patch('services.library_service.get_book_by_id', return_value=None)
+	mocker.patch('services.library_service.return_book_atomic', return_value=('not_found', None, None))
 	success, msg = ls.return_book_by_patron("123456", 1)
 	assert success is False
 	assert "book not found" in msg.lower()
 
 
 def test_return_book_not_borrowed_by_patron(mocker):
-	mocker.patch('services.library_service.get_book_by_id', return_value={"id": 1, "title": "X"})
-	mocker.patch('services.library_service.get_patron_borrowed_books', return_value=[])
+	mocker.patch('services.library_service.return_book_atomic', return_value=(
+		'not_borrowed', {"id": 1, "title": "X"}, None
+	))
 	success, msg = ls.return_book_by_patron("123456", 1)
 	assert success is False
 	assert "was not borrowed" in msg.lower()
 
 
 def test_return_book_update_return_date_failure(mocker):
-	borrow_record = {
-		"book_id": 1,
-		"due_date": datetime.now() + timedelta(days=1)
-	}
-	mocker.patch('services.library_service.get_book_by_id', return_value={"id": 1, "title": "Y"})
-	mocker.patch('services.library_service.get_patron_borrowed_books', return_value=[borrow_record])
-	mocker.patch('services.library_service.update_borrow_record_return_date', return_value=False)
+	mocker.patch('services.library_service.return_book_atomic', return_value=('error', None, None))
 	success, msg = ls.return_book_by_patron("123456", 1)
 	assert success is False
 	assert "recording return date" in msg.lower()
 
 
-def test_return_book_update_availability_failure(mocker):
-	borrow_record = {
-		"book_id": 1,
-		"due_date": datetime.now() + timedelta(days=1)
-	}
-	mocker.patch('services.library_service.get_book_by_id', return_value={"id": 1, "title": "Z"})
-	mocker.patch('services.library_service.get_patron_borrowed_books', return_value=[borrow_record])
-	mocker.patch('services.library_service.update_borrow_record_return_date', return_value=True)
-	mocker.patch('services.library_service.update_book_availability', return_value=False)
+def test_return_book_on_time_has_no_fee(mocker):
+	mocker.patch('services.library_service.return_book_atomic', return_value=(
+		'ok', {"id": 1, "title": "Z"}, datetime.now() + timedelta(days=1)
+	))
 	success, msg = ls.return_book_by_patron("123456", 1)
-	assert success is False
-	assert "updating book availability" in msg.lower()
+	assert success is True
+	assert "no late fees" in msg.lower()
 
 
 def test_calc_fee_invalid_patron():
@@ -261,7 +236,7 @@ def test_calc_fee_overdue_under_7(mocker):
 	mocker.patch('services.library_service.get_book_by_id', return_value={"id": 1})
 	borrow_record = {
 		"book_id": 1,
-		"due_date": datetime.now() - timedelta(days=5)
+		"due_date": to_epoch_seconds(datetime.now() - timedelta(days=5))
 	}
 	mocker.patch('services.library_service.get_patron_borrowed_books', return_value=[borrow_record])
 	info = ls.calculate_late_fee_for_book("123456", 1)
@@ -274,7 +249,7 @@ def test_calc_fee_overdue_cap_at_15(mocker):
 	mocker.patch('services.library_service.get_book_by_id', return_value={"id": 1})
 	borrow_record = {
 		"book_id": 1,
-		"due_date": datetime.now() - timedelta(days=40)
+		"due_date": to_epoch_seconds(datetime.now() - timedelta(days=40))
 	}
 	mocker.patch('services.library_service.get_patron_borrowed_books', return_value=[borrow_record])
 	info = ls.calculate_late_fee_for_book("123456", 1)
@@ -311,8 +286,8 @@ def test_patron_status_invalid_id():
 def test_patron_status_fee_calculation(mocker):
 	now = datetime.now()
 	borrowed = [
-		{"book_id": 1, "is_overdue": True, "due_date": now - timedelta(days=10)},
-		{"book_id": 2, "is_overdue": False, "due_date": now + timedelta(days=1)},
+		{"book_id": 1, "is_overdue": True, "due_date": to_epoch_seconds(now - timedelta(days=10))},
+		{"book_id": 2, "is_overdue": False, "due_date": to_epoch_seconds(now + timedelta(days=1))},
 	]
 	mocker.patch('services.library_service.get_patron_borrowed_books', return_value=borrowed)
 	mocker.patch('services.library_service.get_patron_borrowing_history', return_value=[])
@@ -337,34 +312,27 @@ def test_add_book_duplicate_isbn(mocker):
 
 
 def test_borrow_book_success(mocker):
-	mocker.patch('services.library_service.get_book_by_id', return_value={
-		"id": 1, "title": "Some Book", "available_copies": 1
-	})
-	mocker.patch('services.library_service.get_patron_borrow_count', return_value=0)
-	mocker.patch('services.library_service.insert_borrow_record', return_value=True)
-	mocker.patch('services.library_service.update_book_availability', return_value=True)
+	mocker.patch('services.library_service.borrow_book_atomic', return_value=(
+		'ok', {"id": 1, "title": "Some Book", "available_copies": 0}
+	))
 	ok, msg = ls.borrow_book_by_patron("123456", 1)
 	assert ok is True
 	assert "successfully borrowed" in msg.lower()
 
 
 def test_return_book_success_with_late_fee(mocker):
-	borrow_record = {
-		"book_id": 1,
-		"due_date": datetime.now() - timedelta(days=3)
-	}
-	mocker.patch('services.library_service.get_book_by_id', return_value={"id": 1, "title": "Late Book"})
-	mocker.patch('services.library_service.get_patron_borrowed_books', return_value=[borrow_record])
-	mocker.patch('services.library_service.update_borrow_record_return_date', return_value=True)
-	mocker.patch('services.library_service.update_book_availability', return_value=True)
+	mocker.patch('services.library_service.return_book_atomic', return_value=(
+		'ok', {"id": 1, "title": "Late Book"}, datetime.now() - timedelta(days=3)
+	))
 	ok, msg = ls.return_book_by_patron("123456", 1)
 	assert ok is True
 	assert "late fee" in msg.lower()
 
 
-def test_pay_late_fees_unable_to_calculate(mocker):
-	mocker.patch('services.library_service.calculate_late_fee_for_book', return_value={})
-	ok, msg, txn = ls.pay_late_fees("123456", 1, payment_gateway=None)
+def test_pay_late_fees_invalid_book_id(mocker):
+	owed = mocker.patch('services.library_service.patron_outstanding_fees')
+	ok, msg, txn = ls.pay_late_fees("123456", 0, payment_gateway=None)
 	assert ok is False
-	assert "unable to calculate late fees" in msg.lower()
-	assert txn is None
\ No newline at end of file
+	assert "invalid book id" in msg.lower()
+	assert txn is None
+	owed.assert_not_called()
\ No newline at end of file
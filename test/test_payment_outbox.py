@@ -0,0 +1,246 @@
+import time
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+import pytest
+
+import database
+from services import payment_outbox
+from services.fee_engine import patron_outstanding_fees, queue_patron_fees
+from services.gateway_simulator import SimulatedGateway
+from services.library_service import describe_fee_items, pay_all_late_fees, pay_late_fees
+from services.payment_outbox import OutboxWorker, process_outbox_batch, submit_fee_payment
+
+NOW = datetime.now()
+LATER = NOW + timedelta(hours=1)
+
+
+def _loan(patron_id, book_id, days_overdue):
+    due = NOW - timedelta(days=days_overdue, hours=1)
+    database.insert_borrow_record(patron_id, book_id, due - timedelta(days=14), due)
+
+
+def _gateway(*results):
+    gateway = Mock()
+    gateway.process_payment.side_effect = list(results) or [(True, 'txn_1', 'Approved')]
+    return gateway
+
+
+@pytest.fixture(autouse=True)
+def loans():
+    for i, title in enumerate(['Dune', 'Emma']):
+        database.insert_book(title, 'Author', f'{1000000000000 + i}', 5, 5)
+    _loan('123456', 1, 10)    # 6.50
+    _loan('123456', 2, 3)     # 1.50
+
+
+def test_submit_queues_an_intent_without_calling_the_gateway():
+    error, intent = submit_fee_payment('123456', 'key-1')
+
+    assert error is None
+    assert intent['status'] == 'pending' and intent['attempts'] == 0
+    assert intent['amount'] == 8.0
+    assert intent['description'] == "Late fees for 2 books: 'Dune' (10 days) $6.50; 'Emma' (3 days) $1.50"
+    assert [(item['loan_id'], item['amount']) for item in intent['items']] == [(1, 6.5), (2, 1.5)]
+
+
+def test_resubmitting_returns_the_open_intent():
+    _, first = submit_fee_payment('123456', 'key-1')
+    assert submit_fee_payment('123456', 'key-1')[1]['id'] == first['id']
+    assert submit_fee_payment('123456')[1]['id'] == first['id']
+    assert 'another patron' in submit_fee_payment('654321', 'key-1')[0]
+
+
+def test_queued_fees_are_reserved_against_direct_payment():
+    submit_fee_payment('123456')
+    gateway = _gateway()
+    success, message, _, _ = pay_all_late_fees('123456', gateway)
+    assert not success and message == 'No late fees to pay.'
+    gateway.process_payment.assert_not_called()
+
+
+def test_worker_charges_once_and_records_the_allocation():
+    _, intent = submit_fee_payment('123456', 'key-1')
+    gateway = _gateway()
+
+    assert process_outbox_batch(gateway) == 1
+    gateway.process_payment.assert_called_once_with(
+        patron_id='123456', amount=8.0, description=intent['description'], idempotency_key='key-1')
+
+    done = database.get_payment_intent(intent['id'])
+    assert done['status'] == 'succeeded' and done['transaction_id'] == 'txn_1'
+    assert [a['amount'] for a in database.get_fee_payment_allocations('txn_1')] == [6.5, 1.5]
+    assert process_outbox_batch(gateway, now=LATER) == 0
+    assert submit_fee_payment('123456')[0] == 'No late fees to pay.'
+
+
+def test_gateway_errors_are_retried_with_backoff_and_the_same_key():
+    _, intent = submit_fee_payment('123456', 'key-1')
+    gateway = _gateway(ConnectionError('Network down'), (True, 'txn_1', 'Approved'))
+
+    process_outbox_batch(gateway)
+    queued = database.get_payment_intent(intent['id'])
+    assert queued['status'] == 'pending' and queued['attempts'] == 1
+    assert 'Network down' in queued['message']
+    assert queued['next_attempt_at'] > NOW
+
+    assert process_outbox_batch(gateway) == 0      # still backing off
+    assert process_outbox_batch(gateway, now=LATER) == 1
+    assert database.get_payment_intent(intent['id'])['status'] == 'succeeded'
+    keys = {call.kwargs['idempotency_key'] for call in gateway.process_payment.call_args_list}
+    assert keys == {'key-1'}
+
+
+def test_intent_is_unknown_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(payment_outbox, 'OUTBOX_MAX_ATTEMPTS', 2)
+    _, intent = submit_fee_payment('123456')
+    gateway = _gateway(*[TimeoutError('timed out')] * 3, (True, 'txn_1', 'Approved'))
+
+    process_outbox_batch(gateway)
+    process_outbox_batch(gateway, now=LATER)     # second attempt, then a replay that also times out
+    unknown = database.get_payment_intent(intent['id'])
+    assert unknown['status'] == 'unknown' and unknown['attempts'] == 3
+    assert 'timed out' in unknown['message']
+    assert submit_fee_payment('123456') == ('No late fees to pay.', None)
+
+    # Reconciliation replays the same key rather than starting a new charge
+    assert process_outbox_batch(gateway, now=LATER + timedelta(days=1)) == 1
+    assert database.get_payment_intent(intent['id'])['status'] == 'succeeded'
+    keys = {call.kwargs['idempotency_key'] for call in gateway.process_payment.call_args_list}
+    assert keys == {intent['idempotency_key']}
+
+
+def test_unresolved_charge_cannot_be_paid_again(monkeypatch):
+    monkeypatch.setattr(payment_outbox, 'OUTBOX_MAX_ATTEMPTS', 2)
+    gateway = SimulatedGateway('constant:0', timeout_rate=1.0, timeout=0, seed=1)
+    _, intent = submit_fee_payment('123456')
+    process_outbox_batch(gateway)
+    process_outbox_batch(gateway, now=LATER)
+    assert database.get_payment_intent(intent['id'])['status'] == 'unknown'
+
+    assert submit_fee_payment('123456') == ('No late fees to pay.', None)
+    assert pay_all_late_fees('123456', gateway)[1] == 'No late fees to pay.'
+    assert pay_late_fees('123456', 1, gateway)[1] == 'No late fees to pay for this book.'
+    assert [(charge['amount'], charge['idempotency_key']) for charge in gateway.ledger()] == [
+        (8.0, intent['idempotency_key'])]
+
+
+def test_decline_is_final_and_releases_the_fees():
+    _, intent = submit_fee_payment('123456')
+    process_outbox_batch(_gateway((False, None, 'Card declined')))
+
+    failed = database.get_payment_intent(intent['id'])
+    assert failed['status'] == 'failed' and failed['message'] == 'Payment failed: Card declined'
+    error, retry = submit_fee_payment('123456')
+    assert error is None and retry['id'] != intent['id'] and retry['amount'] == 8.0
+
+
+def test_abandoned_claim_is_retried_after_its_lease():
+    _, intent = submit_fee_payment('123456', 'key-1')
+    claimed_at = datetime.now()
+    claimed = database.claim_payment_intents(claimed_at, payment_outbox.CLAIM_LEASE_SECONDS, 10)
+    assert [c['id'] for c in claimed] == [intent['id']]   # worker dies here
+
+    gateway = _gateway()
+    assert process_outbox_batch(gateway) == 0
+    expired = claimed_at + timedelta(seconds=payment_outbox.CLAIM_LEASE_SECONDS + 1)
+    assert process_outbox_batch(gateway, now=expired) == 1
+    done = database.get_payment_intent(intent['id'])
+    assert done['status'] == 'succeeded' and done['attempts'] == 2
+
+
+def test_background_worker_drains_the_outbox():
+    _, intent = submit_fee_payment('123456')
+    worker = OutboxWorker(_gateway(), poll_interval=0.01).start()
+    try:
+        deadline = time.monotonic() + 5
+        while database.get_payment_intent(intent['id'])['status'] != 'succeeded':
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    finally:
+        worker.stop(timeout=5)
+
+
+def test_pay_api_responds_before_the_gateway_is_called(client):
+    for i, title in enumerate(['Dune', 'Emma']):
+        database.insert_book(title, 'Author', f'{2000000000000 + i}', 5, 5)
+    _loan('111111', database.get_book_by_isbn('2000000000000')['id'], 10)
+    client.application.config['PAYMENT_OUTBOX_DRAINED'] = True
+
+    response = client.post('/api/late_fees/111111/pay', headers={'Idempotency-Key': 'abc'})
+    assert response.status_code == 202
+    data = response.get_json()
+    assert data['status'] == 'pending' and data['amount'] == 6.5
+    assert response.headers['Location'].endswith(data['status_url'])
+    assert client.post('/api/late_fees/111111/pay', headers={'Idempotency-Key': 'abc'}).get_json()['id'] == data['id']
+
+    process_outbox_batch(_gateway())
+    status = client.get(data['status_url']).get_json()
+    assert status['status'] == 'succeeded' and status['transaction_id'] == 'txn_1'
+
+    assert client.post('/api/late_fees/111111/pay').status_code == 400
+    assert client.get('/api/payments/9999').status_code == 404
+
+
+def test_pay_api_refuses_payments_no_worker_will_charge(monkeypatch):
+    from app import create_app
+
+    monkeypatch.setattr(payment_outbox, 'PAYMENT_GATEWAY_CLASS', '')
+    monkeypatch.setattr(payment_outbox, 'OUTBOX_WORKER_MODE', 'thread')
+    assert create_app().test_client().post('/api/late_fees/123456/pay').status_code == 503
+    monkeypatch.setattr(payment_outbox, 'PAYMENT_GATEWAY_CLASS', 'unittest.mock:Mock')
+    monkeypatch.setattr(payment_outbox, 'OUTBOX_WORKER_MODE', 'off')
+    assert create_app().test_client().post('/api/late_fees/123456/pay').status_code == 503
+    assert database.get_payment_intent(1) is None
+
+    monkeypatch.setattr(payment_outbox, 'PAYMENT_GATEWAY_CLASS', 'unittest.mock:Mock')
+    monkeypatch.setattr(payment_outbox, 'OUTBOX_WORKER_MODE', 'process')
+    response = create_app().test_client().post('/api/late_fees/123456/pay')
+    assert response.status_code == 202, response.get_json()
+
+
+def test_pay_api_queues_payments_for_the_default_worker_thread(monkeypatch):
+    from app import create_app
+
+    started = []
+    monkeypatch.setattr(payment_outbox.OutboxWorker, 'start', lambda worker: started.append(worker) or worker)
+    monkeypatch.setattr(payment_outbox, 'PAYMENT_GATEWAY_CLASS', 'unittest.mock:Mock')
+    monkeypatch.setattr(payment_outbox, 'OUTBOX_WORKER_MODE', 'thread')
+    app = create_app()
+    response = app.test_client().post('/api/late_fees/123456/pay')
+    assert response.status_code == 202, response.get_json()
+    assert started == [app.extensions['payment_outbox']]
+
+
+def test_unattempted_intents_expire_and_release_their_fees():
+    _, intent = queue_patron_fees('123456', 'key-1', describe_fee_items, as_of=NOW, expires_in=60)
+    assert patron_outstanding_fees('123456', as_of=NOW + timedelta(seconds=30)) == []
+
+    expired = NOW + timedelta(seconds=61)
+    # Released as soon as it is due, before anything marks it failed
+    assert [item['amount'] for item in patron_outstanding_fees('123456', as_of=expired)] == [6.5, 1.5]
+    assert database.expire_payment_intents(expired) == 1
+    failed = database.get_payment_intent(intent['id'])
+    assert failed['status'] == 'failed' and failed['message'] == database.EXPIRED_MESSAGE
+
+    status, fresh = queue_patron_fees('123456', 'key-2', describe_fee_items, as_of=expired, expires_in=60)
+    assert status == 'created' and fresh['amount'] == 8.0
+
+
+def test_a_late_worker_does_not_charge_an_expired_intent():
+    _, intent = queue_patron_fees('123456', 'key-1', describe_fee_items, as_of=NOW, expires_in=60)
+    gateway = _gateway()
+
+    assert process_outbox_batch(gateway, now=NOW + timedelta(seconds=61)) == 0
+    gateway.process_payment.assert_not_called()
+    assert database.get_payment_intent(intent['id'])['status'] == 'failed'
+
+
+def test_attempted_intents_never_expire():
+    _, intent = queue_patron_fees('123456', 'key-1', describe_fee_items, as_of=NOW, expires_in=60)
+    process_outbox_batch(_gateway(RuntimeError('timeout')), now=NOW)
+
+    expired = NOW + timedelta(seconds=61)
+    assert database.expire_payment_intents(expired) == 0
+    assert database.get_payment_intent(intent['id'])['status'] == 'pending'
+    assert patron_outstanding_fees('123456', as_of=expired) == []
@@ -0,0 +1,142 @@
+import pstats
+import tracemalloc
+
+import pytest
+
+import database
+import profiling
+
+TOKEN = 's3cret'
+
+
+@pytest.fixture
+def profiled_client(tmp_path, monkeypatch):
+    """Test client with profiling on, writing profiles to a temporary directory."""
+    monkeypatch.setattr(profiling, 'PROFILE_TOKEN', TOKEN)
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(profiling, 'PROFILE_SAMPLE_RATES', {})
+    from app import create_app
+
+    app = create_app()
+    app.config['TESTING'] = True
+    database.insert_book('Profiled Book', 'Author', '1234567890123', 2, 2)
+    database.clear_book_cache()
+    with app.test_client() as test_client:
+        yield test_client
+
+
+def _profile(client, path, **headers):
+    return client.get(path, headers={profiling.TOKEN_HEADER: TOKEN, **headers})
+
+
+def test_token_header_profiles_the_request(profiled_client, tmp_path):
+    response = _profile(profiled_client, '/api/search?q=Profiled&type=title')
+
+    profile_id = response.headers[profiling.ID_HEADER]
+    summary = profiling.get_profile(profile_id)
+    assert response.status_code == 200
+    assert summary['endpoint'] == 'api.search_books_api'
+    assert summary['path'] == '/api/search?q=Profiled&type=title'
+    assert summary['trigger'] == 'header'
+    assert summary['files'] == [f'{profile_id}.pstats']
+    assert any('search_books_in_catalog' in entry['function'] for entry in summary['functions'])
+    assert 'memory' not in summary
+    stats = pstats.Stats(str(tmp_path / f'{profile_id}.pstats'))
+    assert any(func[2] == 'search_books_in_catalog' for func in stats.stats)
+
+
+def test_requests_without_the_token_are_not_profiled(profiled_client, tmp_path):
+    assert profiling.ID_HEADER not in profiled_client.get('/catalog').headers
+    assert profiling.ID_HEADER not in profiled_client.get(
+        '/catalog', headers={profiling.TOKEN_HEADER: 'wrong'}).headers
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_memory_header_adds_a_tracemalloc_snapshot(profiled_client, tmp_path):
+    response = _profile(profiled_client, '/catalog', **{profiling.MEMORY_HEADER: '1'})
+
+    summary = profiling.get_profile(response.headers[profiling.ID_HEADER])
+    assert summary['memory']['peak_bytes'] > 0
+    assert summary['memory']['top']
+    snapshot = tracemalloc.Snapshot.load(str(tmp_path / f"{summary['id']}.tracemalloc"))
+    assert snapshot.traces
+    assert not tracemalloc.is_tracing()
+
+
+def test_sample_rates_pick_endpoints(profiled_client, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_SAMPLE_RATES', {'search.search_books': 1.0})
+
+    sampled = profiled_client.get('/search?q=Profiled&type=title')
+    skipped = profiled_client.get('/catalog')
+
+    assert profiling.get_profile(sampled.headers[profiling.ID_HEADER])['trigger'] == 'sample'
+    assert profiling.ID_HEADER not in skipped.headers
+
+
+def test_only_one_request_is_profiled_at_a_time(profiled_client):
+    with profiling._lock:
+        response = _profile(profiled_client, '/catalog')
+
+    assert response.status_code == 200
+    assert profiling.ID_HEADER not in response.headers
+    assert profiling.ID_HEADER in _profile(profiled_client, '/catalog').headers
+
+
+def test_oldest_profiles_are_pruned(profiled_client, tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_KEEP', 2)
+    ids = [_profile(profiled_client, '/catalog').headers[profiling.ID_HEADER] for _ in range(3)]
+
+    assert [summary['id'] for summary in profiling.list_profiles()] == ids[:0:-1]
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(
+        f'{profile_id}{suffix}' for profile_id in ids[1:] for suffix in ('.json', '.pstats'))
+
+
+def test_profile_index_requires_the_token(profiled_client):
+    profile_id = _profile(profiled_client, '/catalog').headers[profiling.ID_HEADER]
+
+    assert profiled_client.get('/profiles').status_code == 403
+    assert profiled_client.get(f'/profiles/files/{profile_id}.pstats').status_code == 403
+
+    index = _profile(profiled_client, '/profiles')
+    assert profiling.ID_HEADER not in index.headers
+    [entry] = index.get_json()['profiles']
+    assert entry['id'] == profile_id
+    assert 'functions' not in entry
+
+    detail = _profile(profiled_client, entry['url']).get_json()
+    assert detail['functions']
+    download = _profile(profiled_client, entry['files'][0])
+    assert download.status_code == 200
+    assert download.headers['Content-Disposition'].startswith('attachment')
+    assert _profile(profiled_client, '/profiles/no-such-profile').status_code == 404
+    assert _profile(profiled_client, f'/profiles/files/{profile_id}.json').status_code == 404
+
+
+def test_sampling_without_a_token_hides_the_profile_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_TOKEN', None)
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(profiling, 'PROFILE_SAMPLE_RATES', {'catalog.catalog': 1.0})
+    from app import create_app
+
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        profile_id = client.get('/catalog').headers[profiling.ID_HEADER]
+
+        assert (tmp_path / f'{profile_id}.pstats').exists()
+        assert client.get('/profiles').status_code == 404
+        assert client.get('/profiles', headers={profiling.TOKEN_HEADER: ''}).status_code == 404
+        assert client.get(f'/profiles/files/{profile_id}.pstats').status_code == 404
+
+
+def test_invalid_sample_rates_are_rejected():
+    assert profiling.parse_sample_rates('search.search_books=0.05, *=0.001') == {
+        'search.search_books': 0.05, '*': 0.001}
+    for spec in ('search.search_books', 'search.search_books=2', '=0.5', 'x=fast'):
+        with pytest.raises(ValueError):
+            profiling.parse_sample_rates(spec)
+
+
+def test_profiling_routes_are_off_by_default(client):
+    assert not profiling.profiling_enabled()
+    assert client.get('/profiles').status_code == 404
@@ -0,0 +1,56 @@
+import pytest
+
+import database
+import services.library_service as ls
+
+
+@pytest.fixture(autouse=True)
+def catalog():
+    ls.add_book_to_catalog("The Great Gatsby", "F. Scott Fitzgerald", "9780743273565", 3)
+    ls.add_book_to_catalog("1984", "George Orwell", "9780451524935", 1)
+
+
+def _titles(results):
+    return [book['title'] for book in results]
+
+
+def test_repeat_search_is_served_from_cache(mocker):
+    scan = mocker.spy(ls, '_search_books')
+    before = ls.get_search_cache_stats()
+    first = ls.search_books_in_catalog('gatsby', 'title')
+    second = ls.search_books_in_catalog('  GATSBY ', 'title')
+    assert _titles(first) == _titles(second) == ['The Great Gatsby']
+    assert scan.call_count == 1
+    stats = ls.get_search_cache_stats()
+    assert stats['hits'] - before['hits'] == 1
+    assert stats['misses'] - before['misses'] == 1
+    assert 0 < stats['hit_rate'] <= 1
+
+
+def test_key_includes_type_mode_and_page(mocker):
+    scan = mocker.spy(ls, '_search_books')
+    ls.search_books_in_catalog('george', 'author')
+    ls.search_books_in_catalog('george', 'title')
+    ls.search_books_in_catalog('george', 'author', mode='trigram')
+    ls.search_books_in_catalog('george', 'author', limit=1)
+    assert scan.call_count == 4
+
+
+def test_new_book_invalidates_results():
+    assert ls.search_books_in_catalog('brave', 'title') == []
+    ls.add_book_to_catalog('Brave New World', 'Aldous Huxley', '9780060850524', 1)
+    assert _titles(ls.search_books_in_catalog('brave', 'title')) == ['Brave New World']
+
+
+def test_borrow_and_return_refresh_availability():
+    before = ls.search_books_in_catalog('gatsby', 'title')[0]['available_copies']
+    book_id = database.get_book_by_isbn('9780743273565')['id']
+    assert ls.borrow_book_by_patron('654321', book_id)[0]
+    assert ls.search_books_in_catalog('gatsby', 'title')[0]['available_copies'] == before - 1
+    assert ls.return_book_by_patron('654321', book_id)[0]
+    assert ls.search_books_in_catalog('gatsby', 'title')[0]['available_copies'] == before
+
+
+def test_callers_cannot_corrupt_cached_results():
+    ls.search_books_in_catalog('gatsby', 'title')[0]['title'] = 'Changed'
+    assert _titles(ls.search_books_in_catalog('gatsby', 'title')) == ['The Great Gatsby']
@@ -0,0 +1,94 @@
+import pytest
+
+import database
+import services.library_service as ls
+
+
+@pytest.fixture(autouse=True)
+def catalog():
+    ls.add_book_to_catalog("The Great Gatsby", "F. Scott Fitzgerald", "9780743273565", 3)
+    ls.add_book_to_catalog("Great Expectations", "Charles Dickens", "9780141439563", 2)
+    ls.add_book_to_catalog("1984", "George Orwell", "9780451524935", 1)
+
+
+def _titles(results):
+    return [book['title'] for book in results]
+
+
+def test_fts_prefix_match_on_title():
+    assert _titles(ls.search_books_in_catalog("gat", "title", mode="fts")) == ["The Great Gatsby"]
+    assert _titles(ls.search_books_in_catalog("GREAT", "title", mode="fts")) == [
+        "Great Expectations", "The Great Gatsby"
+    ]
+
+
+def test_fts_all_words_must_match():
+    assert _titles(ls.search_books_in_catalog("great exp", "title", mode="fts")) == ["Great Expectations"]
+    assert ls.search_books_in_catalog("great orwell", "title", mode="fts") == []
+
+
+def test_fts_author_search_is_column_scoped():
+    assert _titles(ls.search_books_in_catalog("orw", "author", mode="fts")) == ["1984"]
+    assert ls.search_books_in_catalog("gatsby", "author", mode="fts") == []
+
+
+def test_fts_results_match_search_result_shape():
+    result = ls.search_books_in_catalog("1984", "title", mode="fts")[0]
+    assert set(result) == {'id', 'title', 'author', 'isbn', 'available_copies', 'total_copies'}
+
+
+def test_fts_tracks_inserts_updates_and_deletes():
+    ls.add_book_to_catalog("Brave New World", "Aldous Huxley", "9780060850524", 1)
+    assert _titles(ls.search_books_in_catalog("brave", "title", mode="fts")) == ["Brave New World"]
+
+    conn = database.get_db_connection()
+    conn.execute("UPDATE books SET title = 'Island' WHERE isbn = '9780060850524'")
+    conn.commit()
+    conn.close()
+    database.clear_book_cache()  # raw SQL bypasses the helpers that bump the catalog version
+    assert ls.search_books_in_catalog("brave", "title", mode="fts") == []
+    assert _titles(ls.search_books_in_catalog("isl", "title", mode="fts")) == ["Island"]
+
+    conn = database.get_db_connection()
+    conn.execute("DELETE FROM books WHERE isbn = '9780060850524'")
+    conn.commit()
+    conn.close()
+    database.clear_book_cache()  # raw SQL bypasses the helpers that bump the catalog version
+    assert ls.search_books_in_catalog("isl", "title", mode="fts") == []
+
+
+def test_fts_sees_availability_changes():
+    book = database.get_book_by_isbn("9780451524935")
+    database.update_book_availability(book['id'], -1)
+    result = ls.search_books_in_catalog("1984", "title", mode="fts")
+    assert result[0]['available_copies'] == 0
+
+
+def test_substring_mode_keeps_mid_word_matching():
+    assert ls.search_books_in_catalog("atsb", "title", mode="fts") == []
+    assert _titles(ls.search_books_in_catalog("atsb", "title", mode="substring")) == ["The Great Gatsby"]
+
+
+def test_default_mode_comes_from_config(monkeypatch):
+    monkeypatch.setattr(ls, 'SEARCH_MODE', 'fts')
+    assert ls.search_books_in_catalog("atsb", "title") == []
+    monkeypatch.setattr(ls, 'SEARCH_MODE', 'substring')
+    assert _titles(ls.search_books_in_catalog("atsb", "title")) == ["The Great Gatsby"]
+
+
+def test_unknown_mode_returns_no_results():
+    assert ls.search_books_in_catalog("great", "title", mode="regex") == []
+
+
+def test_fts_falls_back_to_substring_without_index():
+    conn = database.get_db_connection()
+    conn.execute('DROP TABLE books_fts')
+    conn.commit()
+    conn.close()
+    assert database.search_books_fulltext("gat", "title") is None
+    assert _titles(ls.search_books_in_catalog("atsb", "title", mode="fts")) == ["The Great Gatsby"]
+
+
+def test_fts_isbn_search_stays_exact():
+    assert len(ls.search_books_in_catalog("9780451524935", "isbn", mode="fts")) == 1
+    assert ls.search_books_in_catalog("978045152493", "isbn", mode="fts") == []
@@ -0,0 +1,115 @@
+import sqlite3
+
+import pytest
+
+import database
+import services.library_service as ls
+from services.search_index import TrigramIndex, trigrams
+
+
+@pytest.fixture(autouse=True)
+def fresh_index(monkeypatch):
+    monkeypatch.setattr(ls, '_search_index', None)
+    ls.add_book_to_catalog("The Great Gatsby", "F. Scott Fitzgerald", "9780743273565", 3)
+    ls.add_book_to_catalog("To Kill a Mockingbird", "Harper Lee", "9780061120084", 2)
+    ls.add_book_to_catalog("1984", "George Orwell", "9780451524935", 1)
+
+
+def _titles(results):
+    return [book['title'] for book in results]
+
+
+def test_trigrams_of_short_and_long_text():
+    assert trigrams("ab") == set()
+    assert trigrams("abcd") == {"abc", "bcd"}
+
+
+def test_index_finds_mid_word_substrings():
+    index = TrigramIndex()
+    index.add({'id': 1, 'title': 'The Great Gatsby', 'author': 'F. Scott Fitzgerald'})
+    index.add({'id': 2, 'title': 'Gateway', 'author': 'Frederik Pohl'})
+    assert index.search('atsb', 'title') == [1]
+    assert sorted(index.search('GAT', 'title')) == [1, 2]
+    assert index.search('zzz', 'title') == []
+    assert index.search('po', 'author') == [2]
+
+
+def test_index_rejects_trigram_false_positives():
+    index = TrigramIndex()
+    index.add({'id': 1, 'title': 'abcxbcd', 'author': 'x'})
+    # every trigram of "abcd" appears, but not the substring itself
+    assert index.search('abcd', 'title') == []
+
+
+@pytest.mark.parametrize('term, search_type', [
+    ("atsb", "title"), ("the", "title"), ("KILL", "title"), ("o", "title"),
+    ("orwell", "author"), ("ee", "author"), ("nobody", "author"),
+])
+def test_trigram_mode_matches_substring_mode(term, search_type):
+    assert ls.search_books_in_catalog(term, search_type, mode="trigram") == \
+        ls.search_books_in_catalog(term, search_type, mode="substring")
+
+
+def test_index_is_built_once_and_updated_on_add():
+    index = ls.get_search_index()
+    assert len(index) == 3
+    ls.add_book_to_catalog("Gatsby Returns", "Anon", "1234567890123", 1)
+    assert ls.get_search_index() is index
+    assert _titles(ls.search_books_in_catalog("atsb", "title", mode="trigram")) == [
+        "Gatsby Returns", "The Great Gatsby"
+    ]
+
+
+def test_failed_add_leaves_index_unchanged():
+    index = ls.get_search_index()
+    ok, _ = ls.add_book_to_catalog("Dup", "Anon", "9780451524935", 1)
+    assert ok is False
+    assert len(index) == 3
+
+
+def test_memory_usage_report():
+    usage = ls.get_search_index().memory_usage()
+    assert usage['books'] == 3
+    assert usage['trigrams'] > 0
+    assert usage['total_bytes'] == usage['postings_bytes'] + usage['text_bytes'] > 0
+
+
+def test_books_written_by_another_connection_are_picked_up():
+    index = ls.get_search_index()
+    conn = sqlite3.connect(database.DATABASE)
+    conn.execute("INSERT INTO books (title, author, isbn, total_copies, available_copies) "
+                 "VALUES ('Gatsby Elsewhere', 'Anon', '1234567890123', 1, 1)")
+    conn.commit()
+
+    assert _titles(ls.search_books_in_catalog("atsb", "title", mode="trigram")) == [
+        "Gatsby Elsewhere", "The Great Gatsby"]
+    assert ls.get_search_index() is index
+
+    conn.execute("UPDATE books SET title = 'The Great Gadsby' WHERE isbn = '9780743273565'")
+    conn.commit()
+    conn.close()
+
+    assert _titles(ls.search_books_in_catalog("atsb", "title", mode="trigram")) == ["Gatsby Elsewhere"]
+    assert ls.get_search_index() is not index
+
+
+def test_availability_changes_do_not_rebuild_the_index():
+    index = ls.get_search_index()
+    book = database.get_book_by_isbn("9780743273565")
+    assert ls.borrow_book_by_patron("123456", book['id'])[0]
+    assert ls.get_search_index() is index
+
+
+def test_trigram_pages_load_only_the_page(monkeypatch):
+    for i in range(20):
+        ls.add_book_to_catalog(f"Volume {i:02d}", "Anon", f"{1000000000000 + i}", 1)
+    loaded = []
+    real = ls.get_books_by_ids
+    monkeypatch.setattr(ls, 'get_books_by_ids', lambda ids: loaded.append(list(ids)) or real(ids))
+
+    first = ls.search_books_in_catalog("volume", "title", mode="trigram", limit=5)
+    second = ls.search_books_in_catalog("volume", "title", mode="trigram", limit=5,
+                                        after=(first[-1]['title'], first[-1]['id']))
+
+    assert _titles(first + second) == [f"Volume {i:02d}" for i in range(10)]
+    assert [len(ids) for ids in loaded] == [5, 5]
@@ -0,0 +1,109 @@
+import logging
+import time
+
+import pytest
+
+import database
+import sql_trace
+from services.library_service import borrow_book_by_patron, get_patron_status_report
+
+
+@pytest.fixture
+def tracing(monkeypatch):
+    """Trace every helper call and log every statement (threshold 0 ms)."""
+    monkeypatch.setattr(sql_trace, 'SLOW_QUERY_MS', 0.0)
+    monkeypatch.setattr(sql_trace, 'SAMPLE_RATE', 1.0)
+    sql_trace.clear_slow_queries()
+    yield
+    sql_trace.clear_slow_queries()
+
+
+def _add_book(isbn='1234567890123'):
+    database.insert_book('Traced Book', 'Author', isbn, 2, 2)
+    return database.get_book_by_isbn(isbn)['id']
+
+
+def test_statements_are_logged_with_parameters_caller_and_plan(tracing, caplog):
+    book_id = _add_book()
+    sql_trace.clear_slow_queries()
+
+    with caplog.at_level(logging.WARNING, logger='sql_trace'):
+        success, _ = borrow_book_by_patron('654321', book_id)
+
+    assert success
+    entries = sql_trace.get_slow_queries()
+    assert {entry['helper'] for entry in entries} == {'database.borrow_book_atomic'}
+    assert {entry['caller'] for entry in entries} == {'services.library_service.borrow_book_by_patron'}
+    lookup = next(entry for entry in entries if entry['statement'].startswith('SELECT open_loans'))
+    assert "'654321'" in lookup['statement']
+    assert any('USING INDEX' in line for line in lookup['plan'])
+    assert any(entry['statement'] == 'COMMIT' and entry['plan'] == [] for entry in entries)
+    assert any('Slow SQL' in record.getMessage() and "'654321'" in record.getMessage()
+               for record in caplog.records)
+
+
+def test_nested_helpers_belong_to_the_outer_call(tracing):
+    _add_book()
+    sql_trace.clear_slow_queries()
+
+    get_patron_status_report('654321')
+
+    assert {entry['caller'] for entry in sql_trace.get_slow_queries()} == {
+        'services.library_service.get_patron_status_report'}
+
+
+def test_fast_statements_are_not_logged(tracing, monkeypatch):
+    monkeypatch.setattr(sql_trace, 'SLOW_QUERY_MS', 10_000.0)
+    book_id = _add_book()
+    borrow_book_by_patron('654321', book_id)
+
+    assert sql_trace.get_slow_queries() == []
+
+
+def test_unsampled_calls_are_not_traced(tracing, monkeypatch):
+    monkeypatch.setattr(sql_trace, 'SAMPLE_RATE', 0.0)
+    book_id = _add_book()
+    borrow_book_by_patron('654321', book_id)
+
+    assert sql_trace.get_slow_queries() == []
+
+
+def test_trace_callback_is_detached_when_the_connection_is_released(tracing):
+    _add_book()
+    database.get_patron_borrow_count('654321')
+
+    conn = database.get_db_connection()
+    try:
+        assert not conn.traced
+    finally:
+        conn.close()
+
+
+def test_generator_helpers_exclude_the_consumers_time(tracing, monkeypatch):
+    monkeypatch.setattr(sql_trace, 'SLOW_QUERY_MS', 50.0)
+    for i in range(3):
+        _add_book(f'{1234567890000 + i}')
+    sql_trace.clear_slow_queries()
+
+    for _ in database.iter_all_books(batch_size=1):
+        time.sleep(0.03)
+
+    assert sql_trace.get_slow_queries() == []
+
+
+def test_slow_spans_end_at_the_next_statement(monkeypatch):
+    ticks = iter([0.0, 0.0, 0.005, 0.006, 0.025, 0.030])
+    monkeypatch.setattr(sql_trace, '_clock', lambda: next(ticks))
+    trace = sql_trace._Trace('database.helper', 'services.caller', 10)
+
+    trace.statement('SELECT 1')      # 0.000
+    trace.statement('SELECT 2')      # 0.005: SELECT 1 took 5 ms
+    trace.statement('SELECT 2')      # 0.006: a trigger step of the same statement
+    trace.statement('COMMIT')        # 0.025: SELECT 2 took 20 ms
+    trace.finish()                   # 0.030
+
+    assert trace.slow == [{'statement': 'SELECT 2', 'ms': 20.0, 'executions': 2}]
+
+
+def test_explain_reports_errors_instead_of_raising():
+    assert sql_trace.explain('SELECT * FROM no_such_table')[0].startswith('(no plan:')